@@ -1,89 +1,362 @@
 #!/usr/bin/env python3
 """
 Standalone PDF to Markdown converter using OpenAI Vision API
-Converts PDF to markdown with rate limiting and page range support
+Converts PDF to markdown with pipelined, concurrent OCR and page range support
 """
 
 import os
+import queue
+import threading
 import time
-import base64
-import gc
-import psutil
 import argparse
-from io import BytesIO
-from pdf2image import convert_from_path
 from openai import OpenAI
 from dotenv import load_dotenv
+from batch_ocr import BatchJob, FixtureBatchRunner, OpenAIBatchRunner, write_batch_files
+from conversion_manifest import ConversionManifest
+from page_cache import PageCache, PAGE_CACHE_ENABLED
+from upload_store import sha256_file
+from embedded_images import extract_page_jpeg
+from ocr_engines import PageSource, build_chain, needs_client, run_chain
+from page_dedup import PAGE_DEDUP_ENABLED, PageDeduplicator
+from page_render import RENDER_DPI, iter_rendered_pages, page_count, render_engine
+from rate_limiter import limiter_for
+from text_layer import TEXT_LAYER_ENABLED, try_text_layer
+from vision_ocr import OCR_MAX_TOKENS, OCR_MODEL
+import usage_ledger
 
-def get_memory_usage():
-    """Get current memory usage in MB"""
-    process = psutil.Process(os.getpid())
-    return process.memory_info().rss / 1024 / 1024
 
-def check_memory_limit(limit_mb=2048):
-    """Check if memory usage exceeds limit"""
-    current_memory = get_memory_usage()
-    if current_memory > limit_mb:
-        print(f"⚠️  Memory usage: {current_memory:.1f}MB (limit: {limit_mb}MB)")
-        return True
-    return False
+# OCR calls running at the same time; pages waiting between stages are bounded by this too
+CONVERT_CONCURRENCY = int(os.getenv('CONVERT_CONCURRENCY', '4'))
+
+_DONE = object()
+
+def check_duplicate(dedup, page):
+    """Run a page past the deduplicator: (None|'blank'|'duplicate', earlier page it repeats)"""
+    embedded = page.embedded()
+    if embedded is not None:
+        # Compared by its bytes and decoded at thumbnail size rather than in full
+        return dedup.check(page.page_number, embedded.to_pil(), embedded.data)
+    return dedup.check(page.page_number, page.image())
+
+def skipped_result(page_num, skipped, duplicate_of, outputs):
+    """Result for a page that was not OCRed: blank, or a copy of the earlier page's result in outputs"""
+    result = {'page': page_num, 'status': 'ok', 'skipped': skipped, 'markdown': ''}
+    if skipped == 'duplicate':
+        result['duplicate_of'] = duplicate_of
+        if duplicate_of in outputs:
+            result['markdown'] = outputs[duplicate_of]['markdown']
+            if outputs[duplicate_of].get('fallback'):
+                result['fallback'] = True
+        else:
+            result.update(status='error', error=f"Duplicate of page {duplicate_of}, which failed")
+    return result
+
+def budget_error(usage_run):
+    return f"Budget of ${usage_run.budget:g} reached (projected ${usage_run.projected():.4f}), page not converted"
+
+def ocr_pipeline(pdf_path, page_numbers, embedded_pages, chain, client, concurrency, dedup=None, usage_run=None):
+    """Yield (page_num, result, engine) for each page in page order.
+
+    Stages run at the same time: pages are rendered in a background thread,
+    encoded by a prepare thread, converted by `concurrency` OCR workers and
+    handed back here in order. A page takes a slot of a fixed window from when
+    it is prepared until it has been yielded, so at most `concurrency * 2`
+    encoded pages (plus RENDER_AHEAD rendered images) exist at once however
+    slow a single page is.
+
+    With a PageDeduplicator, blank pages and repeats of an earlier page skip
+    OCR: they are yielded with engine None and result['skipped'] set, a
+    repeat carrying the markdown of the page it repeats.
+
+    Once usage_run is over its budget, pages that have not started OCR fail
+    with a budget error instead.
+    """
+    window = threading.BoundedSemaphore(concurrency * 2)
+    ocr_queue = queue.Queue(maxsize=concurrency)
+    done_queue = queue.Queue()
+    stop = threading.Event()
+
+    def _put(target, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _prepare():
+        rendered_pages = iter_rendered_pages(pdf_path, [page_num for page_num in page_numbers
+                                                        if page_num not in embedded_pages], RENDER_DPI)
+        try:
+            for page_num in page_numbers:
+                while not window.acquire(timeout=0.5):
+                    if stop.is_set():
+                        return
+                page = None
+                try:
+                    if page_num in embedded_pages:
+                        # Scanned pages that are a single JPEG are sent as that JPEG, never rendered
+                        image, error = None, None
+                    else:
+                        _, image, error = next(rendered_pages)
+                    if error is None:
+                        # The vision engine grayscales, trims, clamps and compresses a rendered page
+                        # before base64 encoding; an embedded JPEG is sent as is
+                        page = PageSource(pdf_path, page_num, RENDER_DPI, image=image,
+                                          embedded=None if page_num in embedded_pages else False)
+                        del image
+                        skipped, duplicate_of = check_duplicate(dedup, page) if dedup else (None, None)
+                        if skipped:
+                            # Resolved against the earlier page's output when yielded
+                            done_queue.put((page_num, (skipped, duplicate_of), None))
+                            continue
+                        if chain[0].name == 'vision':
+                            page.vision_payload()
+                            page.release_image()
+                except Exception as e:
+                    page, error = None, e
+                if not _put(ocr_queue, (page_num, page, error)):
+                    return
+        finally:
+            rendered_pages.close()
+            for _ in range(concurrency):
+                _put(ocr_queue, _DONE)
+
+    def _ocr_worker():
+        while not stop.is_set():
+            try:
+                item = ocr_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            page_num, page, error = item
+            result = {'page': page_num}
+            engine = None
+            if error is not None:
+                result.update(status='error', error=f"No image generated: {error}")
+            elif usage_run and usage_run.over_budget():
+                result.update(status='error', error=budget_error(usage_run))
+            else:
+                try:
+                    print(f"Processing page {page_num}...")
+                    engine = run_chain(chain, page, client, result)
+                except Exception as e:
+                    result.update(status='error', error=str(e))
+            done_queue.put((page_num, result, engine))
+
+    threads = [threading.Thread(target=_prepare, name='convert-prepare', daemon=True)]
+    threads += [threading.Thread(target=_ocr_worker, name=f'convert-ocr-{index}', daemon=True)
+                for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    finished = {}
+    # Results of pages OCRed so far, for the pages that repeat them
+    outputs = {}
+    try:
+        for page_num in page_numbers:
+            # Later pages may finish first; hold them until this one is ready
+            while page_num not in finished:
+                done_page, result, engine = done_queue.get()
+                finished[done_page] = (result, engine)
+            result, engine = finished.pop(page_num)
+            if isinstance(result, tuple):
+                result = skipped_result(page_num, *result, outputs)
+            elif engine is not None and dedup:
+                outputs[page_num] = result
+            yield page_num, result, engine
+            window.release()
+    finally:
+        stop.set()
+
+def batch_pipeline(pdf_path, page_numbers, embedded_pages, engine, runner, pdf_digest, state_path, dedup=None,
+                   usage_run=None):
+    """Yield (page_num, result, engine) for each page in page order, converted through the Batch API.
+
+    All pages are rendered and encoded first and written to JSONL batch
+    files, which are submitted and polled until they finish. A job submitted
+    by an earlier, interrupted run for the same pages is polled again
+    instead of being submitted twice. Pages the deduplicator skips are left
+    out of the batch and yielded as in ocr_pipeline. Pages whose estimated
+    cost would take usage_run over its budget are left out and fail.
+    """
+    job = BatchJob.load(state_path, runner, pdf_digest, page_numbers)
+    failed = {}
+    encoding = {}
+    skipped = {}
+    reserved = []
+    if job is None:
+        def _payloads():
+            rendered_pages = iter_rendered_pages(pdf_path, [page_num for page_num in page_numbers
+                                                            if page_num not in embedded_pages], RENDER_DPI)
+            try:
+                for page_num in page_numbers:
+                    image, error = (None, None) if page_num in embedded_pages else next(rendered_pages)[1:]
+                    try:
+                        if error is not None:
+                            raise error
+                        page = PageSource(pdf_path, page_num, RENDER_DPI, image=image,
+                                          embedded=None if page_num in embedded_pages else False)
+                        del image
+                        kind, duplicate_of = check_duplicate(dedup, page) if dedup else (None, None)
+                        if kind:
+                            skipped[page_num] = (kind, duplicate_of)
+                            continue
+                        img_base64, mime_type, encoding[page_num] = page.vision_payload()
+                    except Exception as e:
+                        failed[page_num] = f"No image generated: {e}"
+                        continue
+                    if usage_run:
+                        if usage_run.over_budget():
+                            failed[page_num] = budget_error(usage_run)
+                            continue
+                        # Held against the budget until the batch's real usage is recorded
+                        estimate = usage_ledger.cost_of(OCR_MODEL, encoding[page_num]['estimated_tokens'],
+                                                        OCR_MAX_TOKENS, batch=True)
+                        usage_run.reserve(estimate)
+                        reserved.append(estimate)
+                    yield page_num, img_base64, mime_type
+            finally:
+                rendered_pages.close()
+
+        print(f"Rendering and encoding {len(page_numbers)} page(s) for the batch...")
+        job = BatchJob(state_path, runner, pdf_digest, page_numbers, skipped=skipped)
+        job.submit(write_batch_files(os.path.splitext(state_path)[0], _payloads()))
+    else:
+        print(f"Resuming batch job from {state_path}: {', '.join(batch['id'] for batch in job.batches)}")
+
+    job.wait()
+    results = job.results()
+    for estimate in reserved:
+        usage_run.release(estimate)
+    document = os.path.basename(pdf_path)
+    for page_num in page_numbers:
+        if page_num in results and results[page_num]['status'] == 'ok':
+            usage_ledger.record(OCR_MODEL, results[page_num]['usage'], batch=True,
+                                image_tokens=encoding.get(page_num, {}).get('estimated_tokens', 0),
+                                tags={'document': document, 'page': page_num})
+    outputs = {page_num: result for page_num, result in results.items() if result['status'] == 'ok'}
+    for page_num in page_numbers:
+        if page_num in job.skipped:
+            yield page_num, skipped_result(page_num, *job.skipped[page_num], outputs), None
+            continue
+        result = results.get(page_num) or {'page': page_num, 'status': 'error',
+                                           'error': failed.get(page_num, 'Page was not submitted')}
+        if page_num in encoding:
+            result['encoding'] = encoding[page_num]
+        yield page_num, result, engine if result['status'] == 'ok' else None
+    # Every page was handed over (and checkpointed by the caller), the batch files are no longer needed
+    job.discard()
+
+def convert_pdf_to_markdown(pdf_path, output_path=None, delay_seconds=0, start_page=None, end_page=None, use_cache=True,
+                            use_text_layer=TEXT_LAYER_ENABLED, engines=None, offline=None,
+                            concurrency=CONVERT_CONCURRENCY, resume=False, batch=False, batch_fixture=None,
+                            dedup=PAGE_DEDUP_ENABLED, budget=None):
+    """Convert PDF to markdown using OpenAI Vision API.
+
+    engines is a comma separated OCR engine chain (default OCR_ENGINES); with
+    offline=True only local engines are used and no API key is needed. Up to
+    `concurrency` pages are OCRed at once. API calls run as fast as the
+    account's rate limits allow (see rate_limiter); delay_seconds adds a
+    minimum spacing between their starts.
 
-def convert_pdf_to_markdown(pdf_path, output_path=None, delay_seconds=10, start_page=None, end_page=None):
-    """Convert PDF to markdown using OpenAI Vision API with rate limiting"""
+    Progress is checkpointed in <output>.manifest.json after every page; with
+    resume=True pages finished by an earlier run are kept and only failed or
+    missing pages are converted.
+
+    With batch=True pages needing vision OCR go through the Batch API
+    instead of interactive calls; batch_fixture replays recorded batch output
+    instead of calling the API.
+
+    With dedup=True blank pages are left empty and a page identical to an
+    earlier one (or, with PAGE_DEDUP_NEAR, one that looks the same) gets that
+    page's markdown instead of its own OCR call.
+
+    Every API call is recorded in the usage ledger. With a budget (USD) no
+    new page is sent once the projected spend exceeds it; those pages fail
+    and --resume picks them up.
+    """
     
     if not os.path.exists(pdf_path):
         print(f"Error: PDF file not found: {pdf_path}")
         return False
+
+    try:
+        chain = build_chain(engines, offline)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return False
+    print(f"OCR engines: {' -> '.join(engine.name for engine in chain)}")
+    batch = batch or bool(batch_fixture)
+    if batch and chain[0].name != 'vision':
+        print("Error: batch mode sends pages to the vision engine, it must come first in the chain")
+        return False
     
     # Load environment variables
     load_dotenv()
     openai_api_key = os.environ.get('OPENAI_API_KEY')
-    if not openai_api_key:
+    if needs_client(chain) and not openai_api_key and not batch_fixture:
         print("Error: OPENAI_API_KEY environment variable not set")
         return False
     
     print(f"Converting PDF: {pdf_path}")
     if start_page or end_page:
         print(f"Page range: {start_page or 1} to {end_page or 'end'}")
-    print(f"Rate limiting: {delay_seconds} seconds between pages")
-    print(f"Initial memory usage: {get_memory_usage():.1f}MB")
+    if delay_seconds:
+        limiter_for(OCR_MODEL).min_interval = delay_seconds
+    print(f"Concurrency: {concurrency} page(s) at a time, paced by the API rate limits" +
+          (f", calls at least {delay_seconds} seconds apart" if delay_seconds else ""))
     
     try:
-        # Get total page count first
-        print("Getting PDF page count...")
-        temp_images = convert_from_path(pdf_path, dpi=150, first_page=1, last_page=1)
-        if not temp_images:
-            print("Error: Cannot read PDF file")
-            return False
-        del temp_images
-        gc.collect()
-        
-        # Get actual page count using a more memory-efficient method
-        from PyPDF2 import PdfReader
+        started = time.time()
+        # Opening the document is enough to check it is readable, no page is rendered
         try:
-            reader = PdfReader(pdf_path)
-            total_pages = len(reader.pages)
-            del reader
-            gc.collect()
-        except:
-            # Fallback: process in small batches to estimate
-            total_pages = 999  # Will process until error
+            total_pages = page_count(pdf_path)
+        except Exception as e:
+            print(f"Error: Cannot read PDF file: {e}")
+            return False
         
-        print(f"Processing PDF with estimated {total_pages} pages")
+        print(f"Processing PDF with {total_pages} pages (rendering with {render_engine()})")
         
-        # Initialize OpenAI client
-        client = OpenAI(api_key=openai_api_key)
+        # Initialize OpenAI client (thread safe, shared by the OCR workers)
+        client = OpenAI(api_key=openai_api_key) if needs_client(chain) and openai_api_key else None
+
+        # Pages converted before (by this script or the Flask service, both at RENDER_DPI) come from the cache,
+        # under the key of the first engine in the chain
+        page_cache = PageCache() if use_cache and PAGE_CACHE_ENABLED else None
+        pdf_digest = sha256_file(pdf_path)
+        cache_model, cache_prompt_hash = chain[0].cache_key()
+        engine_pages = {}
         
         # Determine output file path early
         if not output_path:
             base_name = os.path.splitext(os.path.basename(pdf_path))[0]
             output_path = f"{base_name}.md"
         
-        # Create/clear the output file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write("")  # Start with empty file
+        manifest = None
+        if resume:
+            try:
+                manifest = ConversionManifest.resume(output_path, pdf_path, pdf_digest)
+            except ValueError as e:
+                print(f"Error: {e}")
+                return False
+            if manifest is None:
+                print(f"Nothing to resume for {output_path}, starting from the first page")
+            else:
+                print(f"Resuming {output_path}: {len(manifest.finished_pages())} page(s) done, "
+                      f"{len(manifest.failed_pages())} failed page(s) to retry, "
+                      f"{len(manifest.fallback_pages())} fallback page(s) to try again with the first engine")
+        if manifest is None:
+            # Start with an empty output file and manifest
+            manifest = ConversionManifest.start(output_path, pdf_path, pdf_digest)
+        finished_pages = manifest.finished_pages()
         
         pages_processed = 0
+        encoded_bytes_total = 0
+        text_layer_pages = 0
+        tokens_saved_total = 0
         
         # Determine page range to process
         start = start_page or 1
@@ -95,141 +368,137 @@ def convert_pdf_to_markdown(pdf_path, output_path=None, delay_seconds=10, start_
         
         print(f"Processing pages {start} to {end} (of {total_pages} total)")
         
-        # Process pages one by one to minimize memory usage
-        page_num = start
-        while page_num <= end:
-            try:
-                # Check memory before processing each page
-                if check_memory_limit(1500):  # 1.5GB limit
-                    print("🔄 Running garbage collection...")
-                    gc.collect()
-                    if check_memory_limit(1500):
-                        print("❌ Memory usage too high, stopping conversion")
-                        break
-                
-                print(f"Converting page {page_num}... (Memory: {get_memory_usage():.1f}MB)")
-                
-                # Convert only one page at a time with memory-optimized settings
-                images = convert_from_path(
-                    pdf_path, 
-                    dpi=150,  # Further reduced DPI for memory efficiency
-                    first_page=page_num, 
-                    last_page=page_num,
-                    thread_count=1,  # Single thread to reduce memory
-                    poppler_path=None,  # Use system poppler
-                    grayscale=False,  # Keep color but optimize other settings
-                    size=(None, None),  # No size limit
-                    transparent=False,  # Disable transparency to save memory
-                    single_file=True  # Single file mode
-                )
-                
-                if not images:
-                    print(f"No image generated for page {page_num}")
-                    page_num += 1
+        # Cached pages and usable text layers are resolved up front (text only, nothing is
+        # rendered), so the pipeline only sees the pages that need OCR
+        resolved_pages = {}
+        pending_pages = [page_num for page_num in range(start, end + 1) if page_num not in finished_pages]
+        if len(pending_pages) < end - start + 1:
+            print(f"{end - start + 1 - len(pending_pages)} page(s) already converted, skipping them")
+        for page_num in pending_pages:
+            if page_cache:
+                cached_markdown = page_cache.get(pdf_digest, page_num, RENDER_DPI, cache_model, cache_prompt_hash)
+                if cached_markdown is not None:
+                    resolved_pages[page_num] = (cached_markdown, 'cache', 'served from cache')
                     continue
-                
-                image = images[0]  # Only one image since we're processing one page
-                
-                print(f"Processing page {page_num}...")
-                
-                # Convert PIL image to base64
-                buffered = BytesIO()
-                image.save(buffered, format="PNG", optimize=True)
-                img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                
-                # Clean up memory immediately
-                buffered.close()
-                del images, buffered
-                gc.collect()
-                
-                try:
-                    response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=[
-                            {
-                                "role": "user",
-                                "content": [
-                                    {
-                                        "type": "text",
-                                        "text": "Convert this image to clean markdown text. Extract all text content while preserving structure, formatting, and hierarchy. Use proper markdown syntax for headers, lists, code blocks, and emphasis. If this appears to be an exam question, preserve the question structure and answer choices clearly."
-                                    },
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": f"data:image/png;base64,{img_base64}",
-                                            "detail": "high"
-                                        }
-                                    }
-                                ]
-                            }
-                        ],
-                        max_tokens=4000,
-                        temperature=0.1
-                    )
-                    
-                    # Clean up base64 string immediately after API call
-                    del img_base64
-                    gc.collect()
-                    
-                    page_markdown = response.choices[0].message.content
-                    if page_markdown:
-                        print(f"  ✓ Extracted {len(page_markdown)} characters from page {page_num}")
-                        
-                        # Write immediately to file (append mode)
-                        with open(output_path, 'a', encoding='utf-8') as f:
-                            # Add separator if not first page
-                            if pages_processed > 0:
-                                f.write('\n\n---\n\n')
-                            f.write(f"# Page {page_num}\n\n{page_markdown}")
-                        
-                        pages_processed += 1
-                        print(f"  ✓ Written page {page_num} to {output_path}")
-                    else:
-                        print(f"  ✗ No content extracted from page {page_num}")
-                    
-                    # Rate limiting: wait between API calls
-                    if page_num < end:
-                        print(f"  Waiting {delay_seconds} seconds to avoid rate limiting...")
-                        time.sleep(delay_seconds)
-                        
-                except Exception as e:
-                    print(f"  ✗ Error processing page {page_num}: {e}")
-                    # Clean up on error
-                    if 'img_base64' in locals():
-                        del img_base64
-                    gc.collect()
-                
-                page_num += 1
-                
-            except MemoryError as e:
-                print(f"❌ Memory error on page {page_num}: {e}")
-                print(f"Current memory usage: {get_memory_usage():.1f}MB")
-                print("🔄 Running aggressive garbage collection...")
-                gc.collect()
-                print(f"Memory after cleanup: {get_memory_usage():.1f}MB")
-                if get_memory_usage() > 1000:  # Still high after cleanup
-                    print("❌ Unable to continue due to memory constraints")
-                    break
-                page_num += 1
-                continue
-            except Exception as e:
-                print(f"Error converting page {page_num}: {e}")
-                if "cannot identify image file" in str(e).lower() or page_num > end:
+
+            # Born-digital pages with a good text layer skip rendering and the API call
+            if use_text_layer:
+                text_markdown, text_score = try_text_layer(pdf_path, page_num)
+                if text_markdown is not None:
+                    resolved_pages[page_num] = (text_markdown, 'text-layer',
+                                                f"taken from text layer ({text_score['chars']} chars)")
+                    continue
+                print(f"  Page {page_num}: text layer rejected ({text_score['reason']})")
+
+        vision_pages = [page_num for page_num in pending_pages if page_num not in resolved_pages]
+        print(f"{len(pending_pages) - len(vision_pages)} page(s) from cache/text layer, {len(vision_pages)} page(s) need OCR")
+
+        embedded_pages = {page_num for page_num in vision_pages if extract_page_jpeg(pdf_path, page_num) is not None}
+        if embedded_pages:
+            print(f"{len(embedded_pages)} page(s) are single embedded JPEGs and skip rendering")
+
+        # Blank and repeated pages are spotted as they are rendered, before any OCR call
+        deduplicator = PageDeduplicator() if dedup else None
+        usage_run = usage_ledger.start_run('convert_pdf', budget)
+        if batch and vision_pages:
+            runner = FixtureBatchRunner(batch_fixture) if batch_fixture else OpenAIBatchRunner(client)
+            ocr_results = batch_pipeline(pdf_path, vision_pages, embedded_pages, chain[0], runner, pdf_digest,
+                                         f"{output_path}.batch.json", deduplicator, usage_run)
+        else:
+            # Render, encode and OCR run as overlapping stages; pages come back in page order
+            ocr_results = ocr_pipeline(pdf_path, vision_pages, embedded_pages, chain, client, max(1, concurrency),
+                                       deduplicator, usage_run)
+        try:
+            for page_num in pending_pages:
+                if page_num in resolved_pages:
+                    page_markdown, source, description = resolved_pages.pop(page_num)
+                    manifest.record(page_num, page_markdown, source, cached=source == 'cache')
+                    pages_processed += 1
+                    if source == 'text-layer':
+                        text_layer_pages += 1
+                    print(f"  ✓ Page {page_num} {description}")
+                    continue
+
+                _, result, engine = next(ocr_results)
+                if result.get('skipped') and result['status'] == 'ok':
+                    # Not cached: the page was never OCRed under its own number
+                    manifest.record(page_num, result['markdown'], result['skipped'],
+                                    duplicate_of=result.get('duplicate_of'), fallback=result.get('fallback'))
+                    pages_processed += 1
+                    print(f"  ✓ Page {page_num} " + ("is blank, left empty" if result['skipped'] == 'blank' else
+                                                     f"repeats page {result['duplicate_of']}, reused its markdown"))
+                    continue
+                if engine is None and "cannot identify image file" in result.get('error', '').lower():
                     print(f"Reached end of processing range at page {page_num-1}")
                     break
-                page_num += 1
-                continue
+
+                encoding_stats = result.get('encoding')
+                if encoding_stats:
+                    encoded_bytes_total += encoding_stats['bytes']
+                    tokens_saved_total += encoding_stats['tokens_saved']
+                    source = 'Embedded' if encoding_stats.get('passthrough') else 'Encoded'
+                    print(f"  {source} {encoding_stats['format']} {encoding_stats['final_size']}: "
+                          f"{encoding_stats['bytes'] / 1024:.0f}KB, ~{encoding_stats['estimated_tokens']} image tokens")
+
+                if engine is not None:
+                    page_markdown = result['markdown']
+                    print(f"  ✓ Extracted {len(page_markdown)} characters from page {page_num} ({engine.name})")
+                    engine_pages[engine.name] = engine_pages.get(engine.name, 0) + 1
+
+                    # Append to the file and checkpoint it right away; a fallback engine's text is
+                    # kept but not cached, and --resume tries the first engine again
+                    manifest.record(page_num, page_markdown, engine.name, usage=result.get('usage'),
+                                    fallback=result.get('fallback'))
+                    if page_cache and not result.get('fallback'):
+                        model, engine_prompt_hash = engine.cache_key()
+                        page_cache.put(pdf_digest, page_num, RENDER_DPI, model, engine_prompt_hash, page_markdown)
+
+                    pages_processed += 1
+                    print(f"  ✓ Written page {page_num} to {output_path}")
+                else:
+                    manifest.record_failure(page_num, result['error'])
+                    print(f"  ✗ No content extracted from page {page_num}: {result['error']}")
+            else:
+                # Every page is checkpointed; let the pipeline finish (batch mode then deletes its files)
+                next(ocr_results, None)
+        except KeyboardInterrupt:
+            print(f"Interrupted after {pages_processed} page(s); run again with --resume to continue")
+            return False
+        finally:
+            ocr_results.close()
         
-        if pages_processed == 0:
+        if not manifest.totals()['pages']:
             print("No markdown content extracted from any pages")
             return False
+        if manifest.finalize():
+            print("Retried pages put back in page order")
         
         # Get final file size
         final_size = os.path.getsize(output_path)
+        elapsed = time.time() - started
         
         print(f"✓ Markdown saved to: {output_path}")
         print(f"✓ Total file size: {final_size} bytes")
-        print(f"✓ Successfully processed {pages_processed} pages")
+        print(f"✓ Successfully processed {pages_processed} pages ({text_layer_pages} from the text layer) "
+              f"in {elapsed:.1f}s ({pages_processed / elapsed * 60:.1f} pages/min)")
+        totals = manifest.totals()
+        if totals['failed']:
+            print(f"✗ {totals['failed']} page(s) failed, run again with --resume to retry them")
+        if totals['fallback']:
+            print(f"✗ {totals['fallback']} page(s) came from a fallback OCR engine, "
+                  f"run again with --resume to try the first engine again")
+        print(f"✓ Checkpoint: {manifest.path} ({totals['pages']} pages, "
+              f"{totals['prompt_tokens']} prompt / {totals['completion_tokens']} completion tokens)")
+        print(f"✓ Image payload: {encoded_bytes_total / 1024 / 1024:.1f}MB, ~{tokens_saved_total} image tokens saved by encoding")
+        for line in deduplicator.report() if deduplicator else []:
+            print(f"✓ {line}")
+        for line in usage_ledger.report():
+            print(f"✓ {line}")
+        if engine_pages:
+            print(f"✓ OCR engines used: {', '.join(f'{name}: {count}' for name, count in engine_pages.items())}")
+        if page_cache:
+            stats = page_cache.stats()
+            print(f"✓ Page cache: {stats['hits']} hits, {stats['misses']} misses ({stats['entries']} entries)")
         return True
         
     except Exception as e:
@@ -248,7 +517,11 @@ Examples:
   python convert_pdf_standalone.py document.pdf
   python convert_pdf_standalone.py document.pdf --start 5 --end 10
   python convert_pdf_standalone.py document.pdf --page 7
-  python convert_pdf_standalone.py document.pdf --output output.md --delay 5
+  python convert_pdf_standalone.py document.pdf --output output.md --concurrency 8
+  python convert_pdf_standalone.py document.pdf --concurrency 1 --delay 5
+  python convert_pdf_standalone.py document.pdf --resume
+  python convert_pdf_standalone.py document.pdf --batch
+  python convert_pdf_standalone.py document.pdf --budget 2.50
         """
     )
     
@@ -257,7 +530,23 @@ Examples:
     parser.add_argument("--end", type=int, help="End page number (1-based)")
     parser.add_argument("--page", type=int, help="Single page to convert (shortcut for --start X --end X)")
     parser.add_argument("--output", "-o", help="Output markdown file path")
-    parser.add_argument("--delay", type=int, default=10, help="Delay between API calls in seconds (default: 10)")
+    parser.add_argument("--delay", type=float, default=0, help="Minimum seconds between the start of API calls, on top of rate-limit pacing (default: 0)")
+    parser.add_argument("--concurrency", type=int, default=CONVERT_CONCURRENCY,
+                        help=f"Pages OCRed at the same time (default: {CONVERT_CONCURRENCY})")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the local page cache and call the API for every page")
+    parser.add_argument("--force-ocr", action="store_true", help="Always use OCR, even for pages with a usable text layer")
+    parser.add_argument("--engines", help="Comma separated OCR engines to try in order: vision, tesseract, easyocr, docling (default: OCR_ENGINES)")
+    parser.add_argument("--offline", action="store_true", help="Only use local OCR engines (no API calls)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Send pages through the OpenAI Batch API (batch pricing, results within 24h) instead of one call per page")
+    parser.add_argument("--batch-fixture", metavar="JSONL",
+                        help="Batch mode against a local stand-in that replays recorded batch output lines")
+    parser.add_argument("--budget", type=float, metavar="USD",
+                        help="Stop sending pages once the run's projected API spend exceeds this; --resume continues later")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="OCR every page, including blank pages and repeats of earlier pages")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted conversion: keep pages in the output's manifest, retry failed or missing ones")
     
     args = parser.parse_args()
     
@@ -282,7 +571,17 @@ if __name__ == "__main__":
         output_path=args.output,
         delay_seconds=args.delay,
         start_page=args.start,
-        end_page=args.end
+        end_page=args.end,
+        use_cache=not args.no_cache,
+        use_text_layer=TEXT_LAYER_ENABLED and not args.force_ocr,
+        engines=args.engines,
+        offline=True if args.offline else None,
+        concurrency=args.concurrency,
+        resume=args.resume,
+        batch=args.batch,
+        batch_fixture=args.batch_fixture,
+        dedup=PAGE_DEDUP_ENABLED and not args.no_dedup,
+        budget=args.budget
     )
     
     if success:
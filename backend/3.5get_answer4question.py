@@ -14,6 +14,8 @@ from openai import OpenAI
 import anthropic
 from anthropic import Anthropic
 from dotenv import load_dotenv
+import rate_limiter
+import usage_ledger
 
 
 def load_questions(file_path: str) -> List[Dict[str, Any]]:
@@ -345,7 +347,10 @@ def get_ai_answer_and_explanation_openai(client: OpenAI, question_data: Dict[str
         for attempt in range(num_attempts):
             print(f"  Attempt {attempt + 1}/{num_attempts} for question {question_data.get('question_number', 'unknown')}")
             
-            response = client.chat.completions.create(
+            # Paced by the account's rate limits; 429s are retried with backoff
+            response = rate_limiter.create(
+                client,
+                tags={'question': question_data.get('question_number')},
                 model="gpt-4o",
                 messages=[
                     {
@@ -382,8 +387,9 @@ def get_ai_answer_and_explanation_openai(client: OpenAI, question_data: Dict[str
         return results
     
     except openai.RateLimitError as e:
-        print(f"Rate limit error: {e}")
-        return [("", f"Rate limit exceeded. Please try again later.")]
+        # Keep the attempts that succeeded; nothing is stored for a question with none
+        print(f"Rate limit error after retries: {e}")
+        return results
     except openai.APIError as e:
         print(f"OpenAI API error: {e}")
         return [("", f"API error: {str(e)}")]
@@ -413,7 +419,9 @@ def get_ai_answer_and_explanation_claude(client: Anthropic, question_data: Dict[
         for attempt in range(num_attempts):
             print(f"  Claude attempt {attempt + 1}/{num_attempts} for question {question_data.get('question_number', 'unknown')}")
             
-            response = client.messages.create(
+            response = rate_limiter.create(
+                client,
+                tags={'question': question_data.get('question_number')},
                 model="claude-3-5-sonnet-20241022",
                 max_tokens=800,
                 temperature=0.2 + (attempt * 0.1),  # Slightly vary temperature for different perspectives
@@ -447,8 +455,9 @@ def get_ai_answer_and_explanation_claude(client: Anthropic, question_data: Dict[
         return results
     
     except anthropic.RateLimitError as e:
-        print(f"Claude rate limit error: {e}")
-        return [("", f"Rate limit exceeded. Please try again later.")]
+        # An empty result lets the OpenAI fallback take the question
+        print(f"Claude rate limit error after retries: {e}")
+        return results
     except anthropic.APIError as e:
         print(f"Claude API error: {e}")
         return [("", f"API error: {str(e)}")]
@@ -460,8 +469,12 @@ def get_ai_answer_and_explanation_claude(client: Anthropic, question_data: Dict[
         return [("", f"Error generating answer and explanation: {str(e)}")]
 
 
-def process_questions(file_path: str, openai_api_key: str = None, anthropic_api_key: str = None, test_file_path: str = "test.txt", force_overwrite: bool = False, use_claude: bool = True) -> None:
-    """Main function to process questions and generate explanations."""
+def process_questions(file_path: str, openai_api_key: str = None, anthropic_api_key: str = None, test_file_path: str = "test.txt", force_overwrite: bool = False, use_claude: bool = True, budget: float = None) -> None:
+    """Main function to process questions and generate explanations.
+
+    With a budget (USD) no new question is started once the run's projected spend exceeds it.
+    """
+    usage_run = usage_ledger.start_run('get_answer4question', budget)
     # Initialize AI clients
     openai_client = None
     claude_client = None
@@ -504,6 +517,7 @@ def process_questions(file_path: str, openai_api_key: str = None, anthropic_api_
     overwritten_count = 0
     correct_answers_updated = 0
     multiple_answers_data = []
+    budget_stopped_at = None
     
     for i, question in enumerate(questions, 1):
         question_num = question.get('question_number', i)
@@ -513,6 +527,12 @@ def process_questions(file_path: str, openai_api_key: str = None, anthropic_api_
         if target_question_numbers is not None and question_num not in target_question_numbers:
             continue
         
+        if usage_run.over_budget():
+            budget_stopped_at = question_num
+            print(f"Budget of ${budget:g} reached (projected ${usage_run.projected():.4f}), "
+                  f"stopping before question {question_num}")
+            break
+        
         # Always generate explanation (no skipping)
         has_existing = question_num_str in existing_explanations
         
@@ -611,6 +631,10 @@ def process_questions(file_path: str, openai_api_key: str = None, anthropic_api_
     save_explanations_structured(questions, existing_explanations, structured_file)
     print(f"Processing complete! New: {new_explanations_count}, Overwritten: {overwritten_count}, Correct answers updated: {correct_answers_updated}, Total: {len(existing_explanations)}")
     print(f"Files saved: {file_path}, {explanations_file}, {structured_file}, {multiple_answers_file}")
+    if budget_stopped_at is not None:
+        print(f"Stopped at question {budget_stopped_at} by the budget, run again to continue")
+    for line in usage_ledger.report():
+        print(line)
 
 
 def main():
@@ -618,19 +642,31 @@ def main():
     # Load environment variables from .env file
     load_dotenv()
     
-    if len(sys.argv) < 2 or len(sys.argv) > 4:
-        print("Usage: python 3.5get_answer4question.py <json_file_path> [test_file_path] [--force]")
+    args = sys.argv[1:]
+    budget = None
+    if '--budget' in args:
+        index = args.index('--budget')
+        try:
+            budget = float(args[index + 1])
+        except (IndexError, ValueError):
+            print("Error: --budget needs an amount in USD, e.g. --budget 5")
+            sys.exit(1)
+        del args[index:index + 2]
+    
+    if len(args) < 1 or len(args) > 3:
+        print("Usage: python 3.5get_answer4question.py <json_file_path> [test_file_path] [--force] [--budget USD]")
         print("  json_file_path: Path to the questions JSON file")
         print("  test_file_path: Optional path to test.txt file (default: test.txt)")
         print("  --force: Overwrite existing explanations")
+        print("  --budget: Stop starting new questions once projected API spend exceeds this many USD")
         sys.exit(1)
     
-    json_file = sys.argv[1]
+    json_file = args[0]
     test_file = "test.txt"  # default
     force_overwrite = False
     
     # Parse additional arguments
-    for arg in sys.argv[2:]:
+    for arg in args[1:]:
         if arg == '--force':
             force_overwrite = True
         elif not arg.startswith('--'):
@@ -666,7 +702,7 @@ def main():
         print("Force overwrite mode enabled - will overwrite existing explanations")
     
     # Process questions
-    process_questions(json_file, openai_api_key, anthropic_api_key, test_file, force_overwrite, use_claude)
+    process_questions(json_file, openai_api_key, anthropic_api_key, test_file, force_overwrite, use_claude, budget)
 
 
 if __name__ == '__main__':
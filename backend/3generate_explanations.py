@@ -12,6 +12,7 @@ from typing import Dict, List, Any
 import openai
 from openai import OpenAI
 from dotenv import load_dotenv
+import rate_limiter
 
 
 def load_questions(file_path: str) -> List[Dict[str, Any]]:
@@ -155,7 +156,9 @@ def get_ai_explanation(client: OpenAI, question_data: Dict[str, Any]) -> str:
         if not prompt or len(prompt.strip()) == 0:
             raise ValueError("Generated prompt is empty")
         
-        response = client.chat.completions.create(
+        # Paced by the account's rate limits; 429s are retried with backoff
+        response = rate_limiter.create(
+            client,
             model="gpt-3.5-turbo",
             messages=[
                 {
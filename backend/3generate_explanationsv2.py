@@ -8,10 +8,12 @@ Appends new explanations and overwrites existing ones.
 import json
 import os
 import sys
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import openai
 from openai import OpenAI
 from dotenv import load_dotenv
+import rate_limiter
+import usage_ledger
 
 
 def load_questions(file_path: str) -> List[Dict[str, Any]]:
@@ -151,8 +153,8 @@ Correct Answer: {correct_answer}
 Please provide a clear, concise explanation for why option {correct_answer} is correct and why the other options are incorrect. Focus on AWS concepts and best practices."""
 
 
-def get_ai_explanation(client: OpenAI, question_data: Dict[str, Any]) -> str:
-    """Get explanation from OpenAI API."""
+def get_ai_explanation(client: OpenAI, question_data: Dict[str, Any]) -> Optional[str]:
+    """Get explanation from OpenAI API, or None if the rate limit never cleared."""
     try:
         # Validate question_data structure
         if not isinstance(question_data, dict):
@@ -163,7 +165,10 @@ def get_ai_explanation(client: OpenAI, question_data: Dict[str, Any]) -> str:
         if not prompt or len(prompt.strip()) == 0:
             raise ValueError("Generated prompt is empty")
         
-        response = client.chat.completions.create(
+        # Paced by the account's rate limits; 429s are retried with backoff
+        response = rate_limiter.create(
+            client,
+            tags={'question': question_data.get('question_number')},
             model="gpt-3.5-turbo",
             messages=[
                 {
@@ -189,8 +194,9 @@ def get_ai_explanation(client: OpenAI, question_data: Dict[str, Any]) -> str:
         return content.strip()
     
     except openai.RateLimitError as e:
-        print(f"Rate limit error: {e}")
-        return f"Rate limit exceeded. Please try again later."
+        # Not stored, so the question is picked up again on the next run
+        print(f"Rate limit error after retries: {e}")
+        return None
     except openai.APIError as e:
         print(f"OpenAI API error: {e}")
         return f"API error: {str(e)}"
@@ -202,8 +208,12 @@ def get_ai_explanation(client: OpenAI, question_data: Dict[str, Any]) -> str:
         return f"Error generating explanation: {str(e)}"
 
 
-def process_questions(file_path: str, api_key: str, force_overwrite: bool = False) -> None:
-    """Main function to process questions and generate explanations."""
+def process_questions(file_path: str, api_key: str, force_overwrite: bool = False, budget: Optional[float] = None) -> None:
+    """Main function to process questions and generate explanations.
+
+    With a budget (USD) no new question is started once the run's projected spend exceeds it.
+    """
+    usage_run = usage_ledger.start_run('generate_explanations', budget)
     # Initialize OpenAI client
     client = OpenAI(api_key=api_key)
     
@@ -259,16 +269,28 @@ def process_questions(file_path: str, api_key: str, force_overwrite: bool = Fals
     # Process each question that needs explanation
     new_explanations_count = 0
     overwritten_count = 0
+    rate_limited_count = 0
+    budget_skipped_count = 0
     
     for i, question in enumerate(questions_to_process, 1):
         question_num = str(question.get('question_number', ''))
         
+        if usage_run.over_budget():
+            budget_skipped_count = len(questions_to_process) - i + 1
+            print(f"Budget of ${budget:g} reached (projected ${usage_run.projected():.4f}), "
+                  f"leaving {budget_skipped_count} questions for the next run")
+            break
+        
         has_existing = question_num in existing_explanations and existing_explanations[question_num] != ''
         
         print(f"Processing question {question_num} ({i}/{len(questions_to_process)})...")
         
         # Get AI explanation
         explanation = get_ai_explanation(client, question)
+        if explanation is None:
+            rate_limited_count += 1
+            print(f"Question {question_num}: Skipped, still rate limited")
+            continue
         
         # Update explanations dictionary
         existing_explanations[question_num] = explanation
@@ -284,7 +306,13 @@ def process_questions(file_path: str, api_key: str, force_overwrite: bool = Fals
     save_explanations(existing_explanations, explanations_file)
     save_explanations_structured(questions, existing_explanations, structured_file)
     print(f"Processing complete! New: {new_explanations_count}, Overwritten: {overwritten_count}, Total: {len(existing_explanations)}")
+    if rate_limited_count:
+        print(f"Rate limited: {rate_limited_count} questions, run again to fill them in")
+    if budget_skipped_count:
+        print(f"Over budget: {budget_skipped_count} questions not started, run again to fill them in")
     print(f"Files saved: {explanations_file}, {structured_file}")
+    for line in usage_ledger.report():
+        print(line)
 
 
 def main():
@@ -292,13 +320,25 @@ def main():
     # Load environment variables from .env file
     load_dotenv()
     
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print("Usage: python generate_explanations.py <json_file_path> [--force]")
+    args = sys.argv[1:]
+    budget = None
+    if '--budget' in args:
+        index = args.index('--budget')
+        try:
+            budget = float(args[index + 1])
+        except (IndexError, ValueError):
+            print("Error: --budget needs an amount in USD, e.g. --budget 5")
+            sys.exit(1)
+        del args[index:index + 2]
+    
+    if len(args) < 1 or len(args) > 2:
+        print("Usage: python generate_explanations.py <json_file_path> [--force] [--budget USD]")
         print("  --force: Overwrite existing explanations")
+        print("  --budget: Stop starting new questions once projected API spend exceeds this many USD")
         sys.exit(1)
     
-    json_file = sys.argv[1]
-    force_overwrite = len(sys.argv) == 3 and sys.argv[2] == '--force'
+    json_file = args[0]
+    force_overwrite = len(args) == 2 and args[1] == '--force'
     
     # Check if file exists
     if not os.path.exists(json_file):
@@ -316,7 +356,7 @@ def main():
         print("Force overwrite mode enabled - will overwrite existing explanations")
     
     # Process questions
-    process_questions(json_file, api_key, force_overwrite)
+    process_questions(json_file, api_key, force_overwrite, budget)
 
 
 if __name__ == '__main__':
@@ -5,26 +5,19 @@ import base64
 from io import BytesIO
 from pypdf import PdfReader, PdfWriter
 from flask_cors import CORS # Import CORS
-from pdf2image import convert_from_path
 from PIL import Image
-from openai import OpenAI
 from dotenv import load_dotenv
+import backends
+import docling_converters
+import easyocr_readers
 
-# Try to import heavy dependencies, fallback if not available
-try:
-    from docling.document_converter import DocumentConverter
-    from docling.datamodel.base_models import InputFormat
-    from docling.datamodel.pipeline_options import PdfPipelineOptions
-    DOCLING_AVAILABLE = True
-except ImportError:
-    DOCLING_AVAILABLE = False
+# Heavy dependencies are imported on first use; only check that they are installed
+DOCLING_AVAILABLE = backends.is_available('docling')
+if not DOCLING_AVAILABLE:
     print("Warning: Docling not available. Some features may be limited.")
 
-try:
-    import easyocr
-    EASYOCR_AVAILABLE = True
-except ImportError:
-    EASYOCR_AVAILABLE = False
+EASYOCR_AVAILABLE = backends.is_available('easyocr')
+if not EASYOCR_AVAILABLE:
     print("Warning: EasyOCR not available. OCR features may be limited.")
 
 # Load environment variables from .env file
@@ -35,8 +28,11 @@ app = Flask(__name__)
 # Configure CORS
 CORS(app, origins=["http://localhost:3000", "https://*.railway.app"])
 
-# Configure OpenAI
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Load docling models in the background when the worker starts
+if DOCLING_AVAILABLE and docling_converters.DOCLING_WARMUP:
+    docling_converters.warm_up(configs=((False, True),))
+if EASYOCR_AVAILABLE and easyocr_readers.EASYOCR_WARMUP:
+    easyocr_readers.warm_up()
 
 @app.route('/')
 def home():
@@ -77,6 +73,14 @@ def health():
             "docling": DOCLING_AVAILABLE,
             "easyocr": EASYOCR_AVAILABLE,
             "openai": bool(os.getenv('OPENAI_API_KEY'))
+        },
+        "backends": backends.status(),
+        "models": {
+            "docling": {
+                "ready": DOCLING_AVAILABLE and docling_converters.is_ready(),
+                "converters": docling_converters.status() if DOCLING_AVAILABLE else {}
+            },
+            "easyocr": easyocr_readers.status() if EASYOCR_AVAILABLE else {}
         }
     }), 200
 
@@ -138,20 +142,9 @@ def process_with_docling(pdf_path):
         return None
     
     try:
-        # Configure pipeline options for better performance
-        pipeline_options = PdfPipelineOptions(
-            do_ocr=False,  # Disable OCR for faster processing
-            do_table_structure=True,
-            table_structure_options={
-                "do_cell_matching": True,
-            }
-        )
-        
-        # Initialize converter
-        converter = DocumentConverter()
-        
-        # Convert document
-        result = converter.convert(pdf_path, pipeline_options=pipeline_options)
+        # Convert with the worker's shared converter; OCR is disabled for
+        # faster processing and table structure is kept
+        result = docling_converters.convert(pdf_path, do_ocr=False, do_table_structure=True)
         
         # Extract markdown
         markdown = result.document.export_to_markdown()
@@ -198,9 +191,17 @@ def process_image():
             temp_path = temp_file.name
 
         try:
+            # Optional comma separated EasyOCR language codes, e.g. "en,fr"
+            languages = [lang.strip() for lang in request.form.get('languages', 'en').split(',') if lang.strip()]
+            # Each language set loads its own reader, so only configured languages are accepted
+            try:
+                easyocr_readers.check_languages(languages)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
             # Try EasyOCR if available
             if EASYOCR_AVAILABLE:
-                result = process_with_easyocr(temp_path)
+                result = process_with_easyocr(temp_path, languages)
                 if result:
                     return jsonify({
                         'text': result,
@@ -223,14 +224,14 @@ def process_image():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def process_with_easyocr(image_path):
+def process_with_easyocr(image_path, languages=('en',)):
     """Process image using EasyOCR if available."""
     if not EASYOCR_AVAILABLE:
         return None
     
     try:
-        reader = easyocr.Reader(['en'])
-        results = reader.readtext(image_path)
+        # Readers are cached per language set and shared across requests
+        results = easyocr_readers.readtext(image_path, languages)
         
         # Extract text from results
         text_content = []
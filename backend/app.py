@@ -1,17 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
-import tempfile
-import base64
-from io import BytesIO
-from docling.document_converter import DocumentConverter
-from docling.datamodel.base_models import InputFormat
-from docling.datamodel.pipeline_options import PdfPipelineOptions
-from pypdf import PdfReader, PdfWriter
+import json
+import select
+import socket
+import sys
+import threading
+import time
+import backends
+
+if __name__ == '__main__' and '--startup-report' in sys.argv:
+    # Import-time breakdown of a cold worker start, before this process starts any background loading
+    backends.startup_report('app')
+    sys.exit(0)
+
+import cancellation
+import docling_converters
+import metrics
+import usage_ledger
 from flask_cors import CORS # Import CORS
-from pdf2image import convert_from_path
-from PIL import Image
-from openai import OpenAI
 from dotenv import load_dotenv
+from upload_store import UploadStore
+from page_ocr import iter_ocr_pages, ocr_pages, page_cache, page_summary
+from text_layer import TEXT_LAYER_ENABLED
+from ocr_engines import build_chain, needs_client
+from conversion_jobs import FINISHED_STATUSES, job_progress, job_store, resume_orphaned_jobs, submit_job
+from prefetch import parse_prefetch, prefetcher
 
 # Load environment variables from .env file
 load_dotenv()
@@ -24,6 +37,114 @@ app.config['ENV'] = os.getenv('FLASK_ENV', 'production')
 
 CORS(app) # Enable CORS for all routes
 
+# Uploaded PDFs are kept by SHA-256 digest so clients can reference them again
+upload_store = UploadStore()
+
+# Pick up the jobs of workers that were recycled or killed while running them
+resume_orphaned_jobs()
+
+# An events stream ends after this long (well within gunicorn's --timeout) and the client reconnects
+JOB_EVENTS_MAX_SECONDS = float(os.getenv('JOB_EVENTS_MAX_SECONDS', '60'))
+
+def resolve_pdf_upload():
+    """Return (digest, path, error_response) for the PDF named by this request.
+
+    Clients either upload the file as 'pdfFile' or reference a previous upload
+    with 'pdfDigest'. Unknown digests get a 404 so the client can resend the bytes.
+    """
+    if 'pdfFile' in request.files:
+        pdf_file = request.files['pdfFile']
+        if pdf_file.filename == '':
+            print("Error: No selected file")
+            return None, None, (jsonify({'error': 'No selected file'}), 400)
+        digest = upload_store.save_upload(pdf_file)
+        return digest, upload_store.stored_path(digest), None
+
+    digest = request.form.get('pdfDigest')
+    if not digest:
+        print("Error: No pdfFile part in the request")
+        return None, None, (jsonify({'error': 'No pdfFile part in the request'}), 400)
+
+    digest = digest.lower()
+    path = upload_store.get_path(digest)
+    if path is None:
+        print(f"Unknown digest requested: {digest}")
+        return digest, None, (jsonify({'error': 'unknown digest', 'digest': digest}), 404)
+    print(f"Using cached upload: {digest}")
+    return digest, path, None
+
+def parse_ocr_engines():
+    """Return (engine_chain, error_response) from the optional 'engines' and 'offline' form fields"""
+    offline = request.form.get('offline')
+    try:
+        chain = build_chain(request.form.get('engines'), None if offline is None else offline.lower() == 'true')
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None, (jsonify({'error': str(e)}), 400)
+    return chain, None
+
+def client_hung_up(sock):
+    """True once the client has closed the connection of a gunicorn sync worker request"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+def watch_disconnect(token, sock):
+    while not token.closed.wait(cancellation.CANCEL_POLL_SECONDS):
+        if client_hung_up(sock):
+            token.cancel('disconnect')
+            return
+
+def start_cancel_token():
+    """Register this request so DELETE /requests/<id> or a client disconnect cancels its pages"""
+    request_id = cancellation.request_id_from(request.form.get('requestId') or request.headers.get('X-Request-Id'))
+    token = cancellation.register(request_id)
+    # Only gunicorn exposes the client socket; elsewhere only DELETE can cancel
+    sock = request.environ.get('gunicorn.socket')
+    if sock is not None:
+        threading.Thread(target=watch_disconnect, args=(token, sock), name='disconnect-watch', daemon=True).start()
+    return token
+
+def cancelled_response(token, results):
+    metrics.inc('cancelled_requests_total', kind='request', reason=token.reason)
+    return jsonify({
+        'error': 'Request cancelled',
+        'requestId': token.request_id,
+        'pages': [page_summary(result) for result in results]
+    }), 499
+
+# Each worker publishes its metrics so /metrics can report all of them
+metrics.start_exporter()
+# API calls made by the service are recorded in the usage ledger under one 'service' run
+usage_ledger.start_run('service')
+
+@app.before_request
+def track_request_start():
+    metrics.add_gauge('requests_in_flight', 1, endpoint=request.endpoint or 'unknown')
+
+@app.after_request
+def track_request_status(response):
+    metrics.inc('requests_total', endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+@app.teardown_request
+def track_request_end(error=None):
+    metrics.add_gauge('requests_in_flight', -1, endpoint=request.endpoint or 'unknown')
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text format metrics merged across all workers"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# Heavy backends load on first use; BACKEND_PRELOAD ones start loading now in the background
+backends.preload()
+
+# Load docling models in the background when the worker starts
+if docling_converters.DOCLING_WARMUP:
+    docling_converters.warm_up()
+
 # Health check endpoint for Railway
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -32,9 +153,23 @@ def health_check():
         'status': 'healthy',
         'service': 'examtopics-backend',
         'version': '1.0.0',
-        'environment': app.config['ENV']
+        'environment': app.config['ENV'],
+        'backends': backends.status(),
+        'models': {
+            'docling': {
+                'ready': docling_converters.is_ready(),
+                'converters': docling_converters.status()
+            }
+        }
     }), 200
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Page cache hit/miss counters"""
+    if not page_cache:
+        return jsonify({'enabled': False}), 200
+    return jsonify(dict(page_cache.stats(), enabled=True)), 200
+
 # Root endpoint
 @app.route('/', methods=['GET'])
 def root():
@@ -45,22 +180,17 @@ def root():
         'endpoints': [
             '/health - Health check',
             '/convert-pdf - PDF conversion and OCR',
-            '/ocr-pdf - PDF OCR processing'
+            '/convert-pdf-ocr - PDF OCR processing',
+            '/jobs - Background whole-document OCR jobs',
+            '/requests/<id> - DELETE to cancel a running OCR request',
+            '/cache/stats - Page cache statistics',
+            '/metrics - Prometheus metrics'
         ]
     }), 200
 
 @app.route('/convert-pdf', methods=['POST'])
 def convert_pdf():
     print("Received request to /convert-pdf")
-    if 'pdfFile' not in request.files:
-        print("Error: No pdfFile part in the request")
-        return jsonify({'error': 'No pdfFile part in the request'}), 400
-
-    pdf_file = request.files['pdfFile']
-    if pdf_file.filename == '':
-        print("Error: No selected file")
-        return jsonify({'error': 'No selected file'}), 400
-
     page_number_str = request.form.get('pageNumber')
     page_number = None
     if page_number_str:
@@ -71,51 +201,38 @@ def convert_pdf():
             print(f"Error: Invalid pageNumber provided: {page_number_str}")
             return jsonify({'error': 'Invalid pageNumber provided.'}), 400
 
-    if pdf_file:
-        original_pdf_path = None
-        single_page_pdf_path = None
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-                pdf_file.save(temp_pdf.name)
-                original_pdf_path = temp_pdf.name
-            print(f"Original PDF saved to: {original_pdf_path}")
+    digest, original_pdf_path, error_response = resolve_pdf_upload()
+    if error_response:
+        return error_response
 
+    if original_pdf_path:
+        try:
             pdf_to_convert_path = original_pdf_path
 
             if page_number is not None:
-                reader = PdfReader(original_pdf_path)
-                if not (0 <= page_number - 1 < len(reader.pages)):
-                    print(f"Error: Page number {page_number} is out of bounds. Total pages: {len(reader.pages)}")
+                total_pages = upload_store.page_count(digest)
+                if not (0 <= page_number - 1 < total_pages):
+                    print(f"Error: Page number {page_number} is out of bounds. Total pages: {total_pages}")
                     return jsonify({'error': f'Page number {page_number} is out of bounds.'}), 400
 
-                writer = PdfWriter()
-                writer.add_page(reader.pages[page_number - 1])
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as single_page_pdf:
-                    writer.write(single_page_pdf)
-                    single_page_pdf_path = single_page_pdf.name
-                    pdf_to_convert_path = single_page_pdf_path
-                print(f"Single page PDF saved to: {single_page_pdf_path}")
+                pdf_to_convert_path = upload_store.page_pdf_path(digest, page_number)
+                print(f"Single page PDF: {pdf_to_convert_path}")
 
             print(f"Converting PDF from path: {pdf_to_convert_path}")
             
-            # Try with OCR enabled for better text extraction from image-heavy PDFs
+            # Try with OCR enabled for better text extraction from image-heavy PDFs.
+            # Converters are built once per worker and reused across requests.
+            do_ocr = True
             try:
-                # Initialize converter with OCR enabled
-                pipeline_options = PdfPipelineOptions()
-                pipeline_options.do_ocr = True
-                
-                converter = DocumentConverter(
-                    format_options={
-                        InputFormat.PDF: pipeline_options
-                    }
-                )
+                docling_converters.get_converter(do_ocr=True)
                 print("Using OCR-enabled converter for better text extraction...")
             except Exception as ocr_error:
                 print(f"OCR setup failed, falling back to basic converter: {ocr_error}")
                 # Fallback to basic converter if OCR setup fails
-                converter = DocumentConverter()
+                do_ocr = False
             
-            result = converter.convert(pdf_to_convert_path)
+            with metrics.timed('docling'):
+                result = docling_converters.convert(pdf_to_convert_path, do_ocr=do_ocr)
             markdown_content = result.document.export_to_markdown()
             
             # Log detailed information about the conversion
@@ -127,7 +244,7 @@ def convert_pdf():
 
             if markdown_content and len(markdown_content.strip()) > 20:  # More than just image comments
                 print(f"Markdown content generated ({len(markdown_content)} chars, first 200):\n{markdown_content[:200]}")
-                return jsonify({'markdown': markdown_content}), 200
+                return jsonify({'markdown': markdown_content, 'digest': digest}), 200
             else:
                 # If we only got image comments or very little text, provide more helpful error
                 if markdown_content and "<!-- image -->" in markdown_content:
@@ -143,26 +260,65 @@ def convert_pdf():
             import traceback
             traceback.print_exc() # Print full traceback to console
             return jsonify({'error': f'Error during PDF conversion: {e}'}), 500
+
+STREAM_FORMATS = ('ndjson', 'sse')
+
+def stream_ocr_pages(stream_format, client, pdf_path, digest, page_numbers, use_text_layer, engines):
+    """Stream each page's markdown, usage and timing as it finishes, then a summary.
+
+    Pages arrive in completion order, so every event carries its page number.
+    Nothing is accumulated server-side beyond the per-page status list.
+    """
+    def encode(event, payload):
+        if stream_format == 'sse':
+            return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps(dict(payload, type=event)) + '\n'
+
+    request_id = cancellation.request_id_from(request.form.get('requestId') or request.headers.get('X-Request-Id'))
+
+    def generate():
+        started = time.time()
+        pages = []
+        token = cancellation.register(request_id)
+        results = iter_ocr_pages(client, pdf_path, digest, page_numbers, use_text_layer=use_text_layer,
+                                 engines=engines, cancel=token)
+        try:
+            for result in results:
+                pages.append(page_summary(result))
+                yield encode('page', result)
+            if token.cancelled:
+                metrics.inc('cancelled_requests_total', kind='request', reason=token.reason)
+                yield encode('cancelled', {'requestId': request_id, 'pages': pages})
+                return
+        except GeneratorExit:
+            # The client went away mid-stream; stop the pages still queued or running
+            token.cancel('disconnect')
+            metrics.inc('cancelled_requests_total', kind='request', reason='disconnect')
+            raise
+        except Exception as e:
+            print(f"Error during streamed PDF-to-OCR conversion: {e}")
+            yield encode('error', {'error': f'Error during PDF-to-OCR conversion: {e}'})
+            return
         finally:
-            if original_pdf_path and os.path.exists(original_pdf_path):
-                os.remove(original_pdf_path)
-                print(f"Cleaned up original PDF: {original_pdf_path}")
-            if single_page_pdf_path and os.path.exists(single_page_pdf_path):
-                os.remove(single_page_pdf_path)
-                print(f"Cleaned up single page PDF: {single_page_pdf_path}")
+            results.close()
+            cancellation.unregister(token)
+        pages.sort(key=lambda page: page['page'])
+        yield encode('done', {
+            'digest': digest,
+            'requestId': request_id,
+            'pages': pages,
+            'failedPages': [page['page'] for page in pages if page['status'] != 'ok'],
+            'seconds': round(time.time() - started, 3)
+        })
+        print(f"Streamed {len(pages)} page(s) for {digest}")
+
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/convert-pdf-ocr', methods=['POST'])
 def convert_pdf_ocr():
     print("Received request to /convert-pdf-ocr")
-    if 'pdfFile' not in request.files:
-        print("Error: No pdfFile part in the request")
-        return jsonify({'error': 'No pdfFile part in the request'}), 400
-
-    pdf_file = request.files['pdfFile']
-    if pdf_file.filename == '':
-        print("Error: No selected file")
-        return jsonify({'error': 'No selected file'}), 400
-
     page_number_str = request.form.get('pageNumber')
     page_number = None
     if page_number_str:
@@ -173,132 +329,226 @@ def convert_pdf_ocr():
             print(f"Error: Invalid pageNumber provided: {page_number_str}")
             return jsonify({'error': 'Invalid pageNumber provided.'}), 400
 
-    # Get OpenAI API key from environment
+    # Optional streaming mode: each page is sent as soon as it is converted
+    stream_format = (request.form.get('stream') or request.args.get('stream') or '').lower()
+    if stream_format and stream_format not in STREAM_FORMATS:
+        print(f"Error: Invalid stream format provided: {stream_format}")
+        return jsonify({'error': f"Invalid stream format. Use one of: {', '.join(STREAM_FORMATS)}"}), 400
+
+    # forceOcr=true skips the text-layer fast path and always uses vision OCR
+    use_text_layer = TEXT_LAYER_ENABLED and request.form.get('forceOcr', 'false').lower() != 'true'
+
+    # Ordered OCR engines to try per page, e.g. engines=vision,tesseract or offline=true
+    engines, error_response = parse_ocr_engines()
+    if error_response:
+        return error_response
+
+    # Get OpenAI API key from environment (only needed when the vision engine is in the chain)
     openai_api_key = os.environ.get('OPENAI_API_KEY')
-    if not openai_api_key:
+    if needs_client(engines) and not openai_api_key:
         print("Error: OPENAI_API_KEY environment variable not set")
         return jsonify({'error': 'OpenAI API key not configured'}), 500
 
-    if pdf_file:
-        original_pdf_path = None
-        single_page_pdf_path = None
-        try:
-            # Save uploaded PDF to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-                pdf_file.save(temp_pdf.name)
-                original_pdf_path = temp_pdf.name
-            print(f"Original PDF saved to: {original_pdf_path}")
-
-            pdf_to_convert_path = original_pdf_path
+    digest, original_pdf_path, error_response = resolve_pdf_upload()
+    if error_response:
+        return error_response
 
-            # Extract specific page if requested
+    if original_pdf_path:
+        try:
+            total_pages = upload_store.page_count(digest)
             if page_number is not None:
-                reader = PdfReader(original_pdf_path)
-                if not (0 <= page_number - 1 < len(reader.pages)):
-                    print(f"Error: Page number {page_number} is out of bounds. Total pages: {len(reader.pages)}")
+                if not (0 <= page_number - 1 < total_pages):
+                    print(f"Error: Page number {page_number} is out of bounds. Total pages: {total_pages}")
                     return jsonify({'error': f'Page number {page_number} is out of bounds.'}), 400
+                page_numbers = [page_number]
+            else:
+                page_numbers = list(range(1, total_pages + 1))
 
-                writer = PdfWriter()
-                writer.add_page(reader.pages[page_number - 1])
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as single_page_pdf:
-                    writer.write(single_page_pdf)
-                    single_page_pdf_path = single_page_pdf.name
-                    pdf_to_convert_path = single_page_pdf_path
-                print(f"Single page PDF saved to: {single_page_pdf_path}")
-
-            print(f"Converting PDF to images from path: {pdf_to_convert_path}")
-            
-            # Convert PDF to images using pdf2image
-            images = convert_from_path(pdf_to_convert_path, dpi=300)
-            print(f"Converted PDF to {len(images)} image(s)")
-
-            if not images:
-                print("No images generated from PDF")
-                return jsonify({'error': 'Failed to convert PDF to images'}), 500
+            client = backends.load('openai').OpenAI(api_key=openai_api_key) if needs_client(engines) else None
+            if stream_format:
+                return stream_ocr_pages(stream_format, client, original_pdf_path, digest, page_numbers, use_text_layer,
+                                        engines)
 
-            # Process each image with OpenAI OCR
-            client = OpenAI(api_key=openai_api_key)
-            all_markdown_content = []
+            # Render and OCR pages concurrently; each page reports its own status
+            token = start_cancel_token()
+            try:
+                with prefetcher.interactive(digest):
+                    results = ocr_pages(client, original_pdf_path, digest, page_numbers,
+                                        use_text_layer=use_text_layer, engines=engines, cancel=token)
+                if token.cancelled:
+                    return cancelled_response(token, results)
+            finally:
+                cancellation.unregister(token)
 
-            for i, image in enumerate(images):
-                print(f"Processing image {i+1} of {len(images)}")
-                
-                # Convert PIL image to base64 for OpenAI API
-                buffered = BytesIO()
-                image.save(buffered, format="PNG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                
-                try:
-                    response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=[
-                            {
-                                "role": "user",
-                                "content": [
-                                    {
-                                        "type": "text",
-                                        "text": "Convert this image to clean markdown text. Extract all text content while preserving structure, formatting, and hierarchy. Use proper markdown syntax for headers, lists, code blocks, and emphasis. If this appears to be an exam question, preserve the question structure and answer choices clearly."
-                                    },
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": f"data:image/png;base64,{img_base64}",
-                                            "detail": "high"
-                                        }
-                                    }
-                                ]
-                            }
-                        ],
-                        max_tokens=4000,
-                        temperature=0.1
-                    )
-                    
-                    # Print OpenAI response details
-                    print(f"OpenAI Response for image {i+1}:")
-                    print(f"  Model: {response.model}")
-                    print(f"  Usage: {response.usage}")
-                    print(f"  Finish reason: {response.choices[0].finish_reason}")
-                    
-                    page_markdown = response.choices[0].message.content
-                    if page_markdown:
-                        print(f"  Content length: {len(page_markdown)} characters")
-                        print(f"  Content preview (first 200 chars): {page_markdown[:200]}...")
-                        print(f"  Full content:\n{'-' * 50}")
-                        print(page_markdown)
-                        print(f"{'-' * 50}")
-                        all_markdown_content.append(page_markdown)
-                        print(f"Successfully extracted markdown from image {i+1}")
-                    else:
-                        print(f"No content extracted from image {i+1}")
-                        
-                except Exception as e:
-                    print(f"Error processing image {i+1} with OpenAI: {e}")
-                    # Continue processing other images even if one fails
-                    continue
+            # prefetch=N converts the next N pages in the background for the labeler's next page turns
+            prefetch_pages = parse_prefetch(request.form.get('prefetch'))
+            if page_number is not None and prefetch_pages:
+                prefetcher.schedule(original_pdf_path, digest, page_number, prefetch_pages, total_pages,
+                                    openai_api_key if needs_client(engines) else None, use_text_layer, engines)
+            pages = [page_summary(result) for result in results]
+            failed_pages = [result['page'] for result in results if result['status'] != 'ok']
+            if failed_pages:
+                print(f"Pages without content: {failed_pages}")
 
+            all_markdown_content = [result['markdown'] for result in results if result['status'] == 'ok']
             if not all_markdown_content:
                 print("No markdown content extracted from any images")
-                return jsonify({'error': 'Failed to extract text from images'}), 500
+                return jsonify({
+                    'error': 'Failed to extract text from images',
+                    'digest': digest,
+                    'pages': pages,
+                    'failedPages': failed_pages
+                }), 500
 
             # Combine all markdown content
             final_markdown = '\n\n---\n\n'.join(all_markdown_content)
             print(f"Successfully generated markdown content ({len(final_markdown)} characters)")
             
-            return jsonify({'markdown': final_markdown}), 200
+            return jsonify({
+                'markdown': final_markdown,
+                'digest': digest,
+                'requestId': token.request_id,
+                'pages': pages,
+                'failedPages': failed_pages
+            }), 200
 
         except Exception as e:
             print(f"Error during PDF-to-OCR conversion: {e}")
             import traceback
             traceback.print_exc()
             return jsonify({'error': f'Error during PDF-to-OCR conversion: {e}'}), 500
-        finally:
-            # Clean up temporary files
-            if original_pdf_path and os.path.exists(original_pdf_path):
-                os.remove(original_pdf_path)
-                print(f"Cleaned up original PDF: {original_pdf_path}")
-            if single_page_pdf_path and os.path.exists(single_page_pdf_path):
-                os.remove(single_page_pdf_path)
-                print(f"Cleaned up single page PDF: {single_page_pdf_path}")
+
+def parse_page_range(total_pages):
+    """Read optional startPage/endPage form fields, returning (start, end, error_response)"""
+    try:
+        start_page = int(request.form.get('startPage') or 1)
+        end_page = int(request.form.get('endPage') or total_pages)
+    except ValueError:
+        return None, None, (jsonify({'error': 'Invalid startPage or endPage provided.'}), 400)
+    if not (1 <= start_page <= end_page <= total_pages):
+        return None, None, (jsonify({'error': f'Page range {start_page}-{end_page} is out of bounds. Total pages: {total_pages}'}), 400)
+    return start_page, end_page, None
+
+def job_response(job, pages, include_markdown=True):
+    """JSON body describing a job and the pages finished so far"""
+    body = {
+        'jobId': job['id'],
+        'status': job['status'],
+        'digest': job['digest'],
+        'startPage': job['start_page'],
+        'endPage': job['end_page'],
+        'error': job['error'],
+        'progress': job_progress(job, pages),
+        'pages': [page_summary(page) for page in pages]
+    }
+    if include_markdown:
+        body['markdown'] = '\n\n---\n\n'.join(page['markdown'] for page in pages if page['status'] == 'ok')
+    return body
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Start converting a page range of a PDF in the background"""
+    print("Received request to /jobs")
+    engines, error_response = parse_ocr_engines()
+    if error_response:
+        return error_response
+
+    openai_api_key = os.environ.get('OPENAI_API_KEY')
+    if needs_client(engines) and not openai_api_key:
+        print("Error: OPENAI_API_KEY environment variable not set")
+        return jsonify({'error': 'OpenAI API key not configured'}), 500
+
+    digest, pdf_path, error_response = resolve_pdf_upload()
+    if error_response:
+        return error_response
+
+    total_pages = upload_store.page_count(digest)
+    start_page, end_page, error_response = parse_page_range(total_pages)
+    if error_response:
+        return error_response
+
+    job_id = submit_job(pdf_path, digest, start_page, end_page, openai_api_key, engines)
+    print(f"Created job {job_id} for pages {start_page}-{end_page} of {digest}")
+    return jsonify({
+        'jobId': job_id,
+        'status': 'queued',
+        'digest': digest,
+        'startPage': start_page,
+        'endPage': end_page,
+        'statusUrl': f'/jobs/{job_id}',
+        'eventsUrl': f'/jobs/{job_id}/events'
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status, per-page progress and the markdown converted so far"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    include_markdown = request.args.get('includeMarkdown', 'true').lower() == 'true'
+    return jsonify(job_response(job, job_store.pages(job_id), include_markdown)), 200
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Stop a queued or running job; pages already converted are kept"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_store.cancel(job_id):
+        return jsonify({'error': f"Job already {job['status']}", 'status': job['status']}), 409
+    print(f"Job {job_id}: cancel requested")
+    return jsonify(job_response(job_store.get(job_id), job_store.pages(job_id), include_markdown=False)), 202
+
+@app.route('/requests/<request_id>', methods=['DELETE'])
+def cancel_request(request_id):
+    """Cancel a running /convert-pdf-ocr request by the requestId it was sent with"""
+    if not cancellation.cancel_request(request_id):
+        return jsonify({'error': 'Request not found or already finished'}), 404
+    print(f"Cancel requested for request {request_id}")
+    return jsonify({'requestId': request_id, 'status': 'cancelling'}), 202
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events with each page in page order, then a final 'done' event.
+
+    Each page event's id is its page number. The stream ends after
+    JOB_EVENTS_MAX_SECONDS so it never holds a sync worker for long; the
+    client reconnects with Last-Event-ID (or ?lastEventId=) and gets the
+    pages after it.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    try:
+        last_page = int(cursor) if cursor else job['start_page'] - 1
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be a page number'}), 400
+
+    def generate():
+        nonlocal last_page
+        deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+        yield "retry: 1000\n\n"
+        while True:
+            job = job_store.get(job_id)
+            finished = job['status'] in FINISHED_STATUSES
+            for page in job_store.pages(job_id, after_page=last_page):
+                # Pages finish out of order; hold back those after a gap so the cursor never skips one
+                if page['page'] != last_page + 1 and not finished:
+                    break
+                last_page = page['page']
+                yield f"id: {last_page}\nevent: page\ndata: {json.dumps(page)}\n\n"
+            if finished:
+                yield f"event: done\ndata: {json.dumps(job_response(job, job_store.pages(job_id), include_markdown=False))}\n\n"
+                return
+            if time.monotonic() >= deadline:
+                return
+            # Comment line keeps proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+            time.sleep(1)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 if __name__ == '__main__':
     # Get port from environment variable (Railway sets this automatically)
@@ -0,0 +1,448 @@
+"""
+Async (ASGI) variant of the PDF conversion service.
+
+Serves the same /health, /convert-pdf, /convert-pdf-ocr, /cache/stats and
+/metrics endpoints as app.py, but with the AsyncOpenAI client: while a page
+waits on gpt-4o the event loop serves other requests, so one process can hold
+dozens of vision calls in flight instead of one per gunicorn sync worker.
+Rendering, encoding, PDF parsing and docling run in thread pools.
+
+Run with:
+  uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+or set SERVER_MODE=asgi for wsgi.py.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match, Route
+
+import backends
+import cancellation
+import docling_converters
+import metrics
+import usage_ledger
+from page_ocr import iter_ocr_pages_async, ocr_pages_async, page_cache, page_summary
+from ocr_engines import build_chain, needs_client
+from prefetch import parse_prefetch, prefetcher
+from text_layer import TEXT_LAYER_ENABLED
+from upload_store import UploadStore
+
+# Load environment variables from .env file
+load_dotenv()
+
+STREAM_FORMATS = ('ndjson', 'sse')
+
+upload_store = UploadStore()
+
+_openai_client = None
+
+
+def get_openai_client(api_key):
+    """One AsyncOpenAI client per process so all requests share its connection pool"""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = backends.load('openai').AsyncOpenAI(api_key=api_key)
+    return _openai_client
+
+
+async def resolve_pdf_upload(form):
+    """Return (digest, path, error_response) for the PDF named by this request, like app.py"""
+    pdf_file = form.get('pdfFile')
+    if pdf_file is not None and hasattr(pdf_file, 'file'):
+        if not pdf_file.filename:
+            print("Error: No selected file")
+            return None, None, JSONResponse({'error': 'No selected file'}, status_code=400)
+        digest = await run_in_threadpool(upload_store.save_stream, pdf_file.file)
+        return digest, upload_store.stored_path(digest), None
+
+    digest = form.get('pdfDigest')
+    if not digest:
+        print("Error: No pdfFile part in the request")
+        return None, None, JSONResponse({'error': 'No pdfFile part in the request'}, status_code=400)
+
+    digest = digest.lower()
+    path = await run_in_threadpool(upload_store.get_path, digest)
+    if path is None:
+        print(f"Unknown digest requested: {digest}")
+        return digest, None, JSONResponse({'error': 'unknown digest', 'digest': digest}, status_code=404)
+    print(f"Using cached upload: {digest}")
+    return digest, path, None
+
+
+def parse_page_number(form):
+    """Return (page_number, error_response) for the optional pageNumber field"""
+    page_number_str = form.get('pageNumber')
+    if not page_number_str:
+        return None, None
+    try:
+        page_number = int(page_number_str)
+    except ValueError:
+        print(f"Error: Invalid pageNumber provided: {page_number_str}")
+        return None, JSONResponse({'error': 'Invalid pageNumber provided.'}, status_code=400)
+    print(f"Page number requested: {page_number}")
+    return page_number, None
+
+
+def parse_ocr_engines(form):
+    """Return (engine_chain, error_response) from the optional 'engines' and 'offline' form fields"""
+    offline = form.get('offline')
+    try:
+        chain = build_chain(form.get('engines'), None if offline is None else offline.lower() == 'true')
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None, JSONResponse({'error': str(e)}, status_code=400)
+    return chain, None
+
+
+async def check_page_bounds(digest, page_number):
+    total_pages = await run_in_threadpool(upload_store.page_count, digest)
+    if not (0 <= page_number - 1 < total_pages):
+        print(f"Error: Page number {page_number} is out of bounds. Total pages: {total_pages}")
+        return JSONResponse({'error': f'Page number {page_number} is out of bounds.'}, status_code=400)
+    return None
+
+
+async def watch_disconnect(request, token):
+    """Cancel the token when the client goes away before its response is ready"""
+    while not token.closed.is_set():
+        if await request.is_disconnected():
+            token.cancel('disconnect')
+            return
+        await asyncio.sleep(cancellation.CANCEL_POLL_SECONDS)
+
+
+def request_id_for(request, form):
+    return cancellation.request_id_from(form.get('requestId') or request.headers.get('x-request-id'))
+
+
+async def health_check(request):
+    """Health check endpoint for Railway deployment monitoring"""
+    return JSONResponse({
+        'status': 'healthy',
+        'service': 'examtopics-backend',
+        'version': '1.0.0',
+        'environment': os.getenv('FLASK_ENV', 'production'),
+        'server': 'asgi',
+        'backends': backends.status(),
+        'models': {
+            'docling': {
+                'ready': docling_converters.is_ready(),
+                'converters': docling_converters.status()
+            }
+        }
+    })
+
+
+async def cache_stats(request):
+    """Page cache hit/miss counters"""
+    if not page_cache:
+        return JSONResponse({'enabled': False})
+    stats = await run_in_threadpool(page_cache.stats)
+    return JSONResponse(dict(stats, enabled=True))
+
+
+async def prometheus_metrics(request):
+    """Prometheus text format metrics merged across all workers"""
+    body = await run_in_threadpool(metrics.render_prometheus)
+    return Response(body, media_type='text/plain; version=0.0.4')
+
+
+async def root(request):
+    """Root endpoint with service information"""
+    return JSONResponse({
+        'service': 'ExamTopics Data Labeler Backend',
+        'version': '1.0.0',
+        'endpoints': [
+            '/health - Health check',
+            '/convert-pdf - PDF conversion and OCR',
+            '/convert-pdf-ocr - PDF OCR processing',
+            '/requests/<id> - DELETE to cancel a running OCR request',
+            '/cache/stats - Page cache statistics',
+            '/metrics - Prometheus metrics'
+        ]
+    })
+
+
+def _convert_with_docling(pdf_path):
+    do_ocr = True
+    try:
+        docling_converters.get_converter(do_ocr=True)
+        print("Using OCR-enabled converter for better text extraction...")
+    except Exception as ocr_error:
+        print(f"OCR setup failed, falling back to basic converter: {ocr_error}")
+        do_ocr = False
+    with metrics.timed('docling'):
+        result = docling_converters.convert(pdf_path, do_ocr=do_ocr)
+    return result.document.export_to_markdown()
+
+
+async def convert_pdf(request):
+    print("Received request to /convert-pdf")
+    form = await request.form()
+    page_number, error_response = parse_page_number(form)
+    if error_response:
+        return error_response
+
+    digest, pdf_path, error_response = await resolve_pdf_upload(form)
+    if error_response:
+        return error_response
+
+    try:
+        if page_number is not None:
+            error_response = await check_page_bounds(digest, page_number)
+            if error_response:
+                return error_response
+            pdf_path = await run_in_threadpool(upload_store.page_pdf_path, digest, page_number)
+            print(f"Single page PDF: {pdf_path}")
+
+        print(f"Converting PDF from path: {pdf_path}")
+        markdown_content = await run_in_threadpool(_convert_with_docling, pdf_path)
+        print("PDF conversion completed.")
+
+        if markdown_content and len(markdown_content.strip()) > 20:
+            print(f"Markdown content generated ({len(markdown_content)} chars)")
+            return JSONResponse({'markdown': markdown_content, 'digest': digest})
+        if markdown_content and "<!-- image -->" in markdown_content:
+            error_msg = "The PDF appears to contain mostly images with little extractable text. The PDF may be scan-based or image-heavy. Consider using a PDF with selectable text or enabling better OCR processing."
+        else:
+            error_msg = "No markdown content found after conversion. The PDF may be corrupted, empty, or in an unsupported format."
+        print(f"Conversion issue: {error_msg}")
+        return JSONResponse({'error': error_msg}, status_code=500)
+    except Exception as e:
+        print(f"Error during PDF conversion: {e}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse({'error': f'Error during PDF conversion: {e}'}, status_code=500)
+
+
+def stream_ocr_pages(stream_format, client, pdf_path, digest, page_numbers, use_text_layer, engines, request_id):
+    """Stream each page as it finishes, then a summary; same events as app.py"""
+    def encode(event, payload):
+        if stream_format == 'sse':
+            return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps(dict(payload, type=event)) + '\n'
+
+    async def generate():
+        started = time.time()
+        pages = []
+        token = cancellation.register(request_id)
+        results = iter_ocr_pages_async(client, pdf_path, digest, page_numbers, use_text_layer=use_text_layer,
+                                       engines=engines, cancel=token)
+        try:
+            async for result in results:
+                pages.append(page_summary(result))
+                yield encode('page', result)
+            if token.cancelled:
+                metrics.inc('cancelled_requests_total', kind='request', reason=token.reason)
+                yield encode('cancelled', {'requestId': request_id, 'pages': pages})
+                return
+        except asyncio.CancelledError:
+            # Starlette cancels the response when the client disconnects mid-stream
+            token.cancel('disconnect')
+            metrics.inc('cancelled_requests_total', kind='request', reason='disconnect')
+            raise
+        except Exception as e:
+            print(f"Error during streamed PDF-to-OCR conversion: {e}")
+            yield encode('error', {'error': f'Error during PDF-to-OCR conversion: {e}'})
+            return
+        finally:
+            await results.aclose()
+            cancellation.unregister(token)
+        pages.sort(key=lambda page: page['page'])
+        yield encode('done', {
+            'digest': digest,
+            'requestId': request_id,
+            'pages': pages,
+            'failedPages': [page['page'] for page in pages if page['status'] != 'ok'],
+            'seconds': round(time.time() - started, 3)
+        })
+        print(f"Streamed {len(pages)} page(s) for {digest}")
+
+    media_type = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    return StreamingResponse(generate(), media_type=media_type,
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def convert_pdf_ocr(request):
+    print("Received request to /convert-pdf-ocr")
+    form = await request.form()
+    page_number, error_response = parse_page_number(form)
+    if error_response:
+        return error_response
+
+    stream_format = (form.get('stream') or request.query_params.get('stream') or '').lower()
+    if stream_format and stream_format not in STREAM_FORMATS:
+        print(f"Error: Invalid stream format provided: {stream_format}")
+        return JSONResponse({'error': f"Invalid stream format. Use one of: {', '.join(STREAM_FORMATS)}"}, status_code=400)
+
+    use_text_layer = TEXT_LAYER_ENABLED and (form.get('forceOcr') or 'false').lower() != 'true'
+
+    engines, error_response = parse_ocr_engines(form)
+    if error_response:
+        return error_response
+
+    openai_api_key = os.environ.get('OPENAI_API_KEY')
+    if needs_client(engines) and not openai_api_key:
+        print("Error: OPENAI_API_KEY environment variable not set")
+        return JSONResponse({'error': 'OpenAI API key not configured'}, status_code=500)
+
+    digest, pdf_path, error_response = await resolve_pdf_upload(form)
+    if error_response:
+        return error_response
+
+    try:
+        if page_number is not None:
+            error_response = await check_page_bounds(digest, page_number)
+            if error_response:
+                return error_response
+            page_numbers = [page_number]
+        else:
+            total_pages = await run_in_threadpool(upload_store.page_count, digest)
+            page_numbers = list(range(1, total_pages + 1))
+
+        client = get_openai_client(openai_api_key) if needs_client(engines) else None
+        if stream_format:
+            return stream_ocr_pages(stream_format, client, pdf_path, digest, page_numbers, use_text_layer, engines,
+                                    request_id_for(request, form))
+
+        token = cancellation.register(request_id_for(request, form))
+        watcher = asyncio.ensure_future(watch_disconnect(request, token))
+        try:
+            with prefetcher.interactive(digest):
+                results = await ocr_pages_async(client, pdf_path, digest, page_numbers,
+                                                use_text_layer=use_text_layer, engines=engines, cancel=token)
+            if token.cancelled:
+                metrics.inc('cancelled_requests_total', kind='request', reason=token.reason)
+                return JSONResponse({
+                    'error': 'Request cancelled',
+                    'requestId': token.request_id,
+                    'pages': [page_summary(result) for result in results]
+                }, status_code=499)
+        finally:
+            cancellation.unregister(token)
+            watcher.cancel()
+
+        # Prefetch runs on its own thread with a sync client, like app.py
+        prefetch_pages = parse_prefetch(form.get('prefetch'))
+        if page_number is not None and prefetch_pages:
+            total_pages = await run_in_threadpool(upload_store.page_count, digest)
+            prefetcher.schedule(pdf_path, digest, page_number, prefetch_pages, total_pages,
+                                openai_api_key if needs_client(engines) else None, use_text_layer, engines)
+        pages = [page_summary(result) for result in results]
+        failed_pages = [result['page'] for result in results if result['status'] != 'ok']
+        if failed_pages:
+            print(f"Pages without content: {failed_pages}")
+
+        all_markdown_content = [result['markdown'] for result in results if result['status'] == 'ok']
+        if not all_markdown_content:
+            print("No markdown content extracted from any images")
+            return JSONResponse({
+                'error': 'Failed to extract text from images',
+                'digest': digest,
+                'pages': pages,
+                'failedPages': failed_pages
+            }, status_code=500)
+
+        final_markdown = '\n\n---\n\n'.join(all_markdown_content)
+        print(f"Successfully generated markdown content ({len(final_markdown)} characters)")
+        return JSONResponse({
+            'markdown': final_markdown,
+            'digest': digest,
+            'requestId': token.request_id,
+            'pages': pages,
+            'failedPages': failed_pages
+        })
+    except Exception as e:
+        print(f"Error during PDF-to-OCR conversion: {e}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse({'error': f'Error during PDF-to-OCR conversion: {e}'}, status_code=500)
+
+
+async def cancel_request(request):
+    """Cancel a running /convert-pdf-ocr request (in any worker) by its requestId"""
+    request_id = request.path_params['request_id']
+    if not cancellation.cancel_request(request_id):
+        return JSONResponse({'error': 'Request not found or already finished'}, status_code=404)
+    print(f"Cancel requested for request {request_id}")
+    return JSONResponse({'requestId': request_id, 'status': 'cancelling'}, status_code=202)
+
+
+routes = [
+    Route('/', root),
+    Route('/health', health_check),
+    Route('/cache/stats', cache_stats),
+    Route('/metrics', prometheus_metrics),
+    Route('/convert-pdf', convert_pdf, methods=['POST']),
+    Route('/convert-pdf-ocr', convert_pdf_ocr, methods=['POST']),
+    Route('/requests/{request_id}', cancel_request, methods=['DELETE']),
+]
+
+
+class RequestMetricsMiddleware:
+    """requests_in_flight / requests_total with the same endpoint labels as app.py"""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def endpoint_name(scope):
+        for route in routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return route.endpoint.__name__
+        return 'unknown'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self.endpoint_name(scope)
+        status = {'code': 500}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        metrics.add_gauge('requests_in_flight', 1, endpoint=endpoint)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.add_gauge('requests_in_flight', -1, endpoint=endpoint)
+            metrics.inc('requests_total', endpoint=endpoint, status=status['code'])
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Each worker publishes its metrics so /metrics can report all of them
+    metrics.start_exporter()
+    # API calls made by the service are recorded in the usage ledger under one 'service' run
+    usage_ledger.start_run('service')
+    backends.preload()
+    if docling_converters.DOCLING_WARMUP:
+        docling_converters.warm_up()
+    yield
+
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(RequestMetricsMiddleware),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
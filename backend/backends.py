@@ -0,0 +1,187 @@
+"""
+Registry of heavy backends loaded on first use.
+
+docling (torch/transformers), EasyOCR, the OpenAI SDK and the PDF renderers
+are imported the first time a request needs them instead of when a worker
+boots, so a fresh or restarted worker answers /health straight away. Each
+backend's state ('not_loaded', 'loading', 'ready', 'failed' or 'missing')
+and load time are reported by status(). BACKEND_PRELOAD names backends to
+load in a background thread after startup.
+
+  python backends.py --startup-report
+prints an import-time breakdown of a cold service start and the load time of
+each backend.
+"""
+import argparse
+import importlib
+import importlib.util
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Modules imported by each backend; the first one is returned by load()
+BACKENDS = {
+    'openai': ('openai',),
+    'pdf2image': ('pdf2image',),
+    'pypdfium2': ('pypdfium2',),
+    'docling': (
+        'docling.document_converter',
+        'docling.datamodel.base_models',
+        'docling.datamodel.pipeline_options',
+    ),
+    'easyocr': ('easyocr',),
+}
+
+# Comma separated backends loaded in the background when a worker starts
+BACKEND_PRELOAD = [name.strip() for name in os.getenv('BACKEND_PRELOAD', 'openai,pypdfium2').split(',') if name.strip()]
+
+_state = {name: {'state': 'not_loaded', 'seconds': None, 'error': None} for name in BACKENDS}
+_locks = {name: threading.Lock() for name in BACKENDS}
+_available = {}
+
+
+def is_available(name):
+    """True if the backend's package is installed, without importing it"""
+    if name not in _available:
+        package = BACKENDS[name][0].split('.')[0]
+        _available[name] = importlib.util.find_spec(package) is not None
+    return _available[name]
+
+
+def load(name):
+    """Import a backend once and return its main module; raises ImportError if it cannot load"""
+    state = _state[name]
+    if state['state'] == 'ready':
+        return sys.modules[BACKENDS[name][0]]
+
+    with _locks[name]:
+        if state['state'] != 'ready':
+            if not is_available(name):
+                state.update(state='missing', error=f'{name} is not installed')
+                raise ImportError(state['error'])
+            print(f"Loading backend {name}...")
+            state.update(state='loading', error=None)
+            started = time.time()
+            try:
+                for module in BACKENDS[name]:
+                    importlib.import_module(module)
+            except Exception as e:
+                state.update(state='failed', error=str(e))
+                raise ImportError(f'{name} failed to load: {e}') from e
+            state.update(state='ready', seconds=round(time.time() - started, 3))
+            print(f"Backend {name} ready in {state['seconds']:.2f}s")
+    return sys.modules[BACKENDS[name][0]]
+
+
+def is_ready(name):
+    return _state[name]['state'] == 'ready'
+
+
+def status():
+    """Readiness of every backend in this worker"""
+    return {
+        name: dict(state, available=is_available(name), ready=state['state'] == 'ready')
+        for name, state in _state.items()
+    }
+
+
+def preload(names=None):
+    """Load backends in a background thread so startup is not blocked"""
+    names = [name for name in (BACKEND_PRELOAD if names is None else names) if name in BACKENDS]
+
+    def _load():
+        for name in names:
+            if not is_available(name):
+                continue
+            try:
+                load(name)
+            except ImportError as e:
+                print(f"Backend preload failed: {e}")
+
+    thread = threading.Thread(target=_load, name='backend-preload', daemon=True)
+    thread.start()
+    return thread
+
+
+def _cold_import_times(module):
+    """Run `python -X importtime -c 'import module'`.
+
+    Returns the module's total import seconds and the cumulative seconds of
+    each package it imports directly, slowest first.
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, BACKEND_PRELOAD='', DOCLING_WARMUP='False', EASYOCR_WARMUP='False')
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'import failed')
+
+    total = 0.0
+    children = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        _, cumulative, name = line.split('|')
+        try:
+            cumulative_seconds = int(cumulative) / 1e6
+        except ValueError:
+            continue  # header line
+        # Nesting is shown by two spaces per level after the separator's own space
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        name = name.strip()
+        # A module is reported after everything it imported
+        if depth == 0:
+            if name == module:
+                total = cumulative_seconds
+                break
+            children = []
+        elif depth == 1:
+            children.append((cumulative_seconds, name))
+    return total, sorted(children, reverse=True)
+
+
+def _cold_load_seconds(name):
+    """Load one backend in a fresh interpreter and return the seconds it took"""
+    completed = subprocess.run(
+        [sys.executable, '-c',
+         f"import time, backends; started = time.perf_counter(); backends.load({name!r}); "
+         f"print(time.perf_counter() - started)"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if completed.returncode != 0:
+        return None
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+def startup_report(module='app', top=15):
+    """Print how long a cold import of the service takes and what each backend would add"""
+    print(f"Cold import of {module} (heavy backends are loaded lazily):")
+    try:
+        total, packages = _cold_import_times(module)
+        print(f"  total {total:.2f}s, slowest direct imports:")
+        for seconds, package in packages[:top]:
+            print(f"  {seconds:>7.3f}s  {package}")
+    except RuntimeError as e:
+        print(f"  failed: {e}")
+
+    print("Backend load times on first use:")
+    for name in BACKENDS:
+        if not is_available(name):
+            print(f"  {'-':>7}   {name} (not installed)")
+            continue
+        seconds = _cold_load_seconds(name)
+        print(f"  {seconds:>7.3f}s  {name}" if seconds is not None else f"  {'failed':>7}   {name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backend registry utilities")
+    parser.add_argument('--startup-report', action='store_true', help="Print an import-time breakdown of a cold start")
+    parser.add_argument('--module', default='app', help="Service module to import for the report (default: app)")
+    args = parser.parse_args()
+    if args.startup_report:
+        startup_report(args.module)
+    else:
+        parser.print_help()
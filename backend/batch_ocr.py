@@ -0,0 +1,222 @@
+"""
+Batch API mode for page OCR.
+
+Instead of one interactive chat completion per page, every page is rendered
+and encoded up front into JSONL request files in the OpenAI Batch API format
+(one line per page, custom_id "page-<n>"), which are submitted and polled
+until done; the results are merged back by custom_id. Batches are billed at
+batch pricing and run against the batch quota rather than the interactive
+rate limits, at the price of finishing within BATCH_COMPLETION_WINDOW.
+
+Submitted batch ids are kept in a state file next to the output, so an
+interrupted run picks up the same batches instead of paying for new ones.
+FixtureBatchRunner stands in for the API by replaying a file of recorded
+batch output lines, for offline runs and testing.
+"""
+import json
+import os
+import time
+
+from vision_ocr import vision_request
+
+BATCH_POLL_SECONDS = float(os.getenv('BATCH_POLL_SECONDS', '60'))
+BATCH_COMPLETION_WINDOW = os.getenv('BATCH_COMPLETION_WINDOW', '24h')
+# The Batch API takes input files up to 200MB; bigger jobs are split into several batches
+BATCH_MAX_FILE_BYTES = int(os.getenv('BATCH_MAX_FILE_BYTES', str(190 * 1024 * 1024)))
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+_FINISHED_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+def custom_id(page_number):
+    return f"page-{page_number}"
+
+
+def page_of(custom_id):
+    return int(custom_id.rsplit('-', 1)[1])
+
+
+def write_batch_files(base_path, payloads, max_bytes=BATCH_MAX_FILE_BYTES):
+    """Write (page_number, img_base64, mime_type) payloads as batch request lines.
+
+    Returns [(path, page_numbers)], one file per batch of at most max_bytes.
+    """
+    files = []
+    f = None
+    size = 0
+    try:
+        for page_number, img_base64, mime_type in payloads:
+            line = json.dumps({
+                'custom_id': custom_id(page_number),
+                'method': 'POST',
+                'url': BATCH_ENDPOINT,
+                'body': vision_request(img_base64, mime_type=mime_type),
+            }).encode('utf-8') + b'\n'
+            if f is None or (size and size + len(line) > max_bytes):
+                if f is not None:
+                    f.close()
+                path = f"{base_path}.{len(files) + 1}.jsonl"
+                f = open(path, 'wb')
+                files.append((path, []))
+                size = 0
+            f.write(line)
+            size += len(line)
+            files[-1][1].append(page_number)
+    finally:
+        if f is not None:
+            f.close()
+    return files
+
+
+def parse_output_line(line):
+    """(page_number, result) from one line of batch output or error file"""
+    record = json.loads(line)
+    result = {'page': page_of(record['custom_id'])}
+    response = record.get('response') or {}
+    body = response.get('body') or {}
+    if record.get('error') or response.get('status_code') != 200:
+        error = record.get('error') or body.get('error') or {}
+        message = error.get('message') if isinstance(error, dict) else str(error)
+        result.update(status='error', error=f"Batch request failed: {message or response.get('status_code')}")
+    else:
+        usage = body.get('usage') or {}
+        result.update(status='ok', markdown=body['choices'][0]['message']['content'] or '',
+                      usage={'prompt_tokens': usage.get('prompt_tokens', 0),
+                             'completion_tokens': usage.get('completion_tokens', 0)})
+    return result['page'], result
+
+
+class OpenAIBatchRunner:
+    """Submits request files to the OpenAI Batch API"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, path):
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=BATCH_COMPLETION_WINDOW,
+                                           metadata={'source': os.path.basename(path)})
+        return batch.id
+
+    def poll(self, batch_id):
+        """(status, completed, failed, total)"""
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return (batch.status, counts.completed if counts else 0, counts.failed if counts else 0,
+                counts.total if counts else 0)
+
+    def output(self, batch_id):
+        """Output and error file lines of a finished batch"""
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        # An expired or cancelled batch still returns the requests it finished
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines += self.client.files.content(file_id).text.splitlines()
+        return [line for line in lines if line.strip()]
+
+
+class FixtureBatchRunner:
+    """Local stand-in for the Batch API: answers each request from recorded batch output lines"""
+
+    def __init__(self, fixture_path):
+        self.responses = {}
+        with open(fixture_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    self.responses[json.loads(line)['custom_id']] = line.strip()
+
+    def submit(self, path):
+        return f"fixture:{path}"
+
+    def poll(self, batch_id):
+        total = len(self._custom_ids(batch_id))
+        return 'completed', total, 0, total
+
+    def output(self, batch_id):
+        return [self.responses.get(request_id) or json.dumps({
+            'custom_id': request_id, 'response': None,
+            'error': {'code': 'fixture_missing', 'message': 'no recorded response'}})
+            for request_id in self._custom_ids(batch_id)]
+
+    @staticmethod
+    def _custom_ids(batch_id):
+        with open(batch_id.split(':', 1)[1], encoding='utf-8') as f:
+            return [json.loads(line)['custom_id'] for line in f if line.strip()]
+
+
+class BatchJob:
+    """Batches submitted for one conversion, remembered in a state file until merged"""
+
+    def __init__(self, state_path, runner, pdf_digest, page_numbers, batches=None, skipped=None):
+        self.state_path = state_path
+        self.runner = runner
+        self.pdf_digest = pdf_digest
+        self.page_numbers = sorted(page_numbers)
+        # [{'id', 'path', 'pages'}]
+        self.batches = batches or []
+        # Pages left out of the batches: page number -> (reason, earlier page it repeats)
+        self.skipped = skipped if skipped is not None else {}
+
+    @classmethod
+    def load(cls, state_path, runner, pdf_digest, page_numbers):
+        """The job submitted earlier for (at least) these pages of this PDF, or None"""
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # A resumed conversion asks for fewer pages than were submitted
+        if state.get('pdf_digest') != pdf_digest or not set(page_numbers) <= set(state['pages']):
+            return None
+        skipped = {int(page): tuple(reason) for page, reason in state.get('skipped', {}).items()}
+        return cls(state_path, runner, pdf_digest, state['pages'], state['batches'], skipped)
+
+    def _save(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pdf_digest': self.pdf_digest, 'pages': self.page_numbers, 'batches': self.batches,
+                       'skipped': self.skipped}, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def submit(self, files):
+        for path, pages in files:
+            batch_id = self.runner.submit(path)
+            self.batches.append({'id': batch_id, 'path': path, 'pages': pages})
+            # Saved after each submit so a crash never loses track of a batch being paid for
+            self._save()
+            print(f"Submitted batch {batch_id} ({len(pages)} pages, {os.path.getsize(path) / 1024 / 1024:.1f}MB)")
+
+    def wait(self, poll_seconds=BATCH_POLL_SECONDS):
+        pending = {batch['id'] for batch in self.batches}
+        while True:
+            for batch_id in sorted(pending):
+                status, completed, failed, total = self.runner.poll(batch_id)
+                print(f"Batch {batch_id}: {status}, {completed}/{total} done, {failed} failed")
+                if status in _FINISHED_STATUSES:
+                    pending.discard(batch_id)
+            if not pending:
+                return
+            time.sleep(poll_seconds)
+
+    def results(self):
+        """{page_number: result} for every submitted page"""
+        results = {}
+        for batch in self.batches:
+            for line in self.runner.output(batch['id']):
+                page_number, result = parse_output_line(line)
+                results[page_number] = result
+            for page_number in batch['pages']:
+                results.setdefault(page_number, {'page': page_number, 'status': 'error',
+                                                 'error': 'No result returned by the batch'})
+        return results
+
+    def discard(self):
+        """Forget the job once its results are merged"""
+        for batch in self.batches:
+            if os.path.exists(batch['path']):
+                os.remove(batch['path'])
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
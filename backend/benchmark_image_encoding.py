@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Offline size/quality benchmark for the OCR image encoding profiles.
+
+Renders sample pages of a PDF and encodes each one with several profiles,
+reporting payload bytes, estimated image tokens and encode time against the
+plain colour PNG the pipeline used to send. With --ocr each profile is also
+sent to the vision model and its text compared with the PNG baseline output.
+
+Usage:
+  python benchmark_image_encoding.py data/sample.pdf --pages 1-3
+  python benchmark_image_encoding.py data/sample.pdf --pages 2 --dpi 150 --ocr
+"""
+import argparse
+import difflib
+import os
+import time
+
+from dotenv import load_dotenv
+from pdf2image import convert_from_path
+from image_encoding import encode_image, estimate_image_tokens, png_size
+
+PROFILES = [
+    ('png-colour (baseline)', dict(image_format='PNG', grayscale=False, trim=False, max_dimension=0)),
+    ('png-gray-trim', dict(image_format='PNG', grayscale=True, trim=True, max_dimension=2048)),
+    ('jpeg-gray-q85', dict(image_format='JPEG', quality=85, grayscale=True, trim=True, max_dimension=2048)),
+    ('jpeg-gray-q70', dict(image_format='JPEG', quality=70, grayscale=True, trim=True, max_dimension=2048)),
+    ('webp-gray-q80', dict(image_format='WEBP', quality=80, grayscale=True, trim=True, max_dimension=2048)),
+    ('jpeg-gray-q85-1536', dict(image_format='JPEG', quality=85, grayscale=True, trim=True, max_dimension=1536)),
+]
+
+
+def parse_pages(spec):
+    """Parse '3' or '1-5' into a list of page numbers"""
+    if '-' in spec:
+        start, end = spec.split('-', 1)
+        return list(range(int(start), int(end) + 1))
+    return [int(spec)]
+
+
+def run_benchmark(pdf_path, pages, dpi, run_ocr):
+    client = None
+    if run_ocr:
+        load_dotenv()
+        from openai import OpenAI
+        from vision_ocr import ocr_image_base64
+        client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+
+    totals = {name: {'bytes': 0, 'tokens': 0, 'seconds': 0.0, 'similarity': []} for name, _ in PROFILES}
+    baseline_bytes = 0
+    baseline_tokens = 0
+
+    for page_number in pages:
+        image = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)[0]
+        baseline_bytes += png_size(image)
+        baseline_tokens += estimate_image_tokens(*image.size)
+        print(f"📄 Page {page_number}: {image.size[0]}x{image.size[1]} at {dpi} DPI")
+
+        baseline_text = None
+        for name, options in PROFILES:
+            started = time.time()
+            img_base64, mime_type, stats = encode_image(image, report_savings=False, **options)
+            elapsed = time.time() - started
+            totals[name]['bytes'] += stats['bytes']
+            totals[name]['tokens'] += stats['estimated_tokens']
+            totals[name]['seconds'] += elapsed
+
+            line = f"   {name:<22} {stats['bytes'] / 1024:>8.0f}KB  ~{stats['estimated_tokens']:>5} tokens  {elapsed * 1000:>6.0f}ms"
+            if client:
+                response = ocr_image_base64(client, img_base64, mime_type=mime_type)
+                text = response.choices[0].message.content or ''
+                if baseline_text is None:
+                    baseline_text = text
+                similarity = difflib.SequenceMatcher(None, baseline_text, text).ratio()
+                totals[name]['similarity'].append(similarity)
+                line += f"  similarity {similarity:.3f}  prompt tokens {response.usage.prompt_tokens}"
+            print(line)
+
+    print("\n📊 Totals")
+    print(f"   plain PNG upload: {baseline_bytes / 1024:.0f}KB, ~{baseline_tokens} image tokens")
+    for name, _ in PROFILES:
+        total = totals[name]
+        saved = 100 * (1 - total['bytes'] / baseline_bytes) if baseline_bytes else 0
+        line = (f"   {name:<22} {total['bytes'] / 1024:>8.0f}KB ({saved:5.1f}% smaller)  "
+                f"~{total['tokens']:>6} tokens  {total['seconds'] * 1000:>7.0f}ms encode")
+        if total['similarity']:
+            line += f"  mean similarity {sum(total['similarity']) / len(total['similarity']):.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark OCR image encoding profiles")
+    parser.add_argument("pdf_file", help="PDF with sample pages")
+    parser.add_argument("--pages", default="1", help="Page or range to sample, e.g. 3 or 1-5 (default: 1)")
+    parser.add_argument("--dpi", type=int, default=300, help="Render DPI (default: 300)")
+    parser.add_argument("--ocr", action="store_true", help="Also OCR each profile and compare text with the PNG baseline")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.pdf_file):
+        print(f"❌ File not found: {args.pdf_file}")
+    else:
+        run_benchmark(args.pdf_file, parse_pages(args.pages), args.dpi, args.ocr)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Render throughput benchmark: pdf2image (a pdftoppm process per page) against
+pdfium (document opened once, pages rendered in memory), in-process and with
+a pool of render processes.
+
+Each engine renders the same pages through page_render.iter_rendered_pages,
+the way the converter and the service use it, and reports pages per second.
+
+Usage:
+  python benchmark_render.py data/sample.pdf
+  python benchmark_render.py data/sample.pdf --pages 1-40 --dpi 150 --workers 4
+"""
+import argparse
+import os
+import time
+
+import backends
+import page_render
+
+
+def parse_pages(spec, total):
+    """Parse '3' or '1-5' into a list of page numbers; empty means the whole document"""
+    if not spec:
+        return list(range(1, total + 1))
+    if '-' in spec:
+        start, end = spec.split('-', 1)
+        return list(range(int(start), min(int(end), total) + 1))
+    return [int(spec)]
+
+
+def run(label, engine, pdf_path, pages, dpi, workers):
+    page_render.RENDER_ENGINE = engine
+    # Open and close cached documents count toward the run that needs them
+    page_render._open_documents.clear()
+    started = time.perf_counter()
+    errors = 0
+    for _, image, error in page_render.iter_rendered_pages(pdf_path, pages, dpi, workers=workers):
+        if error is not None:
+            errors += 1
+            if errors == 1:
+                print(f"   ⚠️  {label}: {error}")
+        del image
+    elapsed = time.perf_counter() - started
+    rendered = len(pages) - errors
+    print(f"   {label:<28} {elapsed:>7.2f}s  {rendered / elapsed:>7.1f} pages/s" +
+          (f"  ({errors} failed)" if errors else ""))
+    return rendered / elapsed if rendered else 0
+
+
+def run_benchmark(pdf_path, pages_spec, dpi, workers):
+    total = page_render.page_count(pdf_path)
+    pages = parse_pages(pages_spec, total)
+    print(f"📄 {pdf_path}: rendering {len(pages)} of {total} pages at {dpi} DPI")
+
+    results = {}
+    if backends.is_available('pdf2image'):
+        results['pdf2image'] = run('pdf2image', 'pdf2image', pdf_path, pages, dpi, 1)
+    else:
+        print("   pdf2image not installed, skipping")
+    if backends.is_available('pypdfium2'):
+        results['pdfium'] = run('pdfium', 'pdfium', pdf_path, pages, dpi, 1)
+        if workers > 1:
+            results[f'pdfium x{workers}'] = run(f'pdfium, {workers} processes', 'pdfium', pdf_path, pages, dpi, workers)
+    else:
+        print("   pypdfium2 not installed, skipping")
+
+    baseline = results.get('pdf2image')
+    if baseline:
+        print("\n📊 Speed-up over pdf2image")
+        for name, rate in results.items():
+            if name != 'pdf2image':
+                print(f"   {name:<28} {rate / baseline:>5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark page rendering engines")
+    parser.add_argument("pdf_file", help="PDF to render")
+    parser.add_argument("--pages", help="Page or range to render, e.g. 3 or 1-40 (default: all)")
+    parser.add_argument("--dpi", type=int, default=150, help="Render DPI (default: 150)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Render processes for the parallel pdfium run (default: CPU count)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.pdf_file):
+        print(f"❌ File not found: {args.pdf_file}")
+    else:
+        run_benchmark(args.pdf_file, args.pages, args.dpi, args.workers)
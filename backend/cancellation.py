@@ -0,0 +1,98 @@
+"""
+Cancellation of in-flight OCR requests.
+
+Each /convert-pdf-ocr request gets a CancelToken, registered under its request
+id (the `requestId` form field or X-Request-Id header, or a generated one). The
+page pipeline checks the token before rendering a page and before each OCR
+engine, and stops queuing pages once it is set, so a cancelled request stops
+spending renders and API calls within a page. Tokens are cancelled when the
+client disconnects, or by DELETE /requests/<id>: the request may be running in
+another worker, so the owning worker sees a marker file under CANCEL_DIR on its
+next check.
+"""
+import os
+import re
+import tempfile
+import threading
+import uuid
+
+import process_identity
+
+CANCEL_DIR = os.getenv('CANCEL_DIR', os.path.join(tempfile.gettempdir(), 'examtopics-cancel'))
+# How often waiting code re-checks for a disconnect or a cancel from another worker
+CANCEL_POLL_SECONDS = float(os.getenv('CANCEL_POLL_SECONDS', '0.5'))
+
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+os.makedirs(CANCEL_DIR, exist_ok=True)
+
+
+class Cancelled(Exception):
+    """Raised by the page pipeline once its request has been cancelled"""
+
+
+class CancelToken:
+    def __init__(self, request_id=None, check=None):
+        self.request_id = request_id
+        self.reason = None
+        self._check = check
+        self._event = threading.Event()
+        self.closed = threading.Event()
+
+    def cancel(self, reason='cancelled'):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+            print(f"Request {self.request_id or ''} cancelled ({reason})")
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self._check is not None and self._check():
+            self.cancel('delete')
+        return self._event.is_set()
+
+
+def _marker(request_id, kind):
+    return os.path.join(CANCEL_DIR, f'{request_id}.{kind}')
+
+
+def request_id_from(value):
+    """The client's request id if it is usable as one, else a new id"""
+    return value if value and _REQUEST_ID.match(value) else uuid.uuid4().hex
+
+
+def register(request_id):
+    """Token for a request starting in this worker"""
+    try:
+        os.remove(_marker(request_id, 'cancel'))  # left over from an earlier request with this id
+    except FileNotFoundError:
+        pass
+    with open(_marker(request_id, 'active'), 'w') as f:
+        f.write(process_identity.current())
+    return CancelToken(request_id, check=lambda: os.path.exists(_marker(request_id, 'cancel')))
+
+
+def unregister(token):
+    """The request has finished; stop any disconnect watcher and forget its markers"""
+    token.closed.set()
+    for kind in ('active', 'cancel'):
+        try:
+            os.remove(_marker(token.request_id, kind))
+        except FileNotFoundError:
+            pass
+
+
+def cancel_request(request_id):
+    """Ask whichever worker runs this request to cancel it; False if no such request is running"""
+    if not _REQUEST_ID.match(request_id):
+        return False
+    try:
+        with open(_marker(request_id, 'active')) as f:
+            owner = f.read().strip()
+    except FileNotFoundError:
+        return False
+    # A worker that exited mid-request leaves its marker behind
+    if not owner or not process_identity.is_alive(owner):
+        return False
+    open(_marker(request_id, 'cancel'), 'w').close()
+    return True
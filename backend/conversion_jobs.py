@@ -0,0 +1,301 @@
+"""
+Asynchronous whole-document OCR jobs.
+
+A job converts a page range of a stored PDF in a background thread of the worker
+that accepted it. Job and per-page state live in a small SQLite database so any
+gunicorn worker can answer progress polls, and the work carries on after the
+HTTP request that created the job has returned. DELETE /jobs/<id> marks a job
+'cancelled' in the database; the worker running it sees that before its next
+page stage and stops.
+
+Gunicorn recycles workers (--max-requests) and kills stuck ones (--timeout),
+taking their job threads with them. A job whose worker has exited is taken
+over by the next worker that looks at it (on startup, or when the job is
+polled) and resumed for the pages it has no result for yet; pages converted
+before are answered from the page cache. After JOB_MAX_RESUMES takeovers the
+job is marked 'interrupted'.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import backends
+import metrics
+import process_identity
+from cancellation import CancelToken
+from ocr_engines import build_chain, needs_client
+from page_ocr import OCR_MAX_WORKERS, iter_ocr_pages
+
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', os.path.expanduser('~/.cache/examtopics/jobs.sqlite3'))
+# Jobs running at the same time in one worker; their pages share the page OCR pool
+JOB_MAX_CONCURRENT = int(os.getenv('JOB_MAX_CONCURRENT', '2'))
+JOB_RETENTION_HOURS = int(os.getenv('JOB_RETENTION_HOURS', '24'))
+# Pages a job keeps queued on the shared pool, so interactive requests are not stuck behind a whole document
+JOB_PAGE_WINDOW = int(os.getenv('JOB_PAGE_WINDOW', str(max(1, OCR_MAX_WORKERS // 2))))
+# Times a job is resumed by another worker after its own worker exited
+JOB_MAX_RESUMES = int(os.getenv('JOB_MAX_RESUMES', '3'))
+
+FINISHED_STATUSES = ('completed', 'failed', 'interrupted', 'cancelled')
+
+
+def _owner(job):
+    # Jobs created before owners were named by pid and start time only have the pid
+    return job['owner'] or str(job['owner_pid'])
+
+
+def _owner_alive(job):
+    return process_identity.is_alive(_owner(job))
+
+
+class JobStore:
+    """SQLite record of jobs and their per-page results"""
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                status TEXT NOT NULL,
+                start_page INTEGER NOT NULL,
+                end_page INTEGER NOT NULL,
+                total_pages INTEGER NOT NULL,
+                error TEXT,
+                owner_pid INTEGER,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL,
+                pdf_path TEXT,
+                engines TEXT,
+                resumes INTEGER NOT NULL DEFAULT 0,
+                owner TEXT
+            )
+        """)
+        # Databases created before jobs could be resumed lack these columns
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (('pdf_path', 'TEXT'), ('engines', 'TEXT'),
+                                   ('resumes', 'INTEGER NOT NULL DEFAULT 0'), ('owner', 'TEXT')):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_pages (
+                job_id TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                markdown TEXT,
+                error TEXT,
+                cached INTEGER NOT NULL DEFAULT 0,
+                seconds REAL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (job_id, page)
+            )
+        """)
+        self._conn.commit()
+
+    def create(self, digest, start_page, end_page, pdf_path=None, engines=None):
+        """New queued job; pdf_path and the engine names let another worker resume it"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            self._conn.execute(
+                "INSERT INTO jobs (id, digest, status, start_page, end_page, total_pages, owner_pid, owner, "
+                "created_at, updated_at, pdf_path, engines) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, digest, start_page, end_page, end_page - start_page + 1, os.getpid(),
+                 process_identity.current(), now, now, pdf_path, engines)
+            )
+            self._conn.commit()
+        return job_id
+
+    def set_status(self, job_id, status, error=None):
+        """Update a job's status unless it has been cancelled; False if it was"""
+        now = time.time()
+        finished_at = now if status in FINISHED_STATUSES else None
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE jobs SET status=?, error=?, updated_at=?, finished_at=? WHERE id=? AND status != 'cancelled'",
+                (status, error, now, finished_at, job_id)
+            ).rowcount
+            self._conn.commit()
+        return bool(updated)
+
+    def cancel(self, job_id):
+        """Mark a queued or running job cancelled; False if it had already finished"""
+        now = time.time()
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE jobs SET status='cancelled', error='Cancelled by client', updated_at=?, finished_at=? "
+                "WHERE id=? AND status IN ('queued', 'running')",
+                (now, now, job_id)
+            ).rowcount
+            self._conn.commit()
+        return bool(updated)
+
+    def is_cancelled(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return row is not None and row['status'] == 'cancelled'
+
+    def record_page(self, job_id, result):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, result['page'], result['status'], result.get('markdown'), result.get('error'),
+                 int(result.get('cached', False)), result.get('seconds'), now)
+            )
+            self._conn.execute("UPDATE jobs SET updated_at=? WHERE id=?", (now, job_id))
+            self._conn.commit()
+
+    def get(self, job_id):
+        """Job row as a dict, or None; an orphaned job is taken over and resumed by this worker"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job['status'] not in FINISHED_STATUSES and not _owner_alive(job):
+            job = _take_over(self, job)
+        return job
+
+    def orphaned(self):
+        """Queued or running jobs whose worker has exited"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        return [dict(row) for row in rows if not _owner_alive(row)]
+
+    def claim(self, job):
+        """Make this worker the owner of an orphaned job; False if another worker got there first"""
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE jobs SET owner_pid=?, owner=?, status='queued', resumes=resumes + 1, updated_at=? "
+                "WHERE id=? AND COALESCE(owner, CAST(owner_pid AS TEXT))=? AND status IN ('queued', 'running')",
+                (os.getpid(), process_identity.current(), time.time(), job['id'], _owner(job))
+            ).rowcount
+            self._conn.commit()
+        return bool(updated)
+
+    def pages(self, job_id, after_page=None):
+        """Finished pages of a job in page order, optionally only those after a page number"""
+        query = "SELECT * FROM job_pages WHERE job_id=?"
+        params = [job_id]
+        if after_page is not None:
+            query += " AND page > ?"
+            params.append(after_page)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY page", params).fetchall()
+        pages = []
+        for row in rows:
+            page = dict(row, cached=bool(row['cached']))
+            del page['job_id']
+            pages.append(page)
+        return pages
+
+    def _purge_expired(self, now):
+        cutoff = now - JOB_RETENTION_HOURS * 3600
+        self._conn.execute(
+            "DELETE FROM job_pages WHERE job_id IN (SELECT id FROM jobs WHERE created_at < ?)", (cutoff,)
+        )
+        self._conn.execute("DELETE FROM jobs WHERE created_at < ?", (cutoff,))
+
+
+job_store = JobStore()
+_job_executor = ThreadPoolExecutor(max_workers=JOB_MAX_CONCURRENT, thread_name_prefix='ocr-job')
+
+
+def _run_job(job_id, pdf_path, digest, page_numbers, openai_api_key, engines):
+    if not job_store.set_status(job_id, 'running'):
+        print(f"Job {job_id}: cancelled before it started")
+        metrics.inc('cancelled_pages_total', len(page_numbers), state='queued')
+        metrics.inc('cancelled_requests_total', kind='job', reason='delete')
+        return
+    print(f"Job {job_id}: converting {len(page_numbers)} page(s) of {digest}")
+    cancel = CancelToken(job_id, check=lambda: job_store.is_cancelled(job_id))
+    try:
+        client = backends.load('openai').OpenAI(api_key=openai_api_key) if needs_client(engines) else None
+        for result in iter_ocr_pages(client, pdf_path, digest, page_numbers, window=JOB_PAGE_WINDOW, engines=engines,
+                                     cancel=cancel):
+            if result['status'] == 'cancelled':
+                continue
+            job_store.record_page(job_id, result)
+
+        if cancel.cancelled:
+            print(f"Job {job_id}: cancelled")
+            metrics.inc('cancelled_requests_total', kind='job', reason='delete')
+            return
+
+        # Counted over the whole job, including pages converted before a resume
+        pages = job_store.pages(job_id)
+        failed = sum(1 for page in pages if page['status'] != 'ok')
+        if failed == len(pages):
+            job_store.set_status(job_id, 'failed', 'Failed to extract text from any page')
+        else:
+            job_store.set_status(job_id, 'completed')
+        print(f"Job {job_id}: finished, {len(pages) - failed} page(s) converted, {failed} failed")
+    except Exception as e:
+        print(f"Job {job_id}: failed: {e}")
+        job_store.set_status(job_id, 'failed', str(e))
+
+
+def submit_job(pdf_path, digest, start_page, end_page, openai_api_key, engines=None):
+    """Create a job for a page range and start it in the background; engines is an OCR engine chain"""
+    engine_names = ','.join(engine.name for engine in engines) if engines else None
+    job_id = job_store.create(digest, start_page, end_page, pdf_path, engine_names)
+    page_numbers = list(range(start_page, end_page + 1))
+    _job_executor.submit(_run_job, job_id, pdf_path, digest, page_numbers, openai_api_key, engines)
+    return job_id
+
+
+def _take_over(store, job):
+    """Resume an orphaned job in this worker, or mark it interrupted; returns the updated job"""
+    reason = None
+    if job['resumes'] >= JOB_MAX_RESUMES:
+        reason = f"Worker process exited before the job finished ({job['resumes']} resume(s) already)"
+    elif not job['pdf_path'] or not os.path.exists(job['pdf_path']):
+        reason = 'Worker process exited before the job finished, and its PDF is no longer stored'
+    if reason:
+        store.set_status(job['id'], 'interrupted', reason)
+        return dict(job, status='interrupted', error=reason)
+    if not store.claim(job):
+        # Another worker resumed it first
+        return store.get(job['id'])
+    done = {page['page'] for page in store.pages(job['id'])}
+    page_numbers = [page for page in range(job['start_page'], job['end_page'] + 1) if page not in done]
+    print(f"Job {job['id']}: worker {job['owner_pid']} exited, resuming {len(page_numbers)} page(s)")
+    metrics.inc('job_resumes_total')
+    try:
+        engines = build_chain(job['engines']) if job['engines'] else None
+    except ValueError as e:
+        store.set_status(job['id'], 'failed', str(e))
+        return store.get(job['id'])
+    _job_executor.submit(_run_job, job['id'], job['pdf_path'], job['digest'], page_numbers,
+                         os.environ.get('OPENAI_API_KEY'), engines)
+    return dict(job, status='queued', owner_pid=os.getpid(), owner=process_identity.current(),
+                resumes=job['resumes'] + 1)
+
+
+def resume_orphaned_jobs():
+    """Take over the jobs of exited workers; called when a worker starts"""
+    for job in job_store.orphaned():
+        _take_over(job_store, job)
+
+
+def job_progress(job, pages):
+    """Progress counters for a job given its finished pages"""
+    failed = sum(1 for page in pages if page['status'] != 'ok')
+    return {
+        'total': job['total_pages'],
+        'completed': len(pages) - failed,
+        'failed': failed,
+        'remaining': job['total_pages'] - len(pages)
+    }
@@ -0,0 +1,231 @@
+"""
+Checkpoint manifest for resumable markdown conversions.
+
+The standalone converter appends each finished page to the output markdown
+and then records it in a sidecar manifest (<output>.manifest.json): the
+page's engine, token usage, and the byte offset, length and SHA-256 of its
+text in the markdown file. Failed pages are recorded with their error. The
+manifest is replaced atomically after every page, and entries are only
+trusted while their bytes in the markdown still match, so after a crash,
+OOM or Ctrl-C `--resume` keeps every page that made it to disk, drops any
+half-written tail and converts only failed or missing pages.
+
+Pages read by a fallback OCR engine are marked `fallback` and kept, but they
+do not count as finished: `--resume` tries the first engine on them again,
+and only replaces their text when that succeeds.
+
+Retried pages are appended after the pages already written, and at the end
+of the run the file is rewritten in page order (dropping the text of
+replaced pages). The rewrite is journalled in
+the manifest so an interruption cannot leave the two files disagreeing.
+"""
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_VERSION = 1
+_SEPARATOR = b'\n\n---\n\n'
+
+
+def manifest_path(output_path):
+    return f"{output_path}.manifest.json"
+
+
+def _write_atomic(path, data):
+    """Replace a file with `data` so readers see the old or the new content, never a mix"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _page_bytes(page_num, markdown):
+    return f"# Page {page_num}\n\n{markdown}".encode('utf-8')
+
+
+class ConversionManifest:
+    """Pages of one PDF converted into one markdown file"""
+
+    def __init__(self, output_path, pdf_path, pdf_digest, pages=None, reorder=None):
+        self.output_path = output_path
+        self.path = manifest_path(output_path)
+        self.pdf_path = pdf_path
+        self.pdf_digest = pdf_digest
+        # str(page number) -> entry, as in the JSON file
+        self.pages = pages or {}
+        self._reorder = reorder
+
+    @classmethod
+    def start(cls, output_path, pdf_path, pdf_digest):
+        """Begin a fresh conversion: empty markdown and manifest"""
+        manifest = cls(output_path, pdf_path, pdf_digest)
+        _write_atomic(output_path, b'')
+        manifest._save()
+        return manifest
+
+    @classmethod
+    def resume(cls, output_path, pdf_path, pdf_digest):
+        """Reopen an earlier conversion of the same PDF, or None if there is nothing to resume.
+
+        Raises ValueError when the manifest belongs to a different PDF.
+        """
+        try:
+            with open(manifest_path(output_path), encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get('pdf_digest') != pdf_digest:
+            raise ValueError(f"{output_path} was converted from a different PDF ({data.get('source')})")
+        manifest = cls(output_path, pdf_path, pdf_digest, data.get('pages'), data.get('reorder'))
+        manifest._finish_reorder()
+        manifest._verify()
+        return manifest
+
+    def finished_pages(self):
+        return {int(page) for page, entry in self.pages.items()
+                if entry['status'] == 'ok' and not entry.get('fallback')}
+
+    def fallback_pages(self):
+        return {int(page) for page, entry in self.pages.items()
+                if entry['status'] == 'ok' and entry.get('fallback')}
+
+    def failed_pages(self):
+        return {int(page) for page, entry in self.pages.items() if entry['status'] == 'error'}
+
+    def _ok_entries(self):
+        return sorted((entry['offset'], int(page), entry) for page, entry in self.pages.items()
+                      if entry['status'] == 'ok')
+
+    def _end(self):
+        entries = self._ok_entries()
+        return entries[-1][0] + entries[-1][2]['length'] if entries else 0
+
+    def _save(self):
+        data = {
+            'version': MANIFEST_VERSION,
+            'source': os.path.basename(self.pdf_path),
+            'pdf_digest': self.pdf_digest,
+            'markdown': os.path.basename(self.output_path),
+            'updated_at': time.time(),
+            'pages': {page: self.pages[page] for page in sorted(self.pages, key=int)},
+        }
+        if self._reorder:
+            data['reorder'] = self._reorder
+        _write_atomic(self.path, json.dumps(data, indent=2).encode('utf-8'))
+
+    def _verify(self):
+        """Keep only entries whose bytes are intact, and cut the markdown after the last of them"""
+        try:
+            with open(self.output_path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            content = b''
+        dropped = []
+        for offset, page_num, entry in self._ok_entries():
+            chunk = content[offset:offset + entry['length']]
+            # Pages after a damaged one are dropped too, since they are appended after it
+            if dropped or hashlib.sha256(chunk).hexdigest() != entry['sha256']:
+                dropped.append(page_num)
+                del self.pages[str(page_num)]
+        if dropped:
+            print(f"Pages {', '.join(map(str, dropped))} no longer match {self.output_path}, converting them again")
+        end = self._end()
+        if len(content) != end:
+            if len(content) > end:
+                print(f"Dropping {len(content) - end} bytes written after the last recorded page")
+            with open(self.output_path, 'r+b' if os.path.exists(self.output_path) else 'wb') as f:
+                f.truncate(end)
+        self._save()
+
+    def record(self, page_num, markdown, engine, usage=None, cached=False, **extra):
+        """Append a finished page to the markdown file, then record it with any extra fields"""
+        data = _page_bytes(page_num, markdown)
+        with open(self.output_path, 'ab') as f:
+            if f.tell() > 0:
+                f.write(_SEPARATOR)
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pages[str(page_num)] = {
+            'status': 'ok',
+            'engine': engine,
+            'cached': cached,
+            'prompt_tokens': (usage or {}).get('prompt_tokens', 0),
+            'completion_tokens': (usage or {}).get('completion_tokens', 0),
+            'offset': offset,
+            'length': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            **{key: value for key, value in extra.items() if value is not None},
+        }
+        self._save()
+
+    def record_failure(self, page_num, error):
+        """Record a failed page, unless an earlier run left fallback text for it"""
+        if self.pages.get(str(page_num), {}).get('status') == 'ok':
+            return
+        self.pages[str(page_num)] = {'status': 'error', 'error': error}
+        self._save()
+
+    def _in_order(self, entries):
+        """Whether the pages fill the markdown back to back in page order"""
+        position = 0
+        for index, (offset, page_num, entry) in enumerate(entries):
+            if index and page_num < entries[index - 1][1]:
+                return False
+            if offset != position + (len(_SEPARATOR) if index else 0):
+                return False
+            position = offset + entry['length']
+        return True
+
+    def finalize(self):
+        """Rewrite the markdown in page order if retried pages were appended out of order,
+        or left the replaced text of a fallback page behind"""
+        entries = self._ok_entries()
+        if self._in_order(entries):
+            return False
+        with open(self.output_path, 'rb') as f:
+            content = f.read()
+        ordered = []
+        new_offsets = {}
+        position = 0
+        for _, page_num, entry in sorted(entries, key=lambda item: item[1]):
+            if ordered:
+                ordered.append(_SEPARATOR)
+                position += len(_SEPARATOR)
+            ordered.append(content[entry['offset']:entry['offset'] + entry['length']])
+            new_offsets[str(page_num)] = position
+            position += entry['length']
+        tmp_path = f"{self.output_path}.reorder"
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(ordered))
+            f.flush()
+            os.fsync(f.fileno())
+        # Journal first: a resume after a crash from here on completes the swap
+        self._reorder = {'path': tmp_path, 'offsets': new_offsets}
+        self._save()
+        self._finish_reorder()
+        return True
+
+    def _finish_reorder(self):
+        if not self._reorder:
+            return
+        if os.path.exists(self._reorder['path']):
+            os.replace(self._reorder['path'], self.output_path)
+        for page, offset in self._reorder['offsets'].items():
+            self.pages[page]['offset'] = offset
+        self._reorder = None
+        self._save()
+
+    def totals(self):
+        ok = [entry for entry in self.pages.values() if entry['status'] == 'ok']
+        return {
+            'pages': len(ok),
+            'failed': len(self.pages) - len(ok),
+            'fallback': sum(1 for entry in ok if entry.get('fallback')),
+            'prompt_tokens': sum(entry['prompt_tokens'] for entry in ok),
+            'completion_tokens': sum(entry['completion_tokens'] for entry in ok),
+        }
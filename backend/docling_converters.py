@@ -0,0 +1,112 @@
+"""
+Process-wide docling DocumentConverter instances.
+
+Building a DocumentConverter loads docling's layout, table and OCR models, which
+takes seconds and a lot of memory. Each worker process keeps one converter per
+pipeline configuration and reuses it for every request. docling itself (and
+torch with it) is only imported when the first converter is built.
+"""
+import os
+import threading
+import time
+
+import backends
+
+# Load the default pipeline's models when the worker starts instead of on the first request
+DOCLING_WARMUP = os.getenv('DOCLING_WARMUP', 'False').lower() == 'true'
+
+_converters = {}
+_convert_locks = {}
+_status = {}
+_lock = threading.Lock()
+
+
+def _config_key(do_ocr, do_table_structure):
+    return f"ocr={do_ocr},tables={do_table_structure}"
+
+
+def _build_converter(do_ocr, do_table_structure):
+    backends.load('docling')
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = do_ocr
+    pipeline_options.do_table_structure = do_table_structure
+    converter = DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+        }
+    )
+    # Load the pipeline models now rather than inside the first convert() call
+    converter.initialize_pipeline(InputFormat.PDF)
+    return converter
+
+
+def get_converter(do_ocr=True, do_table_structure=True):
+    """Return the shared converter for a pipeline configuration, building it once"""
+    key = _config_key(do_ocr, do_table_structure)
+    converter = _converters.get(key)
+    if converter is not None:
+        return converter
+
+    with _lock:
+        converter = _converters.get(key)
+        if converter is None:
+            print(f"Loading docling converter ({key})...")
+            _status[key] = 'loading'
+            started = time.time()
+            try:
+                converter = _build_converter(do_ocr, do_table_structure)
+            except Exception:
+                _status[key] = 'failed'
+                raise
+            _converters[key] = converter
+            _convert_locks[key] = threading.Lock()
+            _status[key] = 'ready'
+            print(f"Docling converter ({key}) ready in {time.time() - started:.1f}s")
+    return converter
+
+
+def is_available():
+    """True if docling is installed (without importing it)"""
+    return backends.is_available('docling')
+
+
+def convert(source, do_ocr=True, do_table_structure=True):
+    """Convert a document with the shared converter for this configuration.
+
+    docling pipelines are not guaranteed to be thread safe, so conversions that
+    share a converter are serialized within the worker.
+    """
+    converter = get_converter(do_ocr, do_table_structure)
+    with _convert_locks[_config_key(do_ocr, do_table_structure)]:
+        return converter.convert(source)
+
+
+def warm_up(configs=((True, True),)):
+    """Build converters in a background thread so startup is not blocked"""
+    def _load():
+        for do_ocr, do_table_structure in configs:
+            try:
+                get_converter(do_ocr, do_table_structure)
+            except Exception as e:
+                print(f"Docling warm-up failed ({_config_key(do_ocr, do_table_structure)}): {e}")
+
+    for do_ocr, do_table_structure in configs:
+        _status.setdefault(_config_key(do_ocr, do_table_structure), 'loading')
+    thread = threading.Thread(target=_load, name='docling-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def status():
+    """Readiness of each converter configuration in this worker"""
+    return dict(_status)
+
+
+def is_ready():
+    """True once at least one converter is loaded and none are still loading"""
+    states = _status.values()
+    return 'ready' in states and 'loading' not in states
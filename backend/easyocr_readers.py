@@ -0,0 +1,135 @@
+"""
+Process-wide EasyOCR readers.
+
+easyocr.Reader loads its detection and recognition networks from disk, so each
+worker builds at most one reader per language set and shares it between
+requests. A semaphore caps concurrent inference so parallel requests queue for
+a slot instead of oversubscribing the CPU cores. easyocr and torch are only
+imported when the first reader is built.
+
+Each reader holds its networks in memory, so only language sets made of
+EASYOCR_LANGUAGES can be requested, and at most EASYOCR_MAX_READERS readers
+are kept; the least recently used one is dropped to make room.
+"""
+import collections
+import os
+import threading
+import time
+
+import backends
+
+EASYOCR_MAX_CONCURRENCY = int(os.getenv('EASYOCR_MAX_CONCURRENCY', '1'))
+EASYOCR_GPU = os.getenv('EASYOCR_GPU', 'False').lower() == 'true'
+EASYOCR_WARMUP = os.getenv('EASYOCR_WARMUP', 'False').lower() == 'true'
+DEFAULT_LANGUAGES = ('en',)
+# Language codes clients may ask for
+EASYOCR_LANGUAGES = {lang.strip() for lang in os.getenv('EASYOCR_LANGUAGES', 'en').split(',') if lang.strip()}
+EASYOCR_MAX_READERS = int(os.getenv('EASYOCR_MAX_READERS', '2'))
+
+# Most recently used last
+_readers = collections.OrderedDict()
+_status = {}
+# Held while a reader loads; _readers_lock only guards the LRU order
+_lock = threading.Lock()
+_readers_lock = threading.Lock()
+_inference_slots = threading.BoundedSemaphore(EASYOCR_MAX_CONCURRENCY)
+_torch_threads_set = False
+
+
+def _limit_torch_threads():
+    """Split the CPU cores between the allowed concurrent inferences"""
+    try:
+        import torch
+    except ImportError:
+        return
+    threads = int(os.getenv('EASYOCR_TORCH_THREADS', '0')) or max(1, (os.cpu_count() or 1) // EASYOCR_MAX_CONCURRENCY)
+    torch.set_num_threads(threads)
+    print(f"EasyOCR: {EASYOCR_MAX_CONCURRENCY} concurrent inference(s), {threads} torch thread(s) each")
+
+
+def _load_easyocr():
+    """Import easyocr, sizing torch's thread pool the first time"""
+    global _torch_threads_set
+    easyocr = backends.load('easyocr')
+    if not _torch_threads_set:
+        _limit_torch_threads()
+        _torch_threads_set = True
+    return easyocr
+
+
+def _languages_key(languages):
+    return tuple(sorted(set(languages or DEFAULT_LANGUAGES)))
+
+
+def check_languages(languages):
+    """Raise ValueError for language codes outside EASYOCR_LANGUAGES"""
+    unknown = sorted(set(languages or DEFAULT_LANGUAGES) - EASYOCR_LANGUAGES)
+    if unknown:
+        raise ValueError(f"Unsupported EasyOCR language(s): {', '.join(unknown)}. "
+                         f"Use: {', '.join(sorted(EASYOCR_LANGUAGES))}")
+
+
+def _cached(key):
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is not None:
+            _readers.move_to_end(key)
+        return reader
+
+
+def get_reader(languages=DEFAULT_LANGUAGES):
+    """Return the shared reader for a language set, building it once; ValueError for languages not allowed"""
+    check_languages(languages)
+    key = _languages_key(languages)
+    reader = _cached(key)
+    if reader is not None:
+        return reader
+
+    with _lock:
+        reader = _cached(key)
+        if reader is None:
+            name = ','.join(key)
+            print(f"Loading EasyOCR reader ({name})...")
+            _status[name] = 'loading'
+            started = time.time()
+            try:
+                easyocr = _load_easyocr()
+                reader = easyocr.Reader(list(key), gpu=EASYOCR_GPU)
+            except Exception:
+                _status[name] = 'failed'
+                raise
+            with _readers_lock:
+                _readers[key] = reader
+                while len(_readers) > EASYOCR_MAX_READERS:
+                    dropped, _ = _readers.popitem(last=False)
+                    _status.pop(','.join(dropped), None)
+                    print(f"EasyOCR reader ({','.join(dropped)}) dropped to stay within {EASYOCR_MAX_READERS} reader(s)")
+            _status[name] = 'ready'
+            print(f"EasyOCR reader ({name}) ready in {time.time() - started:.1f}s")
+    return reader
+
+
+def readtext(image, languages=DEFAULT_LANGUAGES, **kwargs):
+    """Run reader.readtext on the shared reader once an inference slot is free"""
+    reader = get_reader(languages)
+    with _inference_slots:
+        return reader.readtext(image, **kwargs)
+
+
+def warm_up(languages=DEFAULT_LANGUAGES):
+    """Build a reader in a background thread so startup is not blocked"""
+    def _load():
+        try:
+            get_reader(languages)
+        except Exception as e:
+            print(f"EasyOCR warm-up failed: {e}")
+
+    _status.setdefault(','.join(_languages_key(languages)), 'loading')
+    thread = threading.Thread(target=_load, name='easyocr-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def status():
+    """Readiness of each reader in this worker"""
+    return dict(_status)
@@ -0,0 +1,181 @@
+"""
+Pass-through of the embedded JPEG of scanned PDF pages.
+
+Most scanned exam PDFs store each page as one JPEG drawn over the whole page.
+For those pages the JPEG stream is sent to the vision model as it is, instead
+of rasterizing the page with poppler, decoding it and encoding it again, which
+costs CPU and usually produces a larger payload than the scanner's original.
+
+A page qualifies when its only visible content is a single baseline-oriented
+DCTDecode (JPEG) image in DeviceGray or DeviceRGB covering nearly the whole
+page, and the stream is within EMBEDDED_IMAGE_MAX_BYTES and
+EMBEDDED_IMAGE_MAX_DIMENSION. Invisible text (an OCR text layer) is allowed.
+Anything else falls back to rendering.
+"""
+import collections
+import os
+import threading
+from io import BytesIO
+
+from PIL import Image
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, ContentStream
+
+import metrics
+
+EMBEDDED_IMAGE_PASSTHROUGH = os.getenv('EMBEDDED_IMAGE_PASSTHROUGH', 'True').lower() == 'true'
+EMBEDDED_IMAGE_MAX_BYTES = int(os.getenv('EMBEDDED_IMAGE_MAX_BYTES', str(8 * 1024 * 1024)))
+EMBEDDED_IMAGE_MAX_DIMENSION = int(os.getenv('EMBEDDED_IMAGE_MAX_DIMENSION', '4096'))
+# Share of the page the image must cover
+EMBEDDED_IMAGE_MIN_COVERAGE = float(os.getenv('EMBEDDED_IMAGE_MIN_COVERAGE', '0.9'))
+
+_PAINT_OPERATORS = {b'S', b's', b'f', b'F', b'f*', b'B', b'B*', b'b', b'b*', b'sh', b'BI'}
+_TEXT_OPERATORS = {b'Tj', b'TJ', b"'", b'"'}
+_INVISIBLE_TEXT = 3
+
+# Parsed documents kept for the next page, most recently used last. A PdfReader reads
+# from one shared file stream, so all use of them goes through the lock
+_MAX_OPEN_READERS = 4
+_open_readers = collections.OrderedDict()
+_readers_lock = threading.Lock()
+
+
+class PageImage:
+    """An embedded JPEG ready to send as-is"""
+
+    def __init__(self, data, width, height, mode):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.mode = mode
+
+    def to_pil(self):
+        """Decode for engines that need pixels (cheaper than a poppler render)"""
+        return Image.open(BytesIO(self.data))
+
+
+def _multiply(m1, m2):
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+            c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+            e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+
+def _image_placements(page, reader, image_names):
+    """Transformation matrices of each Do of the images, or None if the page paints anything else visible"""
+    contents = page.get_contents()
+    if contents is None:
+        return []
+    ctm = (1, 0, 0, 1, 0, 0)
+    stack = []
+    render_mode = 0
+    placements = []
+    for operands, operator in ContentStream(contents, reader).operations:
+        if operator == b'q':
+            stack.append((ctm, render_mode))
+        elif operator == b'Q':
+            if stack:
+                ctm, render_mode = stack.pop()
+        elif operator == b'cm':
+            ctm = _multiply(tuple(float(value) for value in operands), ctm)
+        elif operator == b'Tr':
+            render_mode = int(operands[0])
+        elif operator == b'Do':
+            if operands[0] not in image_names:
+                return None
+            placements.append(ctm)
+        elif operator in _PAINT_OPERATORS:
+            return None
+        elif operator in _TEXT_OPERATORS and render_mode != _INVISIBLE_TEXT:
+            return None
+    return placements
+
+
+def _check_page(reader, page):
+    """The page's single JPEG stream object, or the reason it cannot be passed through"""
+    if int(page.get('/Rotate', 0)) % 360:
+        return None, 'rotated'
+    resources = page.get('/Resources')
+    xobjects = resources.get_object().get('/XObject') if resources else None
+    if not xobjects:
+        return None, 'no-image'
+    xobjects = xobjects.get_object()
+    images = {}
+    for name in xobjects:
+        xobject = xobjects[name].get_object()
+        if xobject.get('/Subtype') != '/Image':
+            return None, 'form-xobject'
+        images[name] = xobject
+    if len(images) != 1:
+        return None, 'multiple-images'
+    (name, image), = images.items()
+
+    filters = image.get('/Filter')
+    filters = list(filters) if isinstance(filters, ArrayObject) else [filters]
+    if filters != ['/DCTDecode']:
+        return None, 'not-jpeg'
+    if image.get('/ColorSpace') not in ('/DeviceGray', '/DeviceRGB') or image.get('/BitsPerComponent', 8) != 8:
+        return None, 'colorspace'
+    if image.get('/ImageMask') or '/SMask' in image or '/Mask' in image or '/Decode' in image:
+        return None, 'masked'
+
+    placements = _image_placements(page, reader, {name})
+    if placements is None:
+        return None, 'other-content'
+    if len(placements) != 1:
+        return None, 'multiple-draws'
+    a, b, c, d, _, _ = placements[0]
+    # Drawn upright and unflipped, so the JPEG's own orientation is the page's
+    if a <= 0 or d <= 0 or abs(b) > 1e-6 or abs(c) > 1e-6:
+        return None, 'transformed'
+    box = page.mediabox
+    if a * d < EMBEDDED_IMAGE_MIN_COVERAGE * float(box.width) * float(box.height):
+        return None, 'partial-page'
+    return image, None
+
+
+def _reader(pdf_path):
+    """PdfReader for a path, reused across pages; call with _readers_lock held"""
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    reader = _open_readers.get(key)
+    if reader is None:
+        reader = PdfReader(pdf_path)
+        _open_readers[key] = reader
+        while len(_open_readers) > _MAX_OPEN_READERS:
+            _open_readers.popitem(last=False)[1].close()
+    _open_readers.move_to_end(key)
+    return reader
+
+
+def extract_page_jpeg(pdf_path, page_number):
+    """PageImage for a page that is one full-page JPEG, else None"""
+    if not EMBEDDED_IMAGE_PASSTHROUGH:
+        return None
+    try:
+        with _readers_lock:
+            reader = _reader(pdf_path)
+            image, reason = _check_page(reader, reader.pages[page_number - 1])
+            if image is not None:
+                data = image.get_data()
+                if len(data) > EMBEDDED_IMAGE_MAX_BYTES:
+                    image, reason = None, 'too-large'
+    except Exception as e:
+        print(f"Page {page_number}: could not inspect embedded images: {e}")
+        image, reason = None, 'unreadable'
+
+    if image is not None:
+        # Reads only the JPEG header, the pixels are not decoded
+        with Image.open(BytesIO(data)) as header:
+            width, height, mode = header.width, header.height, header.mode
+        if header.format != 'JPEG' or mode not in ('L', 'RGB'):
+            reason = 'not-jpeg'
+        elif max(width, height) > EMBEDDED_IMAGE_MAX_DIMENSION:
+            reason = 'too-large'
+
+    if reason is not None:
+        metrics.inc('embedded_image_pages_total', result=reason)
+        return None
+    metrics.inc('embedded_image_pages_total', result='passthrough')
+    return PageImage(data, width, height, mode)
@@ -0,0 +1,145 @@
+"""
+Encoding of rendered PDF pages for the vision OCR payload.
+
+Exam pages are mostly black text on white, so a full colour PNG is far larger
+than the model needs. Pages are optionally converted to grayscale, trimmed of
+blank margins, clamped to a maximum dimension and saved as JPEG/WebP/PNG at a
+configurable quality. Each call reports the payload size and an estimate of the
+image tokens it will cost.
+"""
+import base64
+import math
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+OCR_IMAGE_FORMAT = os.getenv('OCR_IMAGE_FORMAT', 'JPEG').upper()
+OCR_IMAGE_QUALITY = int(os.getenv('OCR_IMAGE_QUALITY', '85'))
+OCR_IMAGE_GRAYSCALE = os.getenv('OCR_IMAGE_GRAYSCALE', 'True').lower() == 'true'
+OCR_IMAGE_TRIM = os.getenv('OCR_IMAGE_TRIM', 'True').lower() == 'true'
+# gpt-4o scales high detail images to fit 2048x2048 anyway, so larger pixels are wasted upload
+OCR_IMAGE_MAX_DIMENSION = int(os.getenv('OCR_IMAGE_MAX_DIMENSION', '2048'))
+# Also encode the old full colour PNG to report bytes saved (costs an extra PNG encode per page)
+OCR_IMAGE_REPORT_SAVINGS = os.getenv('OCR_IMAGE_REPORT_SAVINGS', 'False').lower() == 'true'
+
+MIME_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+# Pixels lighter than this count as background when trimming margins
+_TRIM_THRESHOLD = 245
+_TRIM_PADDING = 16
+
+
+def default_options():
+    """Encoding options taken from the environment"""
+    return {
+        'image_format': OCR_IMAGE_FORMAT,
+        'quality': OCR_IMAGE_QUALITY,
+        'grayscale': OCR_IMAGE_GRAYSCALE,
+        'trim': OCR_IMAGE_TRIM,
+        'max_dimension': OCR_IMAGE_MAX_DIMENSION,
+    }
+
+
+def estimate_image_tokens(width, height):
+    """Image input tokens for a high detail gpt-4o image of this size.
+
+    The API fits the image in 2048x2048, scales the shortest side down to 768
+    and charges 170 tokens per 512px tile plus 85 base tokens.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 170 * tiles + 85
+
+
+def trim_margins(image):
+    """Crop blank margins around the page content, keeping a little padding"""
+    mask = ImageOps.invert(image.convert('L')).point(lambda p: 255 if p > 255 - _TRIM_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - _TRIM_PADDING),
+        max(0, top - _TRIM_PADDING),
+        min(image.width, right + _TRIM_PADDING),
+        min(image.height, bottom + _TRIM_PADDING),
+    ))
+
+
+def encode_image(image, image_format=None, quality=None, grayscale=None, trim=None, max_dimension=None,
+                 report_savings=OCR_IMAGE_REPORT_SAVINGS):
+    """Encode a page image for the vision API.
+
+    Returns (img_base64, mime_type, stats) where stats has the original and
+    final dimensions, the encoded byte size and the estimated image tokens
+    saved. With report_savings the bytes saved against a plain PNG are included.
+    """
+    options = default_options()
+    overrides = {
+        'image_format': image_format, 'quality': quality, 'grayscale': grayscale,
+        'trim': trim, 'max_dimension': max_dimension,
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    image_format = options['image_format'].upper()
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {image_format}")
+
+    original_size = image.size
+    baseline_bytes = png_size(image) if report_savings else None
+    if options['grayscale']:
+        image = image.convert('L')
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if options['trim']:
+        image = trim_margins(image)
+    if options['max_dimension'] and max(image.size) > options['max_dimension']:
+        image = image.copy()
+        image.thumbnail((options['max_dimension'], options['max_dimension']), Image.LANCZOS)
+
+    buffered = BytesIO()
+    if image_format == 'PNG':
+        image.save(buffered, format='PNG', optimize=True)
+    elif image_format == 'JPEG':
+        image.save(buffered, format='JPEG', quality=options['quality'], optimize=True)
+    else:
+        image.save(buffered, format='WEBP', quality=options['quality'], method=4)
+    encoded = buffered.getvalue()
+
+    tokens_before = estimate_image_tokens(*original_size)
+    tokens_after = estimate_image_tokens(*image.size)
+    stats = {
+        'format': image_format,
+        'original_size': list(original_size),
+        'final_size': list(image.size),
+        'bytes': len(encoded),
+        'estimated_tokens': tokens_after,
+        'tokens_saved': tokens_before - tokens_after,
+    }
+    if baseline_bytes is not None:
+        stats['bytes_saved'] = baseline_bytes - len(encoded)
+    return base64.b64encode(encoded).decode('utf-8'), MIME_TYPES[image_format], stats
+
+
+def encode_passthrough(data, width, height):
+    """encode_image's result for JPEG bytes sent as they are, e.g. a scanned page's embedded image"""
+    stats = {
+        'format': 'JPEG',
+        'passthrough': True,
+        'original_size': [width, height],
+        'final_size': [width, height],
+        'bytes': len(data),
+        'estimated_tokens': estimate_image_tokens(width, height),
+        'tokens_saved': 0,
+    }
+    return base64.b64encode(data).decode('utf-8'), MIME_TYPES['JPEG'], stats
+
+
+def png_size(image):
+    """Size in bytes of the unprocessed colour PNG the pipeline used to send"""
+    buffered = BytesIO()
+    image.save(buffered, format='PNG')
+    return len(buffered.getvalue())
@@ -0,0 +1,248 @@
+"""
+Prometheus metrics for the PDF service.
+
+Each process records counters, gauges and histograms in memory. Worker
+processes started with start_exporter() periodically write a JSON snapshot to
+METRICS_DIR, and render_prometheus() merges the snapshots of every worker, so
+/metrics reports the whole gunicorn deployment whichever worker answers it.
+Counters and histograms from exited workers are kept so totals do not go
+backwards on worker restarts; their gauges are dropped.
+"""
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import process_identity
+
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'examtopics-metrics'))
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '2'))
+# Snapshots of exited workers older than this are deleted
+METRICS_RETENTION_SECONDS = 24 * 3600
+
+PREFIX = 'pdf_service_'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+DESCRIPTIONS = {
+    'stage_seconds': ('histogram', 'Time spent in each PDF processing stage'),
+    'openai_tokens_total': ('counter', 'OpenAI tokens used, by kind'),
+    'requests_total': ('counter', 'HTTP requests handled, by endpoint and status'),
+    'requests_in_flight': ('gauge', 'HTTP requests currently being handled'),
+    'cache_lookups_total': ('counter', 'Cache lookups, by cache and result'),
+    'ocr_engine_pages_total': ('counter', 'Pages attempted by each OCR engine, by result'),
+    'embedded_image_pages_total': ('counter', 'Pages checked for a pass-through embedded JPEG, by result or reason rejected'),
+    'single_flight_total': ('counter', 'Page conversions by single-flight role: leader, follower or cross_worker_follower'),
+    'prefetch_pages_total': ('counter', 'Speculatively prefetched pages, by result'),
+    'cancelled_requests_total': ('counter', 'OCR requests and jobs cancelled, by kind and reason'),
+    'cancelled_pages_total': ('counter', 'Pages whose conversion was cancelled, by state when cancelled'),
+    'job_resumes_total': ('counter', 'Background OCR jobs resumed after the worker running them exited'),
+    'rate_limit_waits_total': ('counter', 'API calls held back by the rate limiter, by model and reason'),
+    'rate_limit_retries_total': ('counter', 'API calls retried after a rate limit or transient error, by model and status'),
+    'api_cost_dollars_total': ('counter', 'Estimated API spend in USD from response usage and model prices, by model'),
+    'dedup_pages_total': ('counter', 'Pages checked before OCR, by result: unique, blank or duplicate'),
+    'cache_hit_ratio': ('gauge', 'Hit ratio of each cache since the metrics directory was created'),
+    'peak_rss_bytes': ('gauge', 'Peak resident set size of each live worker process'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_exporter_started = False
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Increase a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def add_gauge(name, amount, **labels):
+    """Move a gauge up or down"""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Record a histogram observation"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+@contextmanager
+def timed(stage):
+    """Time a block as one observation of stage_seconds{stage=...}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('stage_seconds', time.perf_counter() - started, stage=stage)
+
+
+def record_usage(usage):
+    """Count prompt/completion tokens from an OpenAI response.usage"""
+    if usage is None:
+        return
+    inc('openai_tokens_total', usage.prompt_tokens or 0, kind='prompt')
+    inc('openai_tokens_total', usage.completion_tokens or 0, kind='completion')
+
+
+def record_cache_lookup(cache, hit):
+    inc('cache_lookups_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _snapshot():
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'process': process_identity.current(),
+            'updated': time.time(),
+            'peak_rss_bytes': _peak_rss_bytes(),
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'gauges': [[name, list(labels), value] for (name, labels), value in _gauges.items()],
+            'histograms': [
+                [name, list(labels), h['buckets'], h['sum'], h['count']]
+                for (name, labels), h in _histograms.items()
+            ],
+        }
+
+
+def flush():
+    """Write this process's snapshot for the other workers to read"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    # Named by pid and start time, so a new worker that reuses a dead one's pid keeps its own file
+    path = os.path.join(METRICS_DIR, f"{process_identity.current()}.json")
+    fd, temp_path = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(temp_path, path)
+
+
+def start_exporter():
+    """Flush snapshots in the background so /metrics on any worker sees this one"""
+    global _exporter_started
+    if _exporter_started:
+        return
+    _exporter_started = True
+
+    def _loop():
+        while True:
+            try:
+                flush()
+            except Exception as e:
+                print(f"Metrics flush failed: {e}")
+            time.sleep(METRICS_FLUSH_SECONDS)
+
+    threading.Thread(target=_loop, name='metrics-exporter', daemon=True).start()
+
+
+def _load_snapshots():
+    if not _exporter_started:
+        return [_snapshot()]
+    flush()
+    snapshots = []
+    now = time.time()
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(METRICS_DIR, name)
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snapshot['alive'] = process_identity.is_alive(snapshot.get('process', snapshot['pid']))
+        if not snapshot['alive'] and now - snapshot['updated'] > METRICS_RETENTION_SECONDS:
+            os.remove(path)
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+def render_prometheus():
+    """All workers' metrics in the Prometheus text exposition format"""
+    counters, gauges, histograms = {}, {}, {}
+    peak_rss = []
+    for snapshot in _load_snapshots():
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            merged = histograms.setdefault(key, {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], buckets)]
+            merged['sum'] += total
+            merged['count'] += count
+        if snapshot.get('alive', True):
+            for name, labels, value in snapshot['gauges']:
+                key = (name, tuple(tuple(label) for label in labels))
+                gauges[key] = gauges.get(key, 0) + value
+            peak_rss.append((snapshot['pid'], snapshot['peak_rss_bytes']))
+
+    # Hit ratio per cache from the merged lookup counters
+    lookups = {}
+    for (name, labels), value in counters.items():
+        if name == 'cache_lookups_total':
+            labels = dict(labels)
+            totals = lookups.setdefault(labels['cache'], [0, 0])
+            totals[0 if labels['result'] == 'hit' else 1] += value
+    for cache, (hits, misses) in lookups.items():
+        if hits + misses:
+            gauges[('cache_hit_ratio', (('cache', cache),))] = round(hits / (hits + misses), 4)
+    for pid, value in peak_rss:
+        gauges[('peak_rss_bytes', (('pid', str(pid)),))] = value
+
+    lines = []
+    described = set()
+
+    def describe(name):
+        if name not in described:
+            described.add(name)
+            metric_type, help_text = DESCRIPTIONS.get(name, ('untyped', name))
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+
+    for (name, labels), value in sorted(counters.items()):
+        describe(name)
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(gauges.items()):
+        describe(name)
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        describe(name)
+        for bound, bucket_count in zip(BUCKETS, histogram['buckets']):
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {bucket_count}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
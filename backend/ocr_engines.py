@@ -0,0 +1,385 @@
+"""
+Pluggable OCR engines for rendered PDF pages.
+
+A page is converted by an ordered chain of engines: the first one that returns
+text within its timeout wins. The default chain is vision only; with a
+fallback such as 'vision,tesseract' a slow or failing gpt-4o call degrades to
+a local engine instead of failing the page. A fallback result is marked
+'fallback' and is not put in the page cache, so a later run tries the first
+engine again. Engines:
+
+  vision     gpt-4o (OCR_MODEL) through the OpenAI API
+  tesseract  the tesseract CLI (installed in the Docker image)
+  easyocr    EasyOCR, through the shared readers in easyocr_readers
+  docling    docling's PDF pipeline on the single page
+
+OCR_ENGINES sets the default chain, OCR_ENGINE_TIMEOUTS the per-engine
+timeouts ('vision=60,tesseract=30'), and OCR_OFFLINE=true drops engines that
+need the network, for bulk runs without API access (the default chain is then
+OCR_OFFLINE_ENGINES).
+"""
+import abc
+import asyncio
+import contextlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from io import BytesIO
+
+import backends
+import docling_converters
+import easyocr_readers
+import metrics
+from cancellation import Cancelled
+from pypdf import PdfReader, PdfWriter
+from embedded_images import extract_page_jpeg
+from image_encoding import encode_image, encode_passthrough
+from page_render import render_page
+from text_layer import text_to_markdown
+from vision_ocr import OCR_MODEL, ocr_image_base64, ocr_image_base64_async, prompt_hash
+
+OCR_ENGINES = os.getenv('OCR_ENGINES', 'vision')
+# Default chain when only local engines may be used
+OCR_OFFLINE_ENGINES = os.getenv('OCR_OFFLINE_ENGINES', 'tesseract')
+OCR_ENGINE_TIMEOUTS = os.getenv('OCR_ENGINE_TIMEOUTS', '')
+OCR_OFFLINE = os.getenv('OCR_OFFLINE', 'False').lower() == 'true'
+TESSERACT_CMD = os.getenv('TESSERACT_CMD', 'tesseract')
+TESSERACT_LANG = os.getenv('TESSERACT_LANG', 'eng')
+
+_OCR_PROMPT_HASH = prompt_hash()
+
+# In-process local engines run here so a timeout can abandon them. An abandoned call keeps
+# its thread until the engine returns, so a call only starts when a thread is free
+OCR_LOCAL_ENGINE_WORKERS = int(os.getenv('OCR_LOCAL_ENGINE_WORKERS', '2'))
+_local_executor = ThreadPoolExecutor(max_workers=OCR_LOCAL_ENGINE_WORKERS, thread_name_prefix='ocr-engine')
+_local_slots = threading.BoundedSemaphore(OCR_LOCAL_ENGINE_WORKERS)
+
+
+class PageSource:
+    """One PDF page as the engines see it.
+
+    The rendered image and the encoded vision payload are produced on first
+    use; the image can be released once the payload exists and is rendered
+    again only if a later engine needs it. A scanned page that is a single
+    embedded JPEG is sent to the vision model as that JPEG, and decoded from
+    it rather than rendered when an engine needs pixels.
+    """
+
+    def __init__(self, pdf_path, page_number, dpi, image=None, embedded=None):
+        self.pdf_path = pdf_path
+        self.page_number = page_number
+        self.dpi = dpi
+        self._image = image
+        self._embedded = embedded
+        self._payload = None
+        self._lock = threading.Lock()
+
+    def embedded(self):
+        """The page's embedded JPEG (embedded_images.PageImage) if it can be used as-is, else None"""
+        if self._embedded is None:
+            self._embedded = extract_page_jpeg(self.pdf_path, self.page_number) or False
+        return self._embedded or None
+
+    def image(self):
+        with self._lock:
+            if self._image is None:
+                embedded = self.embedded()
+                if embedded is not None:
+                    self._image = embedded.to_pil()
+                else:
+                    self._image = render_page(self.pdf_path, self.page_number, self.dpi)
+            return self._image
+
+    def release_image(self):
+        with self._lock:
+            self._image = None
+
+    def vision_payload(self):
+        """(img_base64, mime_type, encoding_stats) for the vision model"""
+        if self._payload is None:
+            embedded = self.embedded()
+            if embedded is not None:
+                with metrics.timed('encode'):
+                    self._payload = encode_passthrough(embedded.data, embedded.width, embedded.height)
+            else:
+                image = self.image()
+                with metrics.timed('encode'):
+                    self._payload = encode_image(image)
+        return self._payload
+
+    def png_bytes(self):
+        buffer = BytesIO()
+        self.image().convert('L').save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+class OcrEngine(abc.ABC):
+    """Base class: converts a PageSource to markdown"""
+    name = None
+    offline = True
+    default_timeout = 60
+    stage = None
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or self.default_timeout
+
+    def available(self):
+        return True
+
+    def cache_key(self):
+        """(model, prompt_hash) under which this engine's pages are cached"""
+        return self.name, ''
+
+    @abc.abstractmethod
+    def run(self, page, client):
+        """Return {'markdown': ...} plus any engine specific details"""
+
+
+class VisionEngine(OcrEngine):
+    name = 'vision'
+    offline = False
+    default_timeout = 90
+    stage = 'openai'
+
+    def cache_key(self):
+        return OCR_MODEL, _OCR_PROMPT_HASH
+
+    def _request(self, page, client, send):
+        if client is None:
+            raise RuntimeError('OpenAI API key not configured')
+        img_base64, mime_type, encoding_stats = page.vision_payload()
+        tags = {'document': os.path.basename(page.pdf_path), 'page': page.page_number}
+        # The engine timeout is the deadline for the whole call, rate-limit waits and retries included
+        return send(client, img_base64, mime_type=mime_type, image_tokens=encoding_stats['estimated_tokens'],
+                    tags=tags, timeout=self.timeout), encoding_stats
+
+    def run(self, page, client):
+        response, encoding_stats = self._request(page, client, ocr_image_base64)
+        return self._output(page, response, encoding_stats)
+
+    async def run_async(self, page, client):
+        request, encoding_stats = self._request(page, client, ocr_image_base64_async)
+        return self._output(page, await request, encoding_stats)
+
+    def _output(self, page, response, encoding_stats):
+        metrics.record_usage(response.usage)
+        print(f"OpenAI Response for page {page.page_number}:")
+        print(f"  Model: {response.model}")
+        print(f"  Usage: {response.usage}")
+        print(f"  Finish reason: {response.choices[0].finish_reason}")
+        output = {'markdown': response.choices[0].message.content, 'encoding': encoding_stats}
+        if response.usage:
+            output['usage'] = {
+                'prompt_tokens': response.usage.prompt_tokens,
+                'completion_tokens': response.usage.completion_tokens
+            }
+        return output
+
+
+class TesseractEngine(OcrEngine):
+    name = 'tesseract'
+    default_timeout = 60
+    stage = 'tesseract'
+
+    def available(self):
+        return shutil.which(TESSERACT_CMD) is not None
+
+    def run(self, page, client):
+        try:
+            completed = subprocess.run(
+                [TESSERACT_CMD, 'stdin', 'stdout', '-l', TESSERACT_LANG],
+                input=page.png_bytes(), capture_output=True, timeout=self.timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f'timed out after {self.timeout}s')
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.decode('utf-8', 'replace').strip() or 'tesseract failed')
+        return {'markdown': text_to_markdown(completed.stdout.decode('utf-8', 'replace'))}
+
+
+class EasyOcrEngine(OcrEngine):
+    name = 'easyocr'
+    default_timeout = 120
+    stage = 'easyocr'
+
+    def available(self):
+        return backends.is_available('easyocr')
+
+    def run(self, page, client):
+        lines = easyocr_readers.readtext(page.png_bytes(), detail=0, paragraph=True)
+        return {'markdown': text_to_markdown('\n'.join(lines))}
+
+
+class DoclingEngine(OcrEngine):
+    name = 'docling'
+    default_timeout = 180
+    stage = 'docling'
+
+    def available(self):
+        return backends.is_available('docling')
+
+    def run(self, page, client):
+        writer = PdfWriter()
+        writer.add_page(PdfReader(page.pdf_path).pages[page.page_number - 1])
+        fd, page_pdf = tempfile.mkstemp(suffix='.pdf')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                writer.write(out)
+            result = docling_converters.convert(page_pdf, do_ocr=True)
+            return {'markdown': result.document.export_to_markdown()}
+        finally:
+            os.remove(page_pdf)
+
+
+ENGINES = {engine.name: engine for engine in (VisionEngine, TesseractEngine, EasyOcrEngine, DoclingEngine)}
+
+
+def _parse_timeouts(spec):
+    timeouts = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            name, seconds = item.split('=', 1)
+            timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+
+def build_chain(names=None, offline=None):
+    """Engines to try in order; unknown names raise ValueError, unavailable engines are skipped"""
+    offline = OCR_OFFLINE if offline is None else offline
+    names = names or (OCR_OFFLINE_ENGINES if offline else OCR_ENGINES)
+    names = [name.strip().lower() for name in names.split(',') if name.strip()]
+    timeouts = _parse_timeouts(OCR_ENGINE_TIMEOUTS)
+    unknown = [name for name in names if name not in ENGINES]
+    if unknown:
+        raise ValueError(f"Unknown OCR engine(s): {', '.join(unknown)}. Use: {', '.join(ENGINES)}")
+
+    chain = []
+    for name in names:
+        engine = ENGINES[name](timeouts.get(name))
+        if offline and not engine.offline:
+            continue
+        if not engine.available():
+            print(f"OCR engine {name} is not available, skipping it")
+            continue
+        chain.append(engine)
+    if not chain:
+        raise ValueError(f"No OCR engine available for chain '{','.join(names)}'" + (' in offline mode' if offline else ''))
+    return chain
+
+
+def needs_client(chain):
+    return any(not engine.offline for engine in chain)
+
+
+def _accept(result, chain, engine, output):
+    """Record an engine's output in the page result; False if it produced no text"""
+    markdown = output.pop('markdown', None)
+    result.update(output)
+    if not markdown or not markdown.strip():
+        _reject(result, engine, 'No content extracted')
+        return False
+    result.update(markdown=markdown, engine=engine.name, status='ok')
+    if engine is not chain[0]:
+        # Stands in for the first engine: not cached, and retried by later runs
+        result['fallback'] = True
+    metrics.inc('ocr_engine_pages_total', engine=engine.name, result='ok')
+    return True
+
+
+def _reject(result, engine, error):
+    print(f"Page {result['page']}: OCR engine {engine.name} failed: {error}")
+    result.setdefault('engineErrors', []).append({'engine': engine.name, 'error': str(error)})
+    metrics.inc('ocr_engine_pages_total', engine=engine.name, result='failed')
+
+
+def _all_failed(result):
+    errors = result.get('engineErrors', [])
+    # Every engine ran fine but found no text: the page is most likely blank
+    empty = all(error['error'] == 'No content extracted' for error in errors)
+    result.update(status='empty' if empty else 'error',
+                  error='; '.join(f"{error['engine']}: {error['error']}" for error in errors))
+    return None
+
+
+def _start_local(engine, page, client):
+    """Start a local engine on a free thread; returns (future, started event).
+
+    Raises RuntimeError at once when every thread is busy (e.g. with calls
+    that timed out but never returned) rather than queueing behind them.
+    """
+    if not _local_slots.acquire(blocking=False):
+        raise RuntimeError(f'all {OCR_LOCAL_ENGINE_WORKERS} local engine threads are busy '
+                           f'(raise OCR_LOCAL_ENGINE_WORKERS if earlier calls are hanging)')
+    started = threading.Event()
+
+    def _run():
+        started.set()
+        try:
+            return engine.run(page, client)
+        finally:
+            _local_slots.release()
+
+    try:
+        return _local_executor.submit(_run), started
+    except BaseException:
+        _local_slots.release()
+        raise
+
+
+def run_chain(chain, page, client, result, cancel=None):
+    """Run engines in order until one returns text; fills in result and returns the winning engine.
+
+    A cancel token is checked before each engine; a call already in progress runs to completion.
+    """
+    for engine in chain:
+        if cancel is not None and cancel.cancelled:
+            metrics.inc('cancelled_pages_total', state='started')
+            raise Cancelled(cancel.reason)
+        try:
+            with metrics.timed(engine.stage):
+                if engine.offline:
+                    # Local engines may not stop on their own; give up waiting once they have run for the timeout
+                    future, started = _start_local(engine, page, client)
+                    started.wait()
+                    output = future.result(timeout=engine.timeout)
+                else:
+                    output = engine.run(page, client)
+        except (FutureTimeoutError, TimeoutError):
+            _reject(result, engine, f'timed out after {engine.timeout}s')
+            continue
+        except Exception as e:
+            _reject(result, engine, e)
+            continue
+        if _accept(result, chain, engine, output):
+            return engine
+    return _all_failed(result)
+
+
+async def run_chain_async(chain, page, client, result, executor, vision_slots=None):
+    """run_chain with an AsyncOpenAI client; CPU work runs on `executor`, local engines on their own threads"""
+    loop = asyncio.get_running_loop()
+    for engine in chain:
+        try:
+            if engine.offline:
+                with metrics.timed(engine.stage):
+                    # A slot was free, so the engine starts right away and the timeout is its run time
+                    future, _ = _start_local(engine, page, client)
+                    output = await asyncio.wait_for(asyncio.wrap_future(future), engine.timeout)
+            else:
+                await loop.run_in_executor(executor, page.vision_payload)
+                async with vision_slots or contextlib.nullcontext():
+                    with metrics.timed(engine.stage):
+                        output = await asyncio.wait_for(engine.run_async(page, client), engine.timeout)
+        except asyncio.TimeoutError:
+            _reject(result, engine, f'timed out after {engine.timeout}s')
+            continue
+        except Exception as e:
+            _reject(result, engine, e)
+            continue
+        if _accept(result, chain, engine, output):
+            return engine
+    return _all_failed(result)
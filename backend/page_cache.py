@@ -0,0 +1,128 @@
+"""
+Persistent cache of OCR results per PDF page.
+
+Results are stored in a local SQLite database keyed by
+(PDF digest, page number, render DPI, model, prompt hash) so that the Flask
+service and the standalone converter, which both render at RENDER_DPI, never
+pay for the same page twice.
+Entries beyond PAGE_CACHE_MAX_ENTRIES are evicted least recently used first.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+PAGE_CACHE_PATH = os.getenv('PAGE_CACHE_PATH', os.path.expanduser('~/.cache/examtopics/page_cache.sqlite3'))
+PAGE_CACHE_MAX_ENTRIES = int(os.getenv('PAGE_CACHE_MAX_ENTRIES', '20000'))
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'True').lower() == 'true'
+
+# Run eviction every this many inserts rather than on every write
+_EVICT_EVERY = 100
+
+
+class PageCache:
+    """SQLite backed page -> markdown cache with hit/miss counters"""
+
+    def __init__(self, path=PAGE_CACHE_PATH, max_entries=PAGE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One shared connection guarded by a lock; WAL lets several worker
+        # processes and the CLI read and write the same file concurrently.
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                digest TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                dpi INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                markdown TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (digest, page, dpi, model, prompt_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def _bump(self, name):
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, digest, page, dpi, model, prompt_hash):
+        """Return cached markdown for a page, or None on a miss"""
+        key = (digest, page, dpi, model, prompt_hash)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT markdown FROM pages WHERE digest=? AND page=? AND dpi=? AND model=? AND prompt_hash=?",
+                key
+            ).fetchone()
+            metrics.record_cache_lookup('page', row is not None)
+            if row is None:
+                self.misses += 1
+                self._bump('misses')
+                self._conn.commit()
+                return None
+
+            self.hits += 1
+            self._bump('hits')
+            self._conn.execute(
+                "UPDATE pages SET last_used=? WHERE digest=? AND page=? AND dpi=? AND model=? AND prompt_hash=?",
+                (time.time(),) + key
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, digest, page, dpi, model, prompt_hash, markdown):
+        """Store the markdown for a page"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, page, dpi, model, prompt_hash, markdown, now, now)
+            )
+            self._puts += 1
+            if self._puts % _EVICT_EVERY == 0:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM pages WHERE rowid IN (SELECT rowid FROM pages ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            print(f"Page cache: evicted {excess} least recently used entries")
+
+    def stats(self):
+        """Hit/miss counters for this process and across all users of the cache file"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            totals = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'total_hits': totals.get('hits', 0),
+            'total_misses': totals.get('misses', 0),
+        }
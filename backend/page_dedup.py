@@ -0,0 +1,135 @@
+"""
+Blank and duplicate page detection before OCR.
+
+Merged exam PDFs carry blank separator pages, repeated cover pages and pages
+duplicated where source chunks overlap. Each rendered page gets an ink
+coverage score (share of dark pixels, margins ignored); pages with less ink
+than PAGE_BLANK_MAX_INK are skipped. A page whose full-resolution pixels (or
+embedded JPEG bytes) are identical to a page seen earlier in the run reuses
+that page's OCR output instead of being sent again.
+
+With PAGE_DEDUP_NEAR, pages whose difference hash (dHash) of the content,
+trimmed of white margins, is within PAGE_DEDUP_MAX_DISTANCE bits of an
+earlier page are reused too, which also catches re-encoded or rescanned
+copies. It is off by default: the hash has PAGE_HASH_SIZE**2 bits of a
+thumbnail, and exam pages that differ only in the question number or the
+answer letter hash within a few bits of each other, so near matching can put
+one question's text (and answer) under another's page.
+"""
+import hashlib
+import os
+
+from PIL import Image
+
+import metrics
+
+PAGE_DEDUP_ENABLED = os.getenv('PAGE_DEDUP_ENABLED', 'True').lower() == 'true'
+# Highest share of dark pixels for a page to count as blank
+PAGE_BLANK_MAX_INK = float(os.getenv('PAGE_BLANK_MAX_INK', '0.0001'))
+# Also reuse OCR output for pages that only look alike (see above); exact copies are always reused
+PAGE_DEDUP_NEAR = os.getenv('PAGE_DEDUP_NEAR', 'False').lower() == 'true'
+# Most differing hash bits for two pages to count as the same with PAGE_DEDUP_NEAR
+PAGE_DEDUP_MAX_DISTANCE = int(os.getenv('PAGE_DEDUP_MAX_DISTANCE', '12'))
+PAGE_HASH_SIZE = int(os.getenv('PAGE_HASH_SIZE', '16'))
+
+# Gray levels below this count as ink
+_INK_LEVEL = 128
+# Share of each edge left out of the ink score (scanner borders, punch holes)
+_MARGIN = 0.05
+_THUMBNAIL_SIZE = 512
+
+
+def _gray_thumbnail(image):
+    if getattr(image, 'format', None) == 'JPEG':
+        # Decodes an embedded JPEG at a fraction of its size instead of in full
+        image.draft('L', (_THUMBNAIL_SIZE, _THUMBNAIL_SIZE))
+    gray = image.convert('L')
+    gray.thumbnail((_THUMBNAIL_SIZE, _THUMBNAIL_SIZE))
+    return gray
+
+
+def ink_coverage(gray):
+    """Share of dark pixels inside the margins of a grayscale image"""
+    width, height = gray.size
+    left, top = int(width * _MARGIN), int(height * _MARGIN)
+    histogram = gray.crop((left, top, width - left, height - top)).histogram()
+    total = sum(histogram)
+    return sum(histogram[:_INK_LEVEL]) / total if total else 0.0
+
+
+def dhash(gray, size=PAGE_HASH_SIZE):
+    """Difference hash of the inked area: one bit per horizontally adjacent pair of cells, set where brightness drops"""
+    content = gray.point(lambda level: 255 if level < _INK_LEVEL else 0).getbbox()
+    if content:
+        gray = gray.crop(content)
+    pixels = gray.resize((size + 1, size), Image.BILINEAR).tobytes()
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            right = pixels[row * (size + 1) + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def content_digest(image, data=None):
+    """SHA-256 of a page's encoded bytes when given, else of its full-resolution pixels"""
+    if data is None:
+        data = f"{image.mode}:{image.size}:".encode('ascii') + image.tobytes()
+    return hashlib.sha256(data).hexdigest()
+
+
+class PageDeduplicator:
+    """Spots near-blank pages and copies of pages seen earlier in one conversion"""
+
+    def __init__(self, max_distance=PAGE_DEDUP_MAX_DISTANCE, blank_max_ink=PAGE_BLANK_MAX_INK, near=PAGE_DEDUP_NEAR):
+        self.max_distance = max_distance
+        self.blank_max_ink = blank_max_ink
+        self.near = near
+        self.blank_pages = []
+        # duplicate page -> the earlier page it matches
+        self.duplicates = {}
+        self._digests = {}
+        self._seen = []
+
+    def check(self, page_number, image, data=None):
+        """('blank', None), ('duplicate', earlier page number) or (None, None) for a page to OCR.
+
+        data is the page's encoded image (an embedded JPEG), compared instead
+        of decoded pixels when given.
+        """
+        # Before the thumbnail: drafting a JPEG changes the image in place
+        digest = content_digest(image, data)
+        gray = _gray_thumbnail(image)
+        if ink_coverage(gray) <= self.blank_max_ink:
+            self.blank_pages.append(page_number)
+            metrics.inc('dedup_pages_total', result='blank')
+            return 'blank', None
+        original = self._digests.get(digest)
+        if original is None and self.near:
+            page_hash = dhash(gray)
+            original = next((seen_page for seen_hash, seen_page in self._seen
+                             if hamming(page_hash, seen_hash) <= self.max_distance), None)
+            if original is None:
+                self._seen.append((page_hash, page_number))
+        if original is not None:
+            self.duplicates[page_number] = original
+            metrics.inc('dedup_pages_total', result='duplicate')
+            return 'duplicate', original
+        self._digests[digest] = page_number
+        metrics.inc('dedup_pages_total', result='unique')
+        return None, None
+
+    def report(self):
+        """Lines describing what was skipped"""
+        lines = []
+        if self.blank_pages:
+            lines.append(f"Skipped {len(self.blank_pages)} blank page(s): {', '.join(map(str, self.blank_pages))}")
+        if self.duplicates:
+            pairs = ', '.join(f"{page}={original}" for page, original in sorted(self.duplicates.items()))
+            lines.append(f"Reused OCR for {len(self.duplicates)} duplicate page(s) (page=original): {pairs}")
+        return lines
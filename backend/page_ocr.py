@@ -0,0 +1,314 @@
+"""
+Page level OCR for PDFs held in the upload store.
+
+Each page is rendered, converted by the OCR engine chain and cached on its own,
+so pages can run concurrently on a shared, bounded thread pool and a failure
+only affects the page it happened on.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from cancellation import CANCEL_POLL_SECONDS, Cancelled
+from page_cache import PageCache, PAGE_CACHE_ENABLED
+from ocr_engines import PageSource, build_chain, run_chain, run_chain_async
+from page_render import RENDER_DPI
+from single_flight import page_flights
+from text_layer import TEXT_LAYER_ENABLED, try_text_layer
+
+OCR_DPI = RENDER_DPI
+
+# Maximum number of pages converted at the same time by one worker process
+OCR_MAX_WORKERS = int(os.getenv('OCR_MAX_WORKERS', '4'))
+
+# Vision calls awaited at the same time by one async (ASGI) worker process
+ASYNC_OCR_MAX_IN_FLIGHT = int(os.getenv('ASYNC_OCR_MAX_IN_FLIGHT', '32'))
+
+# OCR results are cached per (digest, page, dpi, model, prompt); each engine has its own model key
+page_cache = PageCache() if PAGE_CACHE_ENABLED else None
+
+_executor = None
+_executor_lock = threading.Lock()
+_async_slots = None
+
+
+def get_executor():
+    """Process-wide pool that bounds concurrent page OCR"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix='page-ocr')
+    return _executor
+
+
+def new_page_result(page_number):
+    return {'page': page_number, 'status': 'ok', 'cached': False}
+
+
+def cached_page(result, digest, chain, dpi=OCR_DPI):
+    """Fill in `result` from the page cache; False on a miss"""
+    if not page_cache:
+        return False
+    # Only the first engine's results count; a fallback result must not stop a retry of the primary
+    model, engine_prompt_hash = chain[0].cache_key()
+    cached_markdown = page_cache.get(digest, result['page'], dpi, model, engine_prompt_hash)
+    if cached_markdown is None:
+        return False
+    print(f"Page {result['page']}: served from page cache")
+    result.update(markdown=cached_markdown, cached=True, path='cache', engine=chain[0].name)
+    return True
+
+
+def prepare_page(result, pdf_path, digest, chain, dpi=OCR_DPI, use_text_layer=TEXT_LAYER_ENABLED):
+    """CPU side of converting a page: cache lookup, text layer check, render and encode.
+
+    Fills in `result` and returns None when the page was answered from the
+    cache or the text layer; otherwise returns the PageSource for the engine
+    chain. When the chain starts with the vision engine the page is encoded
+    here and the rendered image released, so only the compact payload waits
+    on the API.
+    """
+    page_number = result['page']
+    if cached_page(result, digest, chain, dpi):
+        return None
+
+    if use_text_layer:
+        with metrics.timed('text_layer'):
+            text_markdown, text_score = try_text_layer(pdf_path, page_number)
+        result['textLayer'] = text_score
+        if text_markdown is not None:
+            print(f"Page {page_number}: using text layer ({text_score['chars']} chars)")
+            result.update(markdown=text_markdown, path='text-layer')
+            return None
+        print(f"Page {page_number}: text layer rejected ({text_score['reason']}), using OCR")
+
+    result['path'] = 'ocr'
+    page = PageSource(pdf_path, page_number, dpi)
+    if chain[0].name == 'vision':
+        img_base64, mime_type, encoding_stats = page.vision_payload()
+        page.release_image()
+        source = 'embedded' if encoding_stats.get('passthrough') else 'encoded'
+        print(f"Page {page_number}: {source} {encoding_stats['format']} {encoding_stats['final_size']}, "
+              f"{encoding_stats['bytes']} bytes, ~{encoding_stats['estimated_tokens']} image tokens")
+    return page
+
+
+def finish_page(result, engine, digest, dpi=OCR_DPI):
+    """Store the winning engine's markdown in the page cache, unless it was only a fallback"""
+    if engine is None:
+        print(f"Page {result['page']}: no OCR engine produced text ({result['error']})")
+        return result
+    page_markdown = result['markdown']
+    print(f"Page {result['page']}: {len(page_markdown)} characters from {engine.name}")
+    print(f"  Content preview (first 200 chars): {page_markdown[:200]}...")
+    if page_cache and not result.get('fallback'):
+        model, engine_prompt_hash = engine.cache_key()
+        page_cache.put(digest, result['page'], dpi, model, engine_prompt_hash, page_markdown)
+    return result
+
+
+def _flight_key(digest, page_number, dpi, use_text_layer, chain):
+    """Requests with the same key produce the same page and are coalesced"""
+    return digest, page_number, dpi, bool(use_text_layer), tuple(engine.name for engine in chain)
+
+
+def _recheck_cache(digest, page_number, dpi, chain):
+    """After waiting on another worker's identical request, its result should be in the page cache"""
+    result = new_page_result(page_number)
+    return result if cached_page(result, digest, chain, dpi) else None
+
+
+def _shared(result, coalesced):
+    # Each caller gets its own copy of the leader's result
+    return dict(result, coalesced=True) if coalesced else result
+
+
+def _convert_page(result, client, pdf_path, digest, chain, dpi, use_text_layer, cancel=None):
+    if cancel is not None and cancel.cancelled:
+        metrics.inc('cancelled_pages_total', state='queued')
+        raise Cancelled(cancel.reason)
+    page = prepare_page(result, pdf_path, digest, chain, dpi, use_text_layer)
+    if page is None:
+        return result
+    return finish_page(result, run_chain(chain, page, client, result, cancel), digest, dpi)
+
+
+def ocr_page(client, pdf_path, digest, page_number, dpi=OCR_DPI, use_text_layer=TEXT_LAYER_ENABLED, engines=None,
+             cancel=None):
+    """Convert one page and return a result dict for it.
+
+    The page comes from the page cache, from the PDF's own text layer when it
+    passes the quality check, or from the OCR engine chain; 'path' records
+    which and 'engine' the engine that produced the text. An identical page
+    already being converted (here or in another worker) is waited for and its
+    result shared, marked 'coalesced'. Once `cancel` is set the page stops
+    before its next stage with status 'cancelled'.
+    """
+    started = time.time()
+    result = new_page_result(page_number)
+    try:
+        chain = engines or build_chain()
+        if page_flights is None:
+            return _convert_page(result, client, pdf_path, digest, chain, dpi, use_text_layer, cancel)
+        result, coalesced = page_flights.do(
+            _flight_key(digest, page_number, dpi, use_text_layer, chain),
+            lambda: _convert_page(new_page_result(page_number), client, pdf_path, digest, chain, dpi, use_text_layer,
+                                  cancel),
+            recheck=lambda: _recheck_cache(digest, page_number, dpi, chain),
+            cancel=cancel
+        )
+        result = _shared(result, coalesced)
+        return result
+
+    except Cancelled:
+        print(f"Page {page_number}: cancelled")
+        result.update(status='cancelled')
+        return result
+    except Exception as e:
+        print(f"Error processing page {page_number}: {e}")
+        result.update(status='error', error=str(e))
+        return result
+    finally:
+        result['seconds'] = round(time.time() - started, 3)
+
+
+def ocr_pages(client, pdf_path, digest, page_numbers, dpi=OCR_DPI, use_text_layer=TEXT_LAYER_ENABLED, engines=None,
+              cancel=None):
+    """OCR several pages concurrently and return their results in page order.
+
+    If `cancel` is set part way, only the pages finished by then are returned.
+    """
+    results = list(iter_ocr_pages(client, pdf_path, digest, page_numbers, window=max(1, len(page_numbers)), dpi=dpi,
+                                  use_text_layer=use_text_layer, engines=engines, cancel=cancel))
+    return sorted(results, key=lambda result: result['page'])
+
+
+def _count_cancelled(remaining, not_started):
+    queued = len(remaining) + not_started
+    if queued:
+        metrics.inc('cancelled_pages_total', queued, state='queued')
+
+
+def iter_ocr_pages(client, pdf_path, digest, page_numbers, window=OCR_MAX_WORKERS, dpi=OCR_DPI,
+                   use_text_layer=TEXT_LAYER_ENABLED, engines=None, cancel=None):
+    """Yield page results as they finish, keeping at most `window` pages queued on the pool.
+
+    Stops when `cancel` is set or the consumer closes the generator: queued
+    pages are dropped and pages already started stop at their next stage.
+    """
+    executor = get_executor()
+    remaining = list(page_numbers)
+    in_flight = set()
+    try:
+        while remaining or in_flight:
+            while remaining and len(in_flight) < window:
+                # Touch the stored PDF so upload store eviction leaves it alone while pages are pending
+                os.utime(pdf_path)
+                in_flight.add(executor.submit(ocr_page, client, pdf_path, digest, remaining.pop(0), dpi,
+                                              use_text_layer, engines, cancel))
+            done, in_flight = wait(in_flight, timeout=CANCEL_POLL_SECONDS if cancel else None,
+                                   return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+            if cancel is not None and cancel.cancelled:
+                return
+    finally:
+        if remaining or in_flight:
+            if cancel is not None:
+                cancel.cancel('closed')
+            _count_cancelled(remaining, sum(1 for future in in_flight if future.cancel()))
+
+
+async def _convert_page_async(result, client, pdf_path, digest, chain, dpi, use_text_layer):
+    loop = asyncio.get_running_loop()
+    page = await loop.run_in_executor(get_executor(), prepare_page, result, pdf_path, digest, chain, dpi,
+                                      use_text_layer)
+    if page is None:
+        return result
+    engine = await run_chain_async(chain, page, client, result, get_executor(), _async_slots)
+    return await loop.run_in_executor(get_executor(), finish_page, result, engine, digest, dpi)
+
+
+async def ocr_page_async(client, pdf_path, digest, page_number, dpi=OCR_DPI, use_text_layer=TEXT_LAYER_ENABLED,
+                         engines=None):
+    """ocr_page for an AsyncOpenAI client.
+
+    Rendering, encoding and local engines run on the shared page pool; the
+    vision call is awaited on the event loop, so one process can have many
+    pages waiting on the API while the pool only holds CPU work.
+    """
+    global _async_slots
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(ASYNC_OCR_MAX_IN_FLIGHT)
+
+    started = time.time()
+    result = new_page_result(page_number)
+    try:
+        chain = engines or build_chain()
+        if page_flights is None:
+            return await _convert_page_async(result, client, pdf_path, digest, chain, dpi, use_text_layer)
+        result, coalesced = await page_flights.do_async(
+            _flight_key(digest, page_number, dpi, use_text_layer, chain),
+            lambda: _convert_page_async(new_page_result(page_number), client, pdf_path, digest, chain, dpi,
+                                        use_text_layer),
+            recheck=lambda: _recheck_cache(digest, page_number, dpi, chain)
+        )
+        result = _shared(result, coalesced)
+        return result
+
+    except Exception as e:
+        print(f"Error processing page {page_number}: {e}")
+        result.update(status='error', error=str(e))
+        return result
+    finally:
+        result['seconds'] = round(time.time() - started, 3)
+
+
+async def iter_ocr_pages_async(client, pdf_path, digest, page_numbers, window=ASYNC_OCR_MAX_IN_FLIGHT, dpi=OCR_DPI,
+                               use_text_layer=TEXT_LAYER_ENABLED, engines=None, cancel=None):
+    """Async iter_ocr_pages: yield page results as they finish, at most `window` pages at a time.
+
+    On cancel, or when the consumer goes away (e.g. a streaming client
+    disconnected), pending pages are cancelled, which also abandons their
+    in-progress vision calls.
+    """
+    remaining = list(page_numbers)
+    in_flight = set()
+    try:
+        while remaining or in_flight:
+            while remaining and len(in_flight) < window:
+                os.utime(pdf_path)
+                in_flight.add(asyncio.ensure_future(
+                    ocr_page_async(client, pdf_path, digest, remaining.pop(0), dpi, use_text_layer, engines)
+                ))
+            done, in_flight = await asyncio.wait(in_flight, timeout=CANCEL_POLL_SECONDS if cancel else None,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+            if cancel is not None and cancel.cancelled:
+                return
+    finally:
+        if in_flight:
+            metrics.inc('cancelled_pages_total', len(in_flight), state='started')
+        _count_cancelled(remaining, 0)
+        for task in in_flight:
+            task.cancel()
+
+
+async def ocr_pages_async(client, pdf_path, digest, page_numbers, dpi=OCR_DPI, use_text_layer=TEXT_LAYER_ENABLED,
+                          engines=None, cancel=None):
+    """Async ocr_pages: results of all pages in page order (those finished by then, if cancelled)"""
+    results = [result async for result in iter_ocr_pages_async(
+        client, pdf_path, digest, page_numbers, dpi=dpi, use_text_layer=use_text_layer, engines=engines,
+        cancel=cancel
+    )]
+    return sorted(results, key=lambda result: result['page'])
+
+
+def page_summary(result):
+    """Per-page status for API responses, without the markdown itself"""
+    return {key: value for key, value in result.items() if key != 'markdown'}
@@ -0,0 +1,243 @@
+"""
+Page rendering for OCR.
+
+Pages are always rendered one at a time, never a whole document at once.
+iter_rendered_pages() renders in a background thread that runs at most
+RENDER_AHEAD pages ahead of the consumer, so peak memory is a few page images
+whatever the document length. Each image should be dropped once it is encoded.
+
+The default RENDER_ENGINE is pdfium: a document is opened once and its pages
+are rendered from that handle straight into memory, where pdf2image forks a
+pdftoppm process per page that reparses the whole file and writes a temporary
+image. pdfium is not thread safe, so in-process renders are serialized by
+pdfium_lock, however many threads ask for pages. With RENDER_WORKERS > 1
+renders run in processes instead: iter_rendered_pages() starts a pool for the
+document, each process opening it once, and render_page() (the service's page
+threads) sends pages to a pool shared by the process, where each render
+process keeps its own recently used documents open.
+"""
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+import backends
+import metrics
+
+# Page render resolution of both the service and the standalone converter, which share
+# page cache entries only at the same DPI; vision images are scaled to 2048px anyway
+RENDER_DPI = int(os.getenv('RENDER_DPI', '300'))
+# Rendered pages waiting for the consumer when iterating a document
+RENDER_AHEAD = int(os.getenv('RENDER_AHEAD', '2'))
+# 'pdfium' (in-process, falls back to pdf2image when pypdfium2 is missing) or 'pdf2image'
+RENDER_ENGINE = os.getenv('RENDER_ENGINE', 'pdfium')
+# Processes rendering in parallel when iterating a document with pdfium; 1 renders in-process
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '1'))
+
+# pdfium is not thread safe; all calls into it go through this lock
+pdfium_lock = threading.Lock()
+
+# Documents kept open for the next page, most recently used last
+_MAX_OPEN_DOCUMENTS = 4
+_open_documents = collections.OrderedDict()
+
+_DONE = object()
+
+
+def render_engine():
+    """The engine pages are rendered with"""
+    if RENDER_ENGINE == 'pdfium' and backends.is_available('pypdfium2'):
+        return 'pdfium'
+    return 'pdf2image'
+
+
+def cached_document(pdf_path):
+    """Open pdfium document for a path, reused across pages; call with pdfium_lock held"""
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    document = _open_documents.get(key)
+    if document is None:
+        document = backends.load('pypdfium2').PdfDocument(pdf_path)
+        _open_documents[key] = document
+        while len(_open_documents) > _MAX_OPEN_DOCUMENTS:
+            _open_documents.popitem(last=False)[1].close()
+    _open_documents.move_to_end(key)
+    return document
+
+
+def close_documents():
+    """Close every cached pdfium document"""
+    with pdfium_lock:
+        while _open_documents:
+            _open_documents.popitem()[1].close()
+
+
+def _render_pdfium(document, page_number, dpi):
+    page = document[page_number - 1]
+    try:
+        return page.render(scale=dpi / 72).to_pil().convert('RGB')
+    finally:
+        page.close()
+
+
+# Render processes shared by render_page() calls, started on first use
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def _render_path_in_worker(pdf_path, page_number, dpi):
+    with pdfium_lock:
+        image = _render_pdfium(cached_document(pdf_path), page_number, dpi)
+    return image.mode, image.size, image.tobytes()
+
+
+def _render_in_pool(pdf_path, page_number, dpi):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # spawn rather than fork: the parent has threads that may hold locks, pdfium's among them
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                               mp_context=multiprocessing.get_context('spawn'))
+        pool = _render_pool
+    try:
+        mode, size, data = pool.submit(_render_path_in_worker, pdf_path, page_number, dpi).result()
+    except BrokenProcessPool:
+        # A render process died (e.g. OOM); start a fresh pool for the next page
+        with _render_pool_lock:
+            if _render_pool is pool:
+                _render_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    return Image.frombytes(mode, size, data)
+
+
+def render_page(pdf_path, page_number, dpi):
+    """Render one page (1-based) to a PIL image"""
+    with metrics.timed('render'):
+        if render_engine() == 'pdfium':
+            if RENDER_WORKERS > 1:
+                return _render_in_pool(os.path.abspath(pdf_path), page_number, dpi)
+            with pdfium_lock:
+                return _render_pdfium(cached_document(pdf_path), page_number, dpi)
+        convert_from_path = backends.load('pdf2image').convert_from_path
+        images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        raise RuntimeError(f'Failed to convert page {page_number} to image')
+    return images[0]
+
+
+def page_count(pdf_path):
+    """Number of pages in a PDF, without rendering any"""
+    if render_engine() == 'pdfium':
+        with pdfium_lock:
+            return len(cached_document(pdf_path))
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+
+# Render worker processes: each opens the document once in the initializer
+_worker_document = None
+
+
+def _open_in_worker(pdf_path):
+    global _worker_document
+    _worker_document = backends.load('pypdfium2').PdfDocument(pdf_path)
+
+
+def _render_in_worker(page_number, dpi):
+    started = time.perf_counter()
+    image = _render_pdfium(_worker_document, page_number, dpi)
+    return image.mode, image.size, image.tobytes(), time.perf_counter() - started
+
+
+def _iter_rendered_in_processes(pdf_path, page_numbers, dpi, ahead, workers):
+    # spawn rather than fork: the parent has threads that may hold locks, pdfium's among them
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_open_in_worker, initargs=(pdf_path,))
+    pages = iter(page_numbers)
+    pending = collections.deque()
+
+    def _submit():
+        for page_number in pages:
+            pending.append((page_number, pool.submit(_render_in_worker, page_number, dpi)))
+            return
+
+    try:
+        for _ in range(workers + max(1, ahead)):
+            _submit()
+        while pending:
+            page_number, future = pending.popleft()
+            try:
+                mode, size, data, seconds = future.result()
+                item = (page_number, Image.frombytes(mode, size, data), None)
+                metrics.observe('stage_seconds', seconds, stage='render')
+                del data
+            except Exception as e:
+                item = (page_number, None, e)
+            _submit()
+            yield item
+            del item
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_rendered_pages(pdf_path, page_numbers, dpi, ahead=RENDER_AHEAD, workers=RENDER_WORKERS):
+    """Yield (page_number, image, error) in page order, rendering up to `ahead` pages in advance.
+
+    A page that fails to render is yielded with image None and the exception,
+    so the caller can record it and carry on with the next page.
+    """
+    page_numbers = list(page_numbers)
+    if workers > 1 and len(page_numbers) > 1 and render_engine() == 'pdfium':
+        yield from _iter_rendered_in_processes(pdf_path, page_numbers, dpi, ahead, workers)
+        return
+
+    rendered = queue.Queue(maxsize=max(1, ahead))
+    stop = threading.Event()
+
+    def _put(item):
+        # Give up if the consumer has gone away instead of blocking forever on a full queue
+        while not stop.is_set():
+            try:
+                rendered.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _render():
+        for page_number in page_numbers:
+            if stop.is_set():
+                return
+            try:
+                item = (page_number, render_page(pdf_path, page_number, dpi), None)
+            except Exception as e:
+                item = (page_number, None, e)
+            if not _put(item):
+                return
+            del item
+        _put(_DONE)
+
+    thread = threading.Thread(target=_render, name='page-render', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = rendered.get()
+            if item is _DONE:
+                return
+            yield item
+            del item
+    finally:
+        stop.set()
+        # Drop anything rendered ahead so the images can be freed
+        while True:
+            try:
+                rendered.get_nowait()
+            except queue.Empty:
+                break
@@ -0,0 +1,161 @@
+"""
+Speculative prefetch of the pages after the one a labeler just opened.
+
+Labelers move through a PDF page by page, so after serving page k of a
+/convert-pdf-ocr request that asks for it (`prefetch=N`), pages k+1..k+N are
+converted in the background and land in the page cache; the next page turn is
+then a cache hit, or joins the prefetch already running for it through
+single-flight. Prefetching runs on its own low-priority thread per worker, not
+the page pool, and only starts a page while no interactive request is in
+flight. A newer request for the same document replaces its queued prefetches,
+so jumping to another part of the PDF drops the pages nobody is heading to, and
+an interactive request for another document cancels the prefetch in progress
+and drops those queued for other documents. No prefetch that calls a paid
+engine starts while the run's projected spend is over its budget.
+"""
+import collections
+import contextlib
+import os
+import threading
+
+import backends
+import metrics
+import usage_ledger
+from cancellation import CancelToken
+from page_ocr import OCR_DPI, ocr_page
+
+# Most pages a single request may ask to prefetch; 0 turns prefetching off
+PREFETCH_MAX_PAGES = int(os.getenv('PREFETCH_MAX_PAGES', '5'))
+# Queued prefetches per worker beyond which the oldest are dropped
+PREFETCH_MAX_QUEUED = int(os.getenv('PREFETCH_MAX_QUEUED', '32'))
+
+
+class Prefetcher:
+    """Background queue of pages to convert speculatively, yielding to interactive requests"""
+
+    def __init__(self, max_queued=PREFETCH_MAX_QUEUED):
+        self.max_queued = max_queued
+        self._pending = collections.OrderedDict()
+        self._interactive = 0
+        self._condition = threading.Condition()
+        self._clients = {}
+        self._thread = None
+        # (digest, cancel token) of the prefetch being converted
+        self._running = None
+
+    @contextlib.contextmanager
+    def interactive(self, digest=None):
+        """Mark an interactive request; prefetches wait until none are in flight.
+
+        Prefetches of documents other than `digest` are cancelled, as the
+        labeler has moved on from them.
+        """
+        with self._condition:
+            self._interactive += 1
+            if digest is not None:
+                self.cancel(keep=digest)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._interactive -= 1
+                self._condition.notify_all()
+
+    def cancel(self, keep=None):
+        """Cancel the running prefetch and drop queued ones, except those of the document `keep`"""
+        with self._condition:
+            dropped = [key for key in self._pending if key[0] != keep]
+            for key in dropped:
+                del self._pending[key]
+            if dropped:
+                metrics.inc('prefetch_pages_total', len(dropped), result='superseded')
+            if self._running is not None and self._running[0] != keep:
+                self._running[1].cancel('superseded')
+
+    def schedule(self, pdf_path, digest, page_number, count, total_pages, openai_api_key=None,
+                 use_text_layer=True, engines=None, dpi=OCR_DPI):
+        """Queue the `count` pages after page_number, replacing older prefetches of this document"""
+        if openai_api_key and usage_ledger.current_run().over_budget():
+            print(f"Prefetch skipped for {digest[:12]}: run is over its budget")
+            metrics.inc('prefetch_pages_total', result='over_budget')
+            return []
+        count = min(count, PREFETCH_MAX_PAGES)
+        pages = list(range(page_number + 1, min(page_number + count, total_pages) + 1))
+        with self._condition:
+            superseded = [key for key in self._pending if key[0] == digest and key[1] not in pages]
+            for key in superseded:
+                del self._pending[key]
+            if superseded:
+                metrics.inc('prefetch_pages_total', len(superseded), result='superseded')
+            for page in pages:
+                self._pending[(digest, page)] = (pdf_path, openai_api_key, use_text_layer, engines, dpi)
+                self._pending.move_to_end((digest, page))
+            while len(self._pending) > self.max_queued:
+                self._pending.popitem(last=False)
+                metrics.inc('prefetch_pages_total', result='dropped')
+            self._start()
+            self._condition.notify_all()
+        if pages:
+            print(f"Prefetch queued for pages {pages[0]}-{pages[-1]} of {digest[:12]}")
+        return pages
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='page-prefetch', daemon=True)
+            self._thread.start()
+
+    def _client(self, openai_api_key):
+        if openai_api_key not in self._clients:
+            self._clients[openai_api_key] = backends.load('openai').OpenAI(api_key=openai_api_key)
+        return self._clients[openai_api_key]
+
+    def _next(self):
+        with self._condition:
+            # Interactive requests go first; a prefetch only starts while none are running
+            while not self._pending or self._interactive:
+                self._condition.wait()
+            (digest, page_number), job = self._pending.popitem(last=False)
+            cancel = CancelToken(f"prefetch-{digest[:12]}-p{page_number}")
+            self._running = (digest, cancel)
+            return (digest, page_number), job, cancel
+
+    def _run(self):
+        while True:
+            (digest, page_number), (pdf_path, openai_api_key, use_text_layer, engines, dpi), cancel = self._next()
+            try:
+                self._prefetch(digest, page_number, pdf_path, openai_api_key, use_text_layer, engines, dpi, cancel)
+            finally:
+                with self._condition:
+                    self._running = None
+
+    def _prefetch(self, digest, page_number, pdf_path, openai_api_key, use_text_layer, engines, dpi, cancel):
+        if not os.path.exists(pdf_path):
+            metrics.inc('prefetch_pages_total', result='dropped')
+            return
+        # The budget may have run out since the page was queued
+        if openai_api_key and usage_ledger.current_run().over_budget():
+            metrics.inc('prefetch_pages_total', result='over_budget')
+            return
+        try:
+            client = self._client(openai_api_key) if openai_api_key else None
+            result = ocr_page(client, pdf_path, digest, page_number, dpi, use_text_layer, engines, cancel=cancel)
+        except Exception as e:
+            print(f"Prefetch of page {page_number} failed: {e}")
+            metrics.inc('prefetch_pages_total', result='error')
+            return
+        if result['status'] == 'cancelled':
+            outcome = 'cancelled'
+        else:
+            outcome = 'cached' if result.get('cached') else 'ok' if result['status'] == 'ok' else 'error'
+        metrics.inc('prefetch_pages_total', result=outcome)
+
+
+prefetcher = Prefetcher()
+
+
+def parse_prefetch(value):
+    """Pages to prefetch from the optional `prefetch` form field; invalid values mean none"""
+    try:
+        return max(0, min(int(value or 0), PREFETCH_MAX_PAGES))
+    except ValueError:
+        return 0
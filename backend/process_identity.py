@@ -0,0 +1,78 @@
+"""
+Identity of worker processes that outlives them.
+
+Jobs, cancel markers and metrics snapshots record the worker that owns them
+so other workers can tell when it has gone. A bare pid is not enough: after a
+container restart pids start over, and a new worker can get the pid of a dead
+one. A process is therefore named '<pid>-<boot id>-<start time>', with the
+boot id from /proc/sys/kernel/random/boot_id and the start time in clock
+ticks from /proc/<pid>/stat, and is alive only while a process with that pid
+and the same start time exists. Without /proc (macOS, Windows) the name is
+the bare pid and only its existence is checked.
+"""
+import os
+
+_boot_id = None
+_current = {}
+
+
+def _read_boot_id():
+    global _boot_id
+    if _boot_id is None:
+        try:
+            with open('/proc/sys/kernel/random/boot_id') as f:
+                _boot_id = f.read().strip().replace('-', '')[:12]
+        except OSError:
+            _boot_id = ''
+    return _boot_id
+
+
+def _start_time(pid):
+    """Start time of a process in clock ticks after boot, or None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name in parentheses may contain spaces; starttime is field 22
+    return stat[stat.rindex(')') + 2:].split()[19]
+
+
+def process_id(pid):
+    """Name of the process with this pid as it is now, or the bare pid without /proc"""
+    start = _start_time(pid)
+    if start is None or not _read_boot_id():
+        return str(pid)
+    return f"{pid}-{_read_boot_id()}-{start}"
+
+
+def current():
+    """Name of this process (recomputed after a fork)"""
+    pid = os.getpid()
+    if pid not in _current:
+        _current.clear()
+        _current[pid] = process_id(pid)
+    return _current[pid]
+
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_alive(owner):
+    """Whether the process named `owner` (from current(), or a bare pid) is still running"""
+    owner = str(owner)
+    try:
+        pid = int(owner.split('-', 1)[0])
+    except ValueError:
+        return False
+    if pid <= 0 or not _pid_exists(pid):
+        return False
+    # A bare pid, recorded before start times were, can only be checked for existence
+    return '-' not in owner or process_id(pid) == owner
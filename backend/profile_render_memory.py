@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Peak memory of whole-document page rendering, eager vs streamed.
+
+Builds a synthetic scan-like PDF with --pages pages and renders it in a child
+process, either the old way (convert_from_path on the whole document, which
+holds every page as a PIL image) or through page_render.iter_rendered_pages,
+which keeps at most --ahead pages in memory and drops each one after encoding.
+Each mode reports the child's peak RSS, which should grow with the page count
+for 'eager' and stay flat for 'stream'.
+
+Usage:
+  python profile_render_memory.py --pages 200
+  python profile_render_memory.py --pages 500 --dpi 300 --ahead 4 --modes stream
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+from pypdf import PdfReader, PdfWriter
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def build_synthetic_pdf(path, pages):
+    """Write a PDF of `pages` copies of an exam-like scanned page"""
+    page = Image.new('L', (1275, 1650), 255)
+    draw = ImageDraw.Draw(page)
+    y = 120
+    for question in range(1, 4):
+        draw.text((100, y), f"QUESTION {question}", fill=0)
+        y += 40
+        for line in range(6):
+            draw.text((100, y), "A company wants to store data durably and query it with standard SQL. " * 2, fill=0)
+            y += 28
+        for option in 'ABCD':
+            draw.text((120, y), f"{option}. Use an AWS managed service for option {option}", fill=0)
+            y += 28
+        draw.text((100, y), "Correct Answer: B", fill=0)
+        y += 80
+
+    single = io.BytesIO()
+    page.save(single, format='PDF', resolution=150)
+    template = PdfReader(io.BytesIO(single.getvalue())).pages[0]
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_page(template)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def measure(mode, pdf_path, dpi, ahead):
+    """Render every page in this process and print peak RSS as JSON"""
+    from image_encoding import encode_image
+
+    started = time.time()
+    encoded_bytes = 0
+    pages = 0
+    if mode == 'eager':
+        from pdf2image import convert_from_path
+        images = convert_from_path(pdf_path, dpi=dpi)
+        for image in images:
+            encoded_bytes += encode_image(image)[2]['bytes']
+            pages += 1
+        del images
+    else:
+        from page_render import iter_rendered_pages
+        page_count = len(PdfReader(pdf_path).pages)
+        for _, image, error in iter_rendered_pages(pdf_path, range(1, page_count + 1), dpi, ahead=ahead):
+            if error is not None:
+                raise error
+            encoded_bytes += encode_image(image)[2]['bytes']
+            del image
+            pages += 1
+
+    print(json.dumps({
+        'mode': mode,
+        'pages': pages,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'seconds': round(time.time() - started, 2),
+        'encoded_mb': round(encoded_bytes / 1024 / 1024, 1),
+    }))
+
+
+def run_profile(pages, dpi, ahead, modes):
+    with tempfile.TemporaryDirectory() as directory:
+        pdf_path = os.path.join(directory, 'synthetic.pdf')
+        print(f"📄 Building synthetic PDF with {pages} pages...")
+        build_synthetic_pdf(pdf_path, pages)
+        print(f"   {os.path.getsize(pdf_path) / 1024 / 1024:.1f}MB on disk, rendering at {dpi} DPI")
+
+        for mode in modes:
+            # A fresh process per mode so peak RSS is not carried over
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--measure', mode, '--pdf', pdf_path,
+                 '--dpi', str(dpi), '--ahead', str(ahead)],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            if completed.returncode != 0:
+                print(f"❌ {mode}: failed\n{completed.stderr.strip()[-2000:]}")
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            print(f"   {mode:<7} peak RSS {result['peak_rss_mb']:>8.1f}MB  {result['pages']} pages  "
+                  f"{result['seconds']:>7.2f}s  ({result['encoded_mb']}MB encoded)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile peak memory of eager vs streamed page rendering")
+    parser.add_argument("--pages", type=int, default=200, help="Pages in the synthetic PDF (default: 200)")
+    parser.add_argument("--dpi", type=int, default=300, help="Render DPI (default: 300)")
+    parser.add_argument("--ahead", type=int, default=2, help="Pages rendered ahead in stream mode (default: 2)")
+    parser.add_argument("--modes", default="stream,eager", help="Comma separated modes to run (default: stream,eager)")
+    parser.add_argument("--measure", choices=['eager', 'stream'], help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.pdf, args.dpi, args.ahead)
+    else:
+        run_profile(args.pages, args.dpi, args.ahead, [mode.strip() for mode in args.modes.split(',')])
@@ -0,0 +1,347 @@
+"""
+Adaptive rate limiting for OpenAI and Anthropic calls.
+
+Instead of fixed sleeps between calls, every call goes through the limiter of
+its model, which learns the account's remaining request and token budget and
+when it resets from the rate-limit headers of each response
+(x-ratelimit-remaining-requests/-tokens and x-ratelimit-reset-* from OpenAI,
+anthropic-ratelimit-* from Anthropic). Calls start immediately while budget is
+left and wait for the reset once it runs out. A 429 (or overload/5xx) is
+retried after its Retry-After, or an exponential backoff with jitter, and holds
+back every other call to that model meanwhile, so parallel workers do not all
+hit the limit again at once. A call given a `timeout` gets one overall deadline
+for its waits, retries and requests, and raises TimeoutError once a wait or
+retry would pass it.
+
+The limiter is per process: each gunicorn worker learns the shared account
+budget from the headers of its own responses.
+
+Every call, successful or not, is also recorded in the usage ledger with its
+tokens, latency and cost (see usage_ledger).
+"""
+import asyncio
+import email.utils
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+import metrics
+import usage_ledger
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+# Retries of a call after 429s, overload or server errors before giving up
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5'))
+RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv('RATE_LIMIT_BACKOFF_SECONDS', '1'))
+RATE_LIMIT_MAX_BACKOFF_SECONDS = float(os.getenv('RATE_LIMIT_MAX_BACKOFF_SECONDS', '60'))
+# Waits are stretched by up to this fraction so waiting calls do not all start together
+RATE_LIMIT_JITTER = float(os.getenv('RATE_LIMIT_JITTER', '0.2'))
+# Optional floor on the time between call starts, per model
+RATE_LIMIT_MIN_INTERVAL = float(os.getenv('RATE_LIMIT_MIN_INTERVAL', '0'))
+
+_RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def _header(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def _reset_seconds(value):
+    """Seconds until a reset given as '6m0s'/'20ms' (OpenAI), an RFC 3339 time (Anthropic) or plain seconds"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if parts and ''.join(number + unit for number, unit in parts) == value.strip():
+        return sum(float(number) * _UNITS[unit] for number, unit in parts)
+    try:
+        return max(0.0, datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() - time.time())
+    except ValueError:
+        return None
+
+
+def _retry_after(headers):
+    """Seconds the API asked us to wait, from retry-after-ms or Retry-After (seconds or an HTTP date)"""
+    value = _header(headers, 'retry-after-ms')
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = _header(headers, 'retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _budget(remaining, reset, now):
+    try:
+        remaining = int(remaining)
+    except (TypeError, ValueError):
+        return None
+    reset = _reset_seconds(reset)
+    return (remaining, now + reset) if reset is not None else None
+
+
+class RateLimiter:
+    """Request and token budget of one model, learned from the API's rate-limit headers"""
+
+    def __init__(self, name, min_interval=RATE_LIMIT_MIN_INTERVAL):
+        self.name = name
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        # (remaining, monotonic reset time), or None while unknown
+        self._requests = None
+        self._tokens = None
+        self._blocked_until = 0.0
+        self._next_start = 0.0
+
+    def _delay(self, tokens):
+        """Why and how long a call must wait, or (None, 0) once its budget is reserved"""
+        with self._lock:
+            now = time.monotonic()
+            # Past its reset a budget is unknown again until the next response reports it
+            if self._requests and self._requests[1] <= now:
+                self._requests = None
+            if self._tokens and self._tokens[1] <= now:
+                self._tokens = None
+            waits = {'retry': self._blocked_until - now, 'interval': self._next_start - now}
+            if self._requests and self._requests[0] < 1:
+                waits['requests'] = self._requests[1] - now
+            if self._tokens and tokens and self._tokens[0] < tokens:
+                waits['tokens'] = self._tokens[1] - now
+            reason, wait = max(waits.items(), key=lambda item: item[1])
+            if wait > 0:
+                return reason, min(wait, RATE_LIMIT_MAX_BACKOFF_SECONDS) * (1 + random.uniform(0, RATE_LIMIT_JITTER))
+            # Reserve this call's share until a response reports the real budget
+            if self._requests:
+                self._requests = (self._requests[0] - 1, self._requests[1])
+            if self._tokens and tokens:
+                self._tokens = (self._tokens[0] - tokens, self._tokens[1])
+            self._next_start = now + self.min_interval
+            return None, 0
+
+    def _waiting(self, reason, wait):
+        metrics.inc('rate_limit_waits_total', model=self.name, reason=reason)
+        if wait >= 1:
+            print(f"Rate limit ({self.name}): waiting {wait:.1f}s ({reason})")
+
+    def acquire(self, tokens=0, deadline=None):
+        """Block until a call estimated at `tokens` tokens may start; TimeoutError if that is past `deadline`"""
+        while True:
+            reason, wait = self._delay(tokens)
+            if reason is None:
+                return
+            _check_deadline(deadline, wait)
+            self._waiting(reason, wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0, deadline=None):
+        while True:
+            reason, wait = self._delay(tokens)
+            if reason is None:
+                return
+            _check_deadline(deadline, wait)
+            self._waiting(reason, wait)
+            await asyncio.sleep(wait)
+
+    def observe(self, headers):
+        """Take the remaining budget and reset times reported by a response"""
+        now = time.monotonic()
+        requests = _budget(_header(headers, 'x-ratelimit-remaining-requests', 'anthropic-ratelimit-requests-remaining'),
+                           _header(headers, 'x-ratelimit-reset-requests', 'anthropic-ratelimit-requests-reset'), now)
+        tokens = _budget(_header(headers, 'x-ratelimit-remaining-tokens', 'anthropic-ratelimit-tokens-remaining'),
+                         _header(headers, 'x-ratelimit-reset-tokens', 'anthropic-ratelimit-tokens-reset'), now)
+        with self._lock:
+            if requests:
+                self._requests = requests
+            if tokens:
+                self._tokens = tokens
+
+    def backoff(self, headers, attempt):
+        """Hold back calls after a rejected one: Retry-After if given, else exponential backoff with jitter"""
+        backoff = min(RATE_LIMIT_MAX_BACKOFF_SECONDS, RATE_LIMIT_BACKOFF_SECONDS * 2 ** attempt)
+        delay = max(_retry_after(headers) or 0, random.uniform(backoff / 2, backoff))
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        return delay
+
+
+def _check_deadline(deadline, wait=0):
+    """Raise TimeoutError if waiting `wait` seconds would pass the monotonic `deadline`"""
+    if deadline is not None and time.monotonic() + wait >= deadline:
+        raise TimeoutError('rate-limited call ran out of time')
+
+
+def _deadline(timeout):
+    return time.monotonic() + timeout if timeout else None
+
+
+def _attempt_kwargs(kwargs, deadline):
+    """The request's own timeout is what is left of the deadline"""
+    if deadline is None:
+        return kwargs
+    return {**kwargs, 'timeout': max(deadline - time.monotonic(), 0.001)}
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(model):
+    """The process-wide limiter of a model (rate limits are per model)"""
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = RateLimiter(model or 'default')
+        return _limiters[model]
+
+
+def _resource(client):
+    # OpenAI chat completions, or Anthropic messages
+    return client.chat.completions if hasattr(client, 'chat') else client.messages
+
+
+def _estimate_tokens(kwargs):
+    """Rough token cost of a call: its text at ~4 characters a token plus the completion allowance"""
+    chars = len(kwargs.get('system') or '')
+    for message in kwargs.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(part.get('text', '')) for part in content or [] if isinstance(part, dict))
+    return chars // 4 + kwargs.get('max_tokens', 0)
+
+
+def _retry_delay(limiter, error, attempt, deadline=None):
+    """Seconds before retrying a failed call, or None if it should not be retried"""
+    status = getattr(error, 'status_code', None)
+    if status is None and type(error).__name__ != 'APIConnectionError':
+        return None
+    response = getattr(error, 'response', None)
+    headers = response.headers if response is not None else {}
+    limiter.observe(headers)
+    if (status is not None and status not in _RETRY_STATUSES) or attempt >= RATE_LIMIT_MAX_RETRIES:
+        return None
+    delay = limiter.backoff(headers, attempt)
+    _check_deadline(deadline, delay)
+    metrics.inc('rate_limit_retries_total', model=limiter.name, status=status or 'connection')
+    print(f"{limiter.name} call failed ({status or 'connection error'}), retry {attempt + 1}/{RATE_LIMIT_MAX_RETRIES} in {delay:.1f}s")
+    return delay
+
+
+class _LedgerEntry:
+    """Reserves a call's worst-case cost in the run's budget and records the call in the usage ledger.
+
+    Async callers record through run_in_executor (record_errors=False), since
+    the ledger write is a blocking SQLite commit.
+    """
+
+    def __init__(self, kwargs, tokens, image_tokens, tags, record_errors=True):
+        self.model = kwargs.get('model')
+        self.image_tokens = image_tokens
+        self.tags = tags
+        completion = kwargs.get('max_tokens', 0)
+        self.estimate = usage_ledger.cost_of(self.model, max(tokens - completion, 0), completion)
+        self.run = usage_ledger.current_run()
+        self.record_errors = record_errors
+
+    def __enter__(self):
+        self.run.reserve(self.estimate)
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.run.release(self.estimate)
+        if exc is not None and self.record_errors:
+            self.failed(exc)
+
+    def failed(self, error):
+        usage_ledger.record(self.model, latency_seconds=time.monotonic() - self.started,
+                            image_tokens=self.image_tokens, error=error, tags=self.tags)
+
+    def done(self, response):
+        usage_ledger.record(self.model, getattr(response, 'usage', None), time.monotonic() - self.started,
+                            self.image_tokens, tags=self.tags)
+        return response
+
+
+def create(client, tokens=None, image_tokens=0, tags=None, timeout=None, **kwargs):
+    """client.chat.completions.create (OpenAI) or client.messages.create (Anthropic), paced by the model's limiter.
+
+    `tokens` is the expected token cost (prompt and completion) when the
+    messages alone do not tell, e.g. for images, of which `image_tokens` are
+    the image. Rate-limit and transient errors are retried here, the SDK's own
+    retries are turned off. The call is recorded in the usage ledger under
+    `tags` (document, page, question). `timeout` bounds the whole call,
+    limiter waits and retries included.
+    """
+    tokens = _estimate_tokens(kwargs) if tokens is None else tokens
+    with _LedgerEntry(kwargs, tokens, image_tokens, tags) as entry:
+        return entry.done(_create(client, tokens, kwargs, _deadline(timeout)))
+
+
+async def create_async(client, tokens=None, image_tokens=0, tags=None, timeout=None, **kwargs):
+    """create() for AsyncOpenAI/AsyncAnthropic clients"""
+    tokens = _estimate_tokens(kwargs) if tokens is None else tokens
+    loop = asyncio.get_running_loop()
+    # The ledger write is a blocking SQLite commit; keep it off the event loop
+    with _LedgerEntry(kwargs, tokens, image_tokens, tags, record_errors=False) as entry:
+        try:
+            response = await _create_async(client, tokens, kwargs, _deadline(timeout))
+        except BaseException as e:
+            await loop.run_in_executor(None, entry.failed, e)
+            raise
+    return await loop.run_in_executor(None, entry.done, response)
+
+
+def _create(client, tokens, kwargs, deadline=None):
+    if not RATE_LIMIT_ENABLED:
+        return _resource(client).create(**_attempt_kwargs(kwargs, deadline))
+    limiter = limiter_for(kwargs.get('model'))
+    resource = _resource(client.with_options(max_retries=0)).with_raw_response
+    for attempt in itertools.count():
+        limiter.acquire(tokens, deadline)
+        try:
+            response = resource.create(**_attempt_kwargs(kwargs, deadline))
+        except Exception as e:
+            if _retry_delay(limiter, e, attempt, deadline) is None:
+                raise
+            continue
+        limiter.observe(response.headers)
+        return response.parse()
+
+
+async def _create_async(client, tokens, kwargs, deadline=None):
+    if not RATE_LIMIT_ENABLED:
+        return await _resource(client).create(**_attempt_kwargs(kwargs, deadline))
+    limiter = limiter_for(kwargs.get('model'))
+    resource = _resource(client.with_options(max_retries=0)).with_raw_response
+    for attempt in itertools.count():
+        await limiter.acquire_async(tokens, deadline)
+        try:
+            response = await resource.create(**_attempt_kwargs(kwargs, deadline))
+        except Exception as e:
+            if _retry_delay(limiter, e, attempt, deadline) is None:
+                raise
+            continue
+        limiter.observe(response.headers)
+        return response.parse()
@@ -0,0 +1,206 @@
+"""
+Single-flight coalescing of identical in-flight page conversions.
+
+When two requests ask for the same page of the same document with the same
+options at the same time, only the first (the leader) does the work; the
+others wait for it and share its result. Within a worker, followers wait on
+the leader's call directly. Across gunicorn workers the leader holds an
+exclusive lock file per key; a follower in another worker waits for the lock
+and then re-checks the page cache, which the leader has filled, before doing
+the work itself. Where fcntl is unavailable (Windows) only threads of the
+same process are coalesced. A follower given a cancel token checks it every
+CANCEL_POLL_SECONDS while it waits, so a cancelled request does not stay
+parked behind someone else's page.
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import metrics
+from cancellation import CANCEL_POLL_SECONDS, Cancelled
+
+try:
+    import fcntl
+    FILE_LOCKS_AVAILABLE = True
+except ImportError:
+    FILE_LOCKS_AVAILABLE = False
+
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'True').lower() == 'true'
+SINGLE_FLIGHT_DIR = os.getenv('SINGLE_FLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'examtopics-flights'))
+# Longest a follower in another worker waits for the leader before doing the work itself
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('SINGLE_FLIGHT_WAIT_SECONDS', '180'))
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.cancelled:
+        metrics.inc('cancelled_pages_total', state='started')
+        raise Cancelled(cancel.reason)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run a function at most once at a time per key, sharing its result with concurrent callers"""
+
+    def __init__(self, lock_dir=SINGLE_FLIGHT_DIR, wait_seconds=SINGLE_FLIGHT_WAIT_SECONDS):
+        self.lock_dir = lock_dir
+        self.wait_seconds = wait_seconds
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        if FILE_LOCKS_AVAILABLE:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def _lock_path(self, key):
+        return os.path.join(self.lock_dir, hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:32] + '.lock')
+
+    def _acquire_file_lock(self, key, cancel=None):
+        """Take the cross-worker lock for a key; returns (fd or None, waited)"""
+        if not FILE_LOCKS_AVAILABLE:
+            return None, False
+        path = self._lock_path(key)
+        deadline = time.time() + self.wait_seconds
+        waited = False
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                waited = True
+                _check_cancel(cancel)
+                if time.time() > deadline:
+                    print(f"Single-flight: gave up waiting for another worker on {path}")
+                    return None, waited
+                time.sleep(0.1)
+                continue
+            # The previous holder unlinks the file on release; make sure we locked the current one
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd, waited
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _release_file_lock(self, key, fd):
+        if fd is None:
+            return
+        try:
+            os.unlink(self._lock_path(key))
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    def _lead(self, key, fn, recheck, cancel=None):
+        """Run fn as the leader in this process, after any leader in another worker"""
+        fd, waited = self._acquire_file_lock(key, cancel)
+        try:
+            if waited and recheck is not None:
+                value = recheck()
+                if value is not None:
+                    metrics.inc('single_flight_total', role='cross_worker_follower')
+                    return value, True
+            metrics.inc('single_flight_total', role='leader')
+            return fn(), False
+        finally:
+            self._release_file_lock(key, fd)
+
+    def do(self, key, fn, recheck=None, cancel=None):
+        """Return (value, shared). shared is True when another caller's work was reused.
+
+        recheck() is called after waiting on another worker and should return
+        the stored result (e.g. from the page cache) or None. Raises Cancelled
+        if `cancel` is set while waiting on another caller.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+
+            metrics.inc('single_flight_total', role='follower')
+            while not call.done.wait(CANCEL_POLL_SECONDS):
+                _check_cancel(cancel)
+            if isinstance(call.error, Cancelled):
+                continue  # the leader's request was cancelled; take over
+            if call.error is not None:
+                raise call.error
+            return call.value[0], True
+
+        try:
+            call.value = self._lead(key, fn, recheck, cancel)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def _acquire_file_lock_async(self, key):
+        loop = asyncio.get_running_loop()
+        # Waiting on another worker happens on the default executor, not the page pool
+        acquiring = loop.run_in_executor(None, self._acquire_file_lock, key)
+        try:
+            return await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The lock is still taken in the background; release it once it is
+            acquiring.add_done_callback(
+                lambda done: done.exception() is None and self._release_file_lock(key, done.result()[0])
+            )
+            raise
+
+    async def do_async(self, key, coroutine_fn, recheck=None):
+        """do() for coroutines: followers await the leader without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        while key in self._async_calls:
+            future = self._async_calls[key]
+            metrics.inc('single_flight_total', role='follower')
+            try:
+                value, _ = await asyncio.shield(future)
+                return value, True
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue  # the leader's client went away; take over
+                raise
+
+        future = self._async_calls[key] = loop.create_future()
+        fd = None
+        try:
+            fd, waited = await self._acquire_file_lock_async(key)
+            value = None
+            if waited and recheck is not None:
+                value = await loop.run_in_executor(None, recheck)
+            if value is not None:
+                metrics.inc('single_flight_total', role='cross_worker_follower')
+                outcome = (value, True)
+            else:
+                metrics.inc('single_flight_total', role='leader')
+                outcome = (await coroutine_fn(), False)
+            future.set_result(outcome)
+            return outcome
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved; there may be no followers
+            raise
+        finally:
+            del self._async_calls[key]
+            self._release_file_lock(key, fd)
+
+
+page_flights = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
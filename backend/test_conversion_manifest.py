@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Checks for conversion_manifest: resuming after a crash, dropping a damaged
+or half-written tail, and putting retried pages back in page order.
+
+Usage:
+  python test_conversion_manifest.py
+"""
+import json
+import os
+import tempfile
+
+from conversion_manifest import ConversionManifest, manifest_path
+
+
+WORK_DIR = tempfile.TemporaryDirectory(prefix='manifest-test-')
+
+
+def new_output():
+    return os.path.join(tempfile.mkdtemp(dir=WORK_DIR.name), 'out.md')
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_resume_keeps_finished_pages():
+    output = new_output()
+    manifest = ConversionManifest.start(output, 'exam.pdf', 'digest')
+    manifest.record(1, 'one', 'vision', usage={'prompt_tokens': 10, 'completion_tokens': 2})
+    manifest.record_failure(2, 'timed out')
+    manifest.record(3, 'three', 'vision')
+
+    resumed = ConversionManifest.resume(output, 'exam.pdf', 'digest')
+    assert resumed.finished_pages() == {1, 3}
+    assert resumed.failed_pages() == {2}
+    assert resumed.totals()['prompt_tokens'] == 10
+    assert read(output) == '# Page 1\n\none\n\n---\n\n# Page 3\n\nthree'
+
+
+def test_resume_refuses_another_pdf():
+    output = new_output()
+    ConversionManifest.start(output, 'exam.pdf', 'digest')
+    try:
+        ConversionManifest.resume(output, 'other.pdf', 'other-digest')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('expected ValueError')
+    assert ConversionManifest.resume(new_output(), 'exam.pdf', 'digest') is None
+
+
+def test_resume_truncates_half_written_tail():
+    output = new_output()
+    manifest = ConversionManifest.start(output, 'exam.pdf', 'digest')
+    manifest.record(1, 'one', 'vision')
+    # A crash while appending page 2, before the manifest was saved
+    with open(output, 'ab') as f:
+        f.write(b'\n\n---\n\n# Page 2\n\nhalf')
+
+    resumed = ConversionManifest.resume(output, 'exam.pdf', 'digest')
+    assert resumed.finished_pages() == {1}
+    assert read(output) == '# Page 1\n\none'
+
+
+def test_resume_drops_damaged_pages_and_those_after():
+    output = new_output()
+    manifest = ConversionManifest.start(output, 'exam.pdf', 'digest')
+    for page in (1, 2, 3):
+        manifest.record(page, f'page {page}', 'vision')
+    content = read(output).replace('page 2', 'page X')
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+    resumed = ConversionManifest.resume(output, 'exam.pdf', 'digest')
+    assert resumed.finished_pages() == {1}
+    assert read(output) == '# Page 1\n\npage 1'
+
+
+def test_finalize_puts_retried_pages_in_order():
+    output = new_output()
+    manifest = ConversionManifest.start(output, 'exam.pdf', 'digest')
+    manifest.record(1, 'one', 'vision')
+    manifest.record_failure(2, 'timed out')
+    manifest.record(3, 'three', 'vision')
+    assert not manifest.finalize()
+
+    resumed = ConversionManifest.resume(output, 'exam.pdf', 'digest')
+    resumed.record(2, 'two', 'vision')
+    assert resumed.finalize()
+    assert read(output) == '# Page 1\n\none\n\n---\n\n# Page 2\n\ntwo\n\n---\n\n# Page 3\n\nthree'
+    assert ConversionManifest.resume(output, 'exam.pdf', 'digest').finished_pages() == {1, 2, 3}
+
+
+def test_interrupted_finalize_completes_on_resume():
+    output = new_output()
+    manifest = ConversionManifest.start(output, 'exam.pdf', 'digest')
+    manifest.record(2, 'two', 'vision')
+    manifest.record(1, 'one', 'vision')
+    # Crash after the reordered file and journal were written, before the swap
+    manifest._finish_reorder = lambda: None
+    manifest.finalize()
+    with open(manifest_path(output), encoding='utf-8') as f:
+        assert 'reorder' in json.load(f)
+
+    resumed = ConversionManifest.resume(output, 'exam.pdf', 'digest')
+    assert resumed.finished_pages() == {1, 2}
+    assert read(output) == '# Page 1\n\none\n\n---\n\n# Page 2\n\ntwo'
+    assert not resumed.finalize()
+
+
+def test_fallback_pages_are_retried_and_replaced():
+    output = new_output()
+    manifest = ConversionManifest.start(output, 'exam.pdf', 'digest')
+    manifest.record(1, 'one', 'vision')
+    manifest.record(2, 'two from tesseract', 'tesseract', fallback=True)
+    manifest.record(3, 'three', 'vision')
+
+    resumed = ConversionManifest.resume(output, 'exam.pdf', 'digest')
+    assert resumed.finished_pages() == {1, 3} and resumed.fallback_pages() == {2}
+    # A failed retry keeps the fallback text
+    resumed.record_failure(2, 'timed out')
+    assert resumed.fallback_pages() == {2}
+    resumed.record(2, 'two', 'vision')
+    assert resumed.finalize()
+    assert read(output) == '# Page 1\n\none\n\n---\n\n# Page 2\n\ntwo\n\n---\n\n# Page 3\n\nthree'
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
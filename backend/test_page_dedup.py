@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Checks for page_dedup: blank pages, exact copies, and exam pages that differ
+only in the question number or answer letter, which must never be merged.
+
+Usage:
+  python test_page_dedup.py
+"""
+import os
+import tempfile
+
+from PIL import Image, ImageDraw, ImageFont
+
+import page_render
+from page_dedup import PAGE_DEDUP_MAX_DISTANCE, PageDeduplicator, dhash, hamming, _gray_thumbnail
+
+BODY = [f"A company stores data in Amazon S3 and needs option {i} to be encrypted at rest." for i in range(14)]
+
+
+def exam_page(number, answer, body=BODY):
+    font = ImageFont.load_default(size=22)
+    image = Image.new('RGB', (1240, 1754), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.text((100, 100), f"QUESTION {number}", fill='black', font=font)
+    for index, line in enumerate(body):
+        draw.text((100, 160 + index * 40), line, fill='black', font=font)
+    draw.text((100, 160 + len(body) * 40 + 40), f"Correct Answer: {answer}", fill='black', font=font)
+    return image
+
+
+def rendered_pages(images):
+    """Save images as a PDF and render its pages back, as the converter sees them"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'pages.pdf')
+        images[0].save(path, save_all=True, append_images=images[1:], resolution=150)
+        pages = [image for _, image, _ in page_render.iter_rendered_pages(path, range(1, len(images) + 1), 150)]
+        page_render.close_documents()
+        return pages
+
+
+def test_pages_differing_in_question_number_are_not_duplicates():
+    q12, q13 = exam_page(12, 'A'), exam_page(13, 'D')
+    # The thumbnail hash cannot tell these apart, which is why near matching is opt-in
+    assert hamming(dhash(_gray_thumbnail(q12.copy())), dhash(_gray_thumbnail(q13.copy()))) <= PAGE_DEDUP_MAX_DISTANCE
+    dedup = PageDeduplicator()
+    assert dedup.check(1, q12) == (None, None)
+    assert dedup.check(2, q13) == (None, None)
+
+
+def test_rendered_copies_blank_pages_and_distinct_questions():
+    blank = Image.new('RGB', (1240, 1754), 'white')
+    pages = rendered_pages([exam_page(12, 'A'), blank, exam_page(13, 'D'), exam_page(12, 'A'),
+                            exam_page(14, 'A', BODY[:-1] + ["A single changed line."])])
+    dedup = PageDeduplicator()
+    results = [dedup.check(number, image) for number, image in enumerate(pages, 1)]
+    assert results == [(None, None), ('blank', None), (None, None), ('duplicate', 1), (None, None)], results
+    assert dedup.report() == ["Skipped 1 blank page(s): 2",
+                              "Reused OCR for 1 duplicate page(s) (page=original): 4=1"], dedup.report()
+
+
+def test_embedded_pages_compare_bytes():
+    dedup = PageDeduplicator()
+    assert dedup.check(1, exam_page(1, 'A'), b'jpeg-1') == (None, None)
+    assert dedup.check(2, exam_page(1, 'A'), b'jpeg-2') == (None, None)
+    assert dedup.check(3, exam_page(1, 'A'), b'jpeg-1') == ('duplicate', 1)
+
+
+def test_near_matching_is_opt_in():
+    page = exam_page(7, 'B')
+    reencoded = page.resize((1100, 1556)).resize(page.size)
+    assert PageDeduplicator().check(1, page.copy()) == (None, None)
+    exact_only = PageDeduplicator()
+    exact_only.check(1, page.copy())
+    assert exact_only.check(2, reencoded.copy()) == (None, None)
+    near = PageDeduplicator(near=True)
+    near.check(1, page.copy())
+    assert near.check(2, reencoded.copy()) == ('duplicate', 1)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
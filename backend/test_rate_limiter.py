@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Checks for rate_limiter: rate-limit header parsing, and the overall deadline
+of a call given a timeout (waits for a reset, backoff and retries included).
+
+Uses fake clients, no API key needed.
+
+Usage:
+  python test_rate_limiter.py
+"""
+import asyncio
+import email.utils
+import os
+import threading
+import time
+import types
+
+os.environ.setdefault('USAGE_LEDGER_ENABLED', 'False')
+
+import rate_limiter
+import usage_ledger
+from rate_limiter import RateLimiter, _reset_seconds, _retry_after
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__('429 Too Many Requests')
+        self.response = types.SimpleNamespace(headers=headers)
+
+
+class FakeClient:
+    """Answers every call with a 429 asking to retry after `retry_after` seconds, or with a response"""
+
+    def __init__(self, retry_after=None, headers=None):
+        self.retry_after = retry_after
+        self.headers = headers or {}
+        self.calls = []
+        completions = types.SimpleNamespace(create=self._create)
+        completions.with_raw_response = types.SimpleNamespace(create=self._create)
+        self.chat = types.SimpleNamespace(completions=completions)
+
+    def with_options(self, **options):
+        return self
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.retry_after is not None:
+            raise RateLimited({'retry-after': str(self.retry_after)})
+        return types.SimpleNamespace(headers=self.headers, parse=lambda: 'response')
+
+
+def test_reset_seconds():
+    assert _reset_seconds(None) is None
+    assert _reset_seconds('20ms') == 0.02
+    assert _reset_seconds('6m0s') == 360
+    assert _reset_seconds('1h2m3.5s') == 3723.5
+    assert _reset_seconds('1.5') == 1.5
+    assert _reset_seconds('-3') == 0
+    assert _reset_seconds('6m0sx') is None
+    assert _reset_seconds('soon') is None
+    reset = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 30))
+    assert 28 <= _reset_seconds(reset) <= 30
+    past = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - 30))
+    assert _reset_seconds(past) == 0
+
+
+def test_retry_after():
+    assert _retry_after({}) is None
+    assert _retry_after({'retry-after-ms': '250'}) == 0.25
+    # retry-after-ms wins over Retry-After, and a bad value falls back to it
+    assert _retry_after({'retry-after-ms': '250', 'retry-after': '9'}) == 0.25
+    assert _retry_after({'retry-after-ms': 'x', 'retry-after': '9'}) == 9
+    assert _retry_after({'retry-after': '-1'}) == 0
+    later = email.utils.formatdate(time.time() + 20, usegmt=True)
+    assert 18 <= _retry_after({'retry-after': later}) <= 20
+    assert _retry_after({'retry-after': 'tomorrow'}) is None
+
+
+def test_observe_learns_budget():
+    limiter = RateLimiter('observe')
+    limiter.observe({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '30s',
+                     'x-ratelimit-remaining-tokens': '5000', 'x-ratelimit-reset-tokens': '1m'})
+    reason, wait = limiter._delay(100)
+    assert reason == 'requests' and 29 <= wait <= 30 * (1 + rate_limiter.RATE_LIMIT_JITTER), (reason, wait)
+
+
+def test_deadline_stops_retries():
+    client = FakeClient(retry_after=0.4)
+    rate_limiter._limiters.pop('retries', None)
+    started = time.monotonic()
+    try:
+        rate_limiter.create(client, model='retries', messages=[], timeout=1)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError('expected TimeoutError')
+    assert time.monotonic() - started < 1.5
+    assert 1 <= len(client.calls) < rate_limiter.RATE_LIMIT_MAX_RETRIES
+    # Each attempt only gets what is left of the deadline
+    assert all(0 < call['timeout'] <= 1 for call in client.calls)
+
+
+def test_deadline_stops_reset_wait():
+    rate_limiter.limiter_for('reset').observe({'x-ratelimit-remaining-requests': '0',
+                                               'x-ratelimit-reset-requests': '30s'})
+    client = FakeClient()
+    started = time.monotonic()
+    try:
+        rate_limiter.create(client, model='reset', messages=[], timeout=2)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError('expected TimeoutError')
+    assert time.monotonic() - started < 0.5 and not client.calls
+
+
+def test_call_without_timeout():
+    client = FakeClient(headers={'x-ratelimit-remaining-requests': '10'})
+    assert rate_limiter.create(client, model='plain', messages=[]) == 'response'
+    assert 'timeout' not in client.calls[0]
+
+
+def test_async_calls_record_usage_off_the_event_loop():
+    recorded = []
+    original = usage_ledger.record
+    usage_ledger.record = lambda *args, **kwargs: recorded.append((threading.current_thread(), kwargs.get('error')))
+
+    async def create(**kwargs):
+        if kwargs['model'] == 'async-error':
+            raise ValueError('bad request')
+        return types.SimpleNamespace(headers={}, parse=lambda: 'response')
+
+    completions = types.SimpleNamespace(create=create)
+    completions.with_raw_response = completions
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions),
+                                   with_options=lambda **options: client)
+    try:
+        assert asyncio.run(rate_limiter.create_async(client, model='async-ok', messages=[])) == 'response'
+        try:
+            asyncio.run(rate_limiter.create_async(client, model='async-error', messages=[]))
+        except ValueError:
+            pass
+    finally:
+        usage_ledger.record = original
+    assert [error is None for _, error in recorded] == [True, False], recorded
+    assert all(thread is not threading.main_thread() for thread, _ in recorded)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Checks for single_flight: concurrent callers share one call, a cancelled
+leader hands the work to a follower, and a cancelled follower stops waiting
+while the leader carries on.
+
+Usage:
+  python test_single_flight.py
+"""
+import asyncio
+import tempfile
+import threading
+import time
+
+from cancellation import CancelToken, Cancelled
+from single_flight import SingleFlight
+
+WORK_DIR = tempfile.TemporaryDirectory(prefix='single-flight-test-')
+LOCK_DIR = WORK_DIR.name
+
+
+def run_threads(*targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join(10)
+
+
+def test_followers_share_the_leaders_result():
+    flights = SingleFlight(LOCK_DIR)
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.3)
+        return 'page'
+
+    run_threads(*[lambda: results.append(flights.do('key', work))] * 4)
+    assert len(calls) == 1, calls
+    assert sorted(results) == [('page', False)] + [('page', True)] * 3, results
+
+
+def test_cancelled_leader_hands_over_to_a_follower():
+    flights = SingleFlight(LOCK_DIR)
+    leader_cancel = CancelToken('leader')
+    outcomes = {}
+
+    def leader_work():
+        time.sleep(0.2)
+        raise Cancelled(leader_cancel.reason)
+
+    def leader():
+        try:
+            flights.do('key', leader_work, cancel=leader_cancel)
+        except Cancelled:
+            outcomes['leader'] = 'cancelled'
+
+    def follower():
+        outcomes['follower'] = flights.do('key', lambda: 'follower did it')
+
+    run_threads(leader, follower)
+    assert outcomes == {'leader': 'cancelled', 'follower': ('follower did it', False)}, outcomes
+
+
+def test_cancelled_follower_stops_waiting():
+    flights = SingleFlight(LOCK_DIR)
+    follower_cancel = CancelToken('follower')
+    outcomes = {}
+
+    def leader():
+        outcomes['leader'] = flights.do('key', lambda: time.sleep(2) or 'page')
+
+    def follower():
+        started = time.monotonic()
+        try:
+            flights.do('key', lambda: 'never', cancel=follower_cancel)
+        except Cancelled:
+            outcomes['follower'] = time.monotonic() - started
+
+    def cancel_follower():
+        time.sleep(0.2)
+        follower_cancel.cancel('disconnect')
+
+    run_threads(leader, follower, cancel_follower)
+    assert outcomes['leader'] == ('page', False), outcomes
+    assert outcomes['follower'] < 1.5, outcomes
+
+
+def test_async_cancelled_leader_hands_over():
+    flights = SingleFlight(LOCK_DIR)
+
+    async def slow():
+        await asyncio.sleep(1)
+        return 'leader'
+
+    async def fast():
+        return 'follower'
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do_async('key', slow))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(flights.do_async('key', fast))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        return await follower, leader.cancelled()
+
+    assert asyncio.run(main()) == (('follower', False), True)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,105 @@
+"""
+Text-layer fast path for born-digital PDF pages.
+
+Many exam PDFs carry a usable text layer. Extracting it with pdfium takes
+milliseconds, so each page is scored first and only pages whose text layer is
+missing or garbled are rasterized and sent to vision OCR.
+"""
+import os
+import re
+import unicodedata
+
+from page_render import cached_document, pdfium_lock
+
+TEXT_LAYER_ENABLED = os.getenv('TEXT_LAYER_ENABLED', 'True').lower() == 'true'
+TEXT_LAYER_MIN_CHARS = int(os.getenv('TEXT_LAYER_MIN_CHARS', '200'))
+TEXT_LAYER_MAX_GARBAGE_RATIO = float(os.getenv('TEXT_LAYER_MAX_GARBAGE_RATIO', '0.05'))
+
+_QUESTION_RE = re.compile(r'^\s*(?:QUESTION\s+\d+|Question\s+#\d+)', re.MULTILINE)
+_OPTION_RE = re.compile(r'^\s*[A-F][.)]\s+\S', re.MULTILINE)
+_CORRECT_ANSWER_RE = re.compile(r'^\s*Correct Answer:\s*(.*)$', re.MULTILINE)
+_WORD_RE = re.compile(r'[A-Za-z]{2,}')
+
+
+def _is_garbage(char):
+    """Characters that indicate a broken font mapping rather than real text"""
+    if char == '�':
+        return True
+    category = unicodedata.category(char)
+    if category == 'Co':  # private use area glyphs
+        return True
+    return category == 'Cc' and char not in '\n\r\t'
+
+
+def score_text(text):
+    """Score a page's text layer and decide whether it can replace vision OCR"""
+    stripped = ''.join(text.split())
+    chars = len(stripped)
+    garbage = sum(1 for char in stripped if _is_garbage(char))
+    garbage_ratio = garbage / chars if chars else 1.0
+    words = _WORD_RE.findall(text)
+    has_question = bool(_QUESTION_RE.search(text))
+    option_count = len(_OPTION_RE.findall(text))
+    # Real prose is mostly dictionary-like words; CID soup extracts as symbols and fragments
+    word_coverage = sum(len(word) for word in words) / chars if chars else 0.0
+
+    if chars < TEXT_LAYER_MIN_CHARS:
+        reason = f'too little text ({chars} chars)'
+    elif garbage_ratio > TEXT_LAYER_MAX_GARBAGE_RATIO:
+        reason = f'garbled glyphs ({garbage_ratio:.1%})'
+    elif not (has_question or option_count >= 2) and word_coverage < 0.6:
+        reason = f'no exam structure and low word coverage ({word_coverage:.0%})'
+    else:
+        reason = None
+
+    return {
+        'usable': reason is None,
+        'reason': reason,
+        'chars': chars,
+        'garbage_ratio': round(garbage_ratio, 4),
+        'has_question': has_question,
+        'option_count': option_count,
+        'word_coverage': round(word_coverage, 3),
+    }
+
+
+def text_to_markdown(text):
+    """Light markdown formatting of extracted text, in the shape the question extractor expects"""
+    lines = []
+    for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        line = line.rstrip()
+        if _QUESTION_RE.match(line):
+            line = f"## {line.strip()}"
+        else:
+            answer = _CORRECT_ANSWER_RE.match(line)
+            if answer:
+                line = f"**Correct Answer:** {answer.group(1).strip()}"
+        lines.append(line)
+    markdown = '\n'.join(lines)
+    return re.sub(r'\n{3,}', '\n\n', markdown).strip()
+
+
+def extract_page_text(pdf_path, page_number):
+    """Text layer of one page (1-based), from the document page_render keeps open"""
+    with pdfium_lock:
+        page = cached_document(pdf_path)[page_number - 1]
+        try:
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            return text
+        finally:
+            page.close()
+
+
+def try_text_layer(pdf_path, page_number):
+    """Return (markdown, score); markdown is None when the page needs vision OCR"""
+    try:
+        text = extract_page_text(pdf_path, page_number)
+    except Exception as e:
+        print(f"Page {page_number}: text layer extraction failed: {e}")
+        return None, {'usable': False, 'reason': f'extraction failed: {e}'}
+    score = score_text(text)
+    if not score['usable']:
+        return None, score
+    return text_to_markdown(text), score
@@ -0,0 +1,193 @@
+"""
+Content-addressed store for uploaded PDFs.
+
+Uploads are kept on disk under their SHA-256 digest so that clients can refer
+to a document by digest instead of re-sending it for every page. The store is
+bounded by total size and evicts the least recently used files first.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+import metrics
+from pypdf import PdfReader, PdfWriter
+
+UPLOAD_CACHE_DIR = os.getenv('UPLOAD_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'examtopics-uploads'))
+UPLOAD_CACHE_MAX_MB = int(os.getenv('UPLOAD_CACHE_MAX_MB', '2048'))
+
+# Files used within this many seconds are never evicted, so a request that has
+# just resolved a path does not lose the file underneath it.
+EVICTION_GRACE_SECONDS = 60
+
+# Temp files untouched for this long belong to a write that was interrupted
+# (a worker killed mid-upload) and are removed at startup.
+STALE_PART_SECONDS = 3600
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_file(path):
+    """Return the hex SHA-256 digest of a file on disk"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_valid_digest(digest):
+    """Check that a client supplied digest looks like a hex SHA-256"""
+    return bool(digest) and bool(_DIGEST_RE.match(digest))
+
+
+class UploadStore:
+    """On-disk PDF store keyed by SHA-256 with size-bounded LRU eviction"""
+
+    def __init__(self, directory=UPLOAD_CACHE_DIR, max_bytes=UPLOAD_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._page_counts = {}
+        os.makedirs(self.directory, exist_ok=True)
+        self._remove_stale_parts()
+
+    def _remove_stale_parts(self):
+        cutoff = time.time() - STALE_PART_SECONDS
+        for name in os.listdir(self.directory):
+            if not name.endswith('.part'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    print(f"Removed interrupted upload: {name}")
+            except FileNotFoundError:
+                pass
+
+    def _path(self, digest, page_number=None):
+        if page_number is None:
+            return os.path.join(self.directory, f"{digest}.pdf")
+        return os.path.join(self.directory, f"{digest}-p{page_number:05d}.pdf")
+
+    def save_upload(self, file_storage):
+        """Hash and store an uploaded file, returning its digest"""
+        return self.save_stream(file_storage.stream)
+
+    def save_stream(self, stream):
+        """Hash and store the contents of a binary file object, returning its digest"""
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with metrics.timed('upload_save'), os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            hex_digest = digest.hexdigest()
+            final_path = self._path(hex_digest)
+            already_stored = os.path.exists(final_path)
+            metrics.record_cache_lookup('upload', already_stored)
+            if already_stored:
+                os.remove(temp_path)
+                os.utime(final_path)
+                print(f"Upload already stored: {hex_digest}")
+            else:
+                os.replace(temp_path, final_path)
+                print(f"Stored upload {hex_digest} ({os.path.getsize(final_path)} bytes)")
+        finally:
+            # Also reached when the client disconnects or the request is cancelled mid-upload
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self.evict()
+        return hex_digest
+
+    def stored_path(self, digest):
+        """Path of a digest that was just stored by save_upload"""
+        return self._path(digest)
+
+    def get_path(self, digest):
+        """Return the stored path for a digest, or None if it is not stored"""
+        if not is_valid_digest(digest):
+            return None
+        path = self._path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._page_counts.pop(digest, None)
+            metrics.record_cache_lookup('upload', False)
+            return None
+        metrics.record_cache_lookup('upload', True)
+        return path
+
+    def page_count(self, digest):
+        """Number of pages in a stored PDF, parsed once per digest"""
+        count = self._page_counts.get(digest)
+        if count is None:
+            with metrics.timed('pdf_parse'):
+                count = len(PdfReader(self._path(digest)).pages)
+            self._page_counts[digest] = count
+        return count
+
+    def page_pdf_path(self, digest, page_number):
+        """Return a single-page PDF for a stored document, extracting it once"""
+        page_path = self._path(digest, page_number)
+        if os.path.exists(page_path):
+            os.utime(page_path)
+            return page_path
+
+        with metrics.timed('pdf_split'):
+            reader = PdfReader(self._path(digest))
+            writer = PdfWriter()
+            writer.add_page(reader.pages[page_number - 1])
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    writer.write(out)
+                os.replace(temp_path, page_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return page_path
+
+    def evict(self):
+        """Remove least recently used files until the store fits its size limit"""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith('.pdf'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path, name))
+                total += stat.st_size
+
+            # Forget page counts of documents no longer stored, including those
+            # evicted by other workers sharing the directory
+            stored = {name[:-len('.pdf')] for *_, name in entries}
+            for digest in [digest for digest in self._page_counts if digest not in stored]:
+                del self._page_counts[digest]
+
+            if total <= self.max_bytes:
+                return
+
+            cutoff = time.time() - EVICTION_GRACE_SECONDS
+            for mtime, size, path, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if mtime > cutoff:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self._page_counts.pop(name[:64], None)
+                print(f"Evicted cached upload: {name}")
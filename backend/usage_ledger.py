@@ -0,0 +1,358 @@
+"""
+Token and cost ledger for OpenAI and Anthropic calls.
+
+Every call made through rate_limiter.create()/create_async() (and every page
+merged from a Batch API job) is recorded in a local SQLite database: model,
+prompt, completion and estimated image tokens, latency, cost and whether it
+failed, tagged with the run it belongs to and the document, page or question
+it was made for. Cost comes from per-million-token prices (USAGE_PRICES
+overrides or adds to the built-in list); batch calls are billed at
+USAGE_BATCH_DISCOUNT of the price.
+
+A run is one invocation of a script (or one service process). With a budget
+the run projects its spend as the cost recorded so far plus the calls in
+flight and the next call, at the run's average cost per call (at their
+worst case, full completion allowance, until a call has finished); scripts
+check over_budget() before scheduling more work and stop once it is exceeded.
+
+Reports per run, including per-page and per-question cost and latency
+percentiles:
+  python usage_ledger.py              # latest run
+  python usage_ledger.py --run <id>
+  python usage_ledger.py --runs 20    # list recent runs
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import metrics
+
+USAGE_LEDGER_ENABLED = os.getenv('USAGE_LEDGER_ENABLED', 'True').lower() == 'true'
+USAGE_LEDGER_PATH = os.getenv('USAGE_LEDGER_PATH', os.path.expanduser('~/.cache/examtopics/usage_ledger.sqlite3'))
+# Share of the normal price paid for Batch API requests
+USAGE_BATCH_DISCOUNT = float(os.getenv('USAGE_BATCH_DISCOUNT', '0.5'))
+
+# USD per million (input, output) tokens; a model is priced by the longest matching prefix
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'claude-3-5-sonnet': (3.00, 15.00),
+    'claude-3-7-sonnet': (3.00, 15.00),
+    'claude-sonnet-4': (3.00, 15.00),
+    'claude-3-5-haiku': (0.80, 4.00),
+    'claude-3-opus': (15.00, 75.00),
+    'claude-opus-4': (15.00, 75.00),
+}
+
+
+def _parse_prices(value):
+    """'gpt-4o=2.5/10,my-model=1/2' -> {model: (input, output)}"""
+    prices = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        model, _, price = item.partition('=')
+        input_price, _, output_price = price.partition('/')
+        prices[model.strip()] = (float(input_price), float(output_price or input_price))
+    return prices
+
+
+MODEL_PRICES.update(_parse_prices(os.getenv('USAGE_PRICES', '')))
+
+_unpriced_warned = set()
+
+
+def price_for(model):
+    """(input, output) USD per million tokens, or None for an unknown model"""
+    matches = [prefix for prefix in MODEL_PRICES if (model or '').startswith(prefix)]
+    if not matches:
+        if model not in _unpriced_warned:
+            _unpriced_warned.add(model)
+            print(f"Usage ledger: no price for model {model}, its calls are recorded at no cost (see USAGE_PRICES)")
+        return None
+    return MODEL_PRICES[max(matches, key=len)]
+
+
+def cost_of(model, prompt_tokens, completion_tokens, batch=False):
+    price = price_for(model)
+    if price is None:
+        return 0.0
+    cost = (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+    return cost * USAGE_BATCH_DISCOUNT if batch else cost
+
+
+def usage_tokens(usage):
+    """(prompt, completion) tokens from an OpenAI or Anthropic response.usage"""
+    if usage is None:
+        return 0, 0
+    prompt = getattr(usage, 'prompt_tokens', None)
+    if prompt is None:
+        prompt = getattr(usage, 'input_tokens', 0)
+    completion = getattr(usage, 'completion_tokens', None)
+    if completion is None:
+        completion = getattr(usage, 'output_tokens', 0)
+    return prompt or 0, completion or 0
+
+
+class UsageLedger:
+    """SQLite table of API calls, shared by the scripts and the service like the page cache"""
+
+    def __init__(self, path=USAGE_LEDGER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS calls (
+                id INTEGER PRIMARY KEY,
+                created_at REAL NOT NULL,
+                run TEXT NOT NULL,
+                source TEXT NOT NULL,
+                model TEXT NOT NULL,
+                status TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                image_tokens INTEGER NOT NULL,
+                latency_seconds REAL,
+                cost REAL NOT NULL,
+                batch INTEGER NOT NULL,
+                document TEXT,
+                page INTEGER,
+                question TEXT,
+                error TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS calls_run ON calls (run)")
+        self._conn.commit()
+
+    def add(self, call):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO calls (created_at, run, source, model, status, prompt_tokens, completion_tokens, "
+                "image_tokens, latency_seconds, cost, batch, document, page, question, error) "
+                "VALUES (:created_at, :run, :source, :model, :status, :prompt_tokens, :completion_tokens, "
+                ":image_tokens, :latency_seconds, :cost, :batch, :document, :page, :question, :error)",
+                call
+            )
+            self._conn.commit()
+
+    def calls(self, run):
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM calls WHERE run=? ORDER BY id", (run,))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def runs(self, limit=20):
+        """Most recent runs first: (run, source, started, calls, cost)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT run, source, MIN(created_at), COUNT(*), SUM(cost) FROM calls "
+                "GROUP BY run ORDER BY MIN(created_at) DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """The process-wide ledger, opened on first use; None when disabled"""
+    global _ledger
+    if not USAGE_LEDGER_ENABLED:
+        return None
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = UsageLedger()
+    return _ledger
+
+
+class UsageRun:
+    """Spend of one script invocation or service process, with an optional budget in USD"""
+
+    def __init__(self, source, budget=None):
+        self.source = source
+        self.budget = budget
+        self.id = f"{source}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.spent = 0.0
+        self.calls = 0
+        # Calls in flight and the sum of their worst-case costs
+        self._in_flight = 0
+        self._in_flight_cost = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, estimate):
+        """Count a call being made, at its worst-case cost, toward the projection"""
+        with self._lock:
+            self._in_flight += 1
+            self._in_flight_cost += estimate
+
+    def release(self, estimate):
+        with self._lock:
+            self._in_flight -= 1
+            self._in_flight_cost -= estimate
+
+    def charge(self, cost):
+        with self._lock:
+            self.spent += cost
+            self.calls += 1
+
+    def projected(self):
+        """Spend so far plus calls in flight and one more call, at the average cost once there is one"""
+        with self._lock:
+            if not self.calls:
+                return self._in_flight_cost
+            return self.spent + self.spent / self.calls * (self._in_flight + 1)
+
+    def over_budget(self):
+        return self.budget is not None and self.projected() > self.budget
+
+
+_run = None
+_run_lock = threading.Lock()
+
+
+def start_run(source, budget=None):
+    """Begin the run later calls in this process are recorded under"""
+    global _run
+    with _run_lock:
+        _run = UsageRun(source, budget)
+    if budget is not None:
+        print(f"Usage ledger: run {_run.id}, budget ${budget:g}")
+    return _run
+
+
+def current_run():
+    """The run started in this process, or one named after the script when none was"""
+    global _run
+    if _run is None:
+        with _run_lock:
+            if _run is None:
+                _run = UsageRun(os.path.splitext(os.path.basename(sys.argv[0]))[0].strip('-') or 'python')
+    return _run
+
+
+def record(model, usage=None, latency_seconds=None, image_tokens=0, batch=False, error=None, tags=None):
+    """Record one call (usage is response.usage, or a dict of prompt/completion tokens) and return its cost"""
+    if isinstance(usage, dict):
+        prompt_tokens, completion_tokens = usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+    else:
+        prompt_tokens, completion_tokens = usage_tokens(usage)
+    cost = cost_of(model, prompt_tokens, completion_tokens, batch)
+    run = current_run()
+    if error is None:
+        run.charge(cost)
+    metrics.inc('api_cost_dollars_total', cost, model=model or 'unknown')
+    ledger = get_ledger()
+    if ledger is None:
+        return cost
+    tags = tags or {}
+    try:
+        ledger.add({
+            'created_at': time.time(),
+            'run': run.id,
+            'source': run.source,
+            'model': model or 'unknown',
+            'status': 'error' if error is not None else 'ok',
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'image_tokens': image_tokens or 0,
+            'latency_seconds': latency_seconds,
+            'cost': cost,
+            'batch': int(batch),
+            'document': tags.get('document'),
+            'page': tags.get('page'),
+            'question': None if tags.get('question') is None else str(tags['question']),
+            'error': None if error is None else str(error)[:500],
+        })
+    except sqlite3.Error as e:
+        # Accounting must never fail the call it accounts for
+        print(f"Usage ledger: could not record call: {e}")
+    return cost
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(max(1, math.ceil(fraction * len(ordered))), len(ordered)) - 1]
+
+
+def _distribution(label, groups):
+    """One report line with p50/p90/p99 of cost and latency over groups of calls"""
+    costs = [sum(call['cost'] for call in calls) for calls in groups.values()]
+    line = (f"{label} ({len(groups)}): cost p50 ${percentile(costs, 0.5):.4f} p90 ${percentile(costs, 0.9):.4f} "
+            f"p99 ${percentile(costs, 0.99):.4f}")
+    # Batch calls have no latency of their own
+    latencies = [sum(call['latency_seconds'] or 0 for call in calls) for calls in groups.values()
+                 if any(call['latency_seconds'] is not None for call in calls)]
+    if latencies:
+        line += (f", latency p50 {percentile(latencies, 0.5):.1f}s p90 {percentile(latencies, 0.9):.1f}s "
+                 f"p99 {percentile(latencies, 0.99):.1f}s")
+    return line
+
+
+def report(run_id=None):
+    """Lines summarizing a run's calls (default: this process's run)"""
+    ledger = get_ledger()
+    if ledger is None:
+        return []
+    run_id = run_id or current_run().id
+    calls = ledger.calls(run_id)
+    if not calls:
+        return [f"Run {run_id}: no API calls recorded"]
+    failed = [call for call in calls if call['status'] != 'ok']
+    lines = [f"Run {run_id}: {len(calls)} call(s), {len(failed)} failed, "
+             f"${sum(call['cost'] for call in calls):.4f}"]
+    models = {}
+    for call in calls:
+        models.setdefault((call['model'], bool(call['batch'])), []).append(call)
+    for (model, batch), model_calls in sorted(models.items()):
+        image_tokens = sum(call['image_tokens'] for call in model_calls)
+        lines.append(f"  {model}{' (batch)' if batch else ''}: {len(model_calls)} call(s), "
+                     f"{sum(call['prompt_tokens'] for call in model_calls)} prompt "
+                     + (f"(~{image_tokens} image) " if image_tokens else "") +
+                     f"/ {sum(call['completion_tokens'] for call in model_calls)} completion tokens, "
+                     f"${sum(call['cost'] for call in model_calls):.4f}")
+    pages, questions = {}, {}
+    for call in calls:
+        if call['page'] is not None:
+            pages.setdefault((call['document'], call['page']), []).append(call)
+        if call['question'] is not None:
+            questions.setdefault(call['question'], []).append(call)
+    if pages:
+        lines.append("  " + _distribution('Per page', pages))
+    if questions:
+        lines.append("  " + _distribution('Per question', questions))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report API usage recorded in the usage ledger")
+    parser.add_argument("--run", help="Run to report (default: the latest)")
+    parser.add_argument("--runs", type=int, metavar="N", help="List the N most recent runs instead")
+    args = parser.parse_args()
+
+    ledger = get_ledger()
+    if ledger is None:
+        print("❌ Usage ledger is disabled (USAGE_LEDGER_ENABLED=False)")
+        sys.exit(1)
+    recent = ledger.runs(args.runs or 1)
+    if args.runs:
+        for run_id, source, started, count, cost in recent:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}  {run_id:<48} "
+                  f"{count:>6} call(s)  ${cost:.4f}")
+    elif args.run or recent:
+        for line in report(args.run or recent[0][0]):
+            print(line)
+    else:
+        print(f"No API calls recorded in {ledger.path}")
@@ -0,0 +1,64 @@
+"""
+Shared OpenAI Vision OCR call used by the Flask service and the standalone converter
+"""
+import hashlib
+import os
+
+import rate_limiter
+
+OCR_MODEL = os.getenv('OCR_MODEL', 'gpt-4o')
+OCR_MAX_TOKENS = 4000
+OCR_PROMPT = "Convert this image to clean markdown text. Extract all text content while preserving structure, formatting, and hierarchy. Use proper markdown syntax for headers, lists, code blocks, and emphasis. If this appears to be an exam question, preserve the question structure and answer choices clearly."
+
+
+def prompt_hash(prompt=OCR_PROMPT):
+    """Short stable hash of a prompt, used as part of cache keys"""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+
+def vision_request(img_base64, model=OCR_MODEL, prompt=OCR_PROMPT, mime_type="image/png"):
+    """Chat completion arguments asking the vision model to transcribe one page image"""
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{img_base64}",
+                            "detail": "high"
+                        }
+                    }
+                ]
+            }
+        ],
+        max_tokens=OCR_MAX_TOKENS,
+        temperature=0.1
+    )
+
+
+def ocr_image_base64(client, img_base64, model=OCR_MODEL, prompt=OCR_PROMPT, mime_type="image/png", image_tokens=0,
+                     tags=None, timeout=None):
+    """Send a base64 encoded page image to the vision model and return the raw response.
+
+    The call is paced by the model's rate limiter; image_tokens is the
+    estimated cost of the image, which the limiter cannot tell from the payload.
+    tags (document, page) label the call in the usage ledger. timeout bounds
+    the whole call, rate-limit waits and retries included.
+    """
+    return rate_limiter.create(client, tokens=image_tokens + OCR_MAX_TOKENS, image_tokens=image_tokens, tags=tags,
+                               timeout=timeout, **vision_request(img_base64, model, prompt, mime_type))
+
+
+async def ocr_image_base64_async(client, img_base64, model=OCR_MODEL, prompt=OCR_PROMPT, mime_type="image/png",
+                                 image_tokens=0, tags=None, timeout=None):
+    """ocr_image_base64() with an AsyncOpenAI client"""
+    return await rate_limiter.create_async(client, tokens=image_tokens + OCR_MAX_TOKENS, image_tokens=image_tokens,
+                                           tags=tags, timeout=timeout,
+                                           **vision_request(img_base64, model, prompt, mime_type))
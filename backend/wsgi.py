@@ -4,7 +4,14 @@ Production startup script for Railway deployment
 """
 import os
 import sys
-from app import app
+
+# 'wsgi' runs app.py under gunicorn sync workers; 'asgi' runs asgi_app.py under
+# uvicorn, where each process holds many OCR calls in flight
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi').lower()
+
+# Importable as the WSGI entry point (gunicorn wsgi:app); the asgi launcher does not need Flask
+if SERVER_MODE != 'asgi':
+    from app import app
 
 if __name__ == '__main__':
     # Ensure we're using production settings
@@ -17,7 +24,20 @@ if __name__ == '__main__':
     print(f"Starting ExamTopics Backend on port {port}")
     print(f"Environment: {os.getenv('FLASK_ENV', 'production')}")
     print(f"Debug mode: {os.getenv('FLASK_DEBUG', 'False')}")
-    
+    print(f"Server mode: {SERVER_MODE}")
+
+    if SERVER_MODE == 'asgi':
+        import uvicorn
+        uvicorn.run(
+            'asgi_app:app',
+            host='0.0.0.0',
+            port=port,
+            workers=int(os.getenv('ASGI_WORKERS', '1')),
+            timeout_keep_alive=5,
+            log_level='info'
+        )
+        sys.exit(0)
+
     # Run with Gunicorn in production or Flask dev server locally
     if os.getenv('RAILWAY_ENVIRONMENT') == 'production':
         import gunicorn.app.wsgiapp as wsgi
@@ -98,6 +98,8 @@ export default function Labeler() {
   }, [router]);
   const [pdfFile, setPdfFile] = useState<File | null>(null);
   const [pdfUrl, setPdfUrl] = useState<string | null>(null);
+  const pdfDigestRef = useRef<string | null>(null); // SHA-256 of the uploaded PDF as stored by the backend
+  const ocrAbortRef = useRef<AbortController | null>(null); // In-flight OCR request, aborted when no longer wanted
   const [markdownContent, setMarkdownContent] = useState<string | null>(null); // Will store HTML string
   const [originalMarkdownContent, setOriginalMarkdownContent] = useState<string | null>(null); // Store original content
   const [originalContentByPage, setOriginalContentByPage] = useState<{[page: number]: string}>({}); // Store original content per page
@@ -200,6 +202,8 @@ export default function Labeler() {
     if (file) {
       setPdfFile(file);
       setPdfUrl(URL.createObjectURL(file));
+      pdfDigestRef.current = null; // New document, the backend has not seen it yet
+      ocrAbortRef.current?.abort(); // The backend stops converting pages of the old document
       setMarkdownContent(null);
       setOriginalMarkdownContent(null);
       setOriginalContentByPage({}); // Clear per-page content storage
@@ -230,15 +234,41 @@ export default function Labeler() {
     setOcrLoading(true);
     setError(null);
 
-    const formData = new FormData();
-    formData.append("pdfFile", pdfFile);
-    formData.append("pageNumber", currentPage.toString()); // Send current page number
+    // Aborting closes the connection, which makes the backend cancel the pages it is still converting
+    ocrAbortRef.current?.abort();
+    const controller = new AbortController();
+    ocrAbortRef.current = controller;
 
-    try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_PDF_CONVERSION_API_URL || 'http://localhost:5000'}/convert-pdf-ocr`, {
+    const requestOcr = (sendFile: boolean) => {
+      const formData = new FormData();
+      if (sendFile || !pdfDigestRef.current) {
+        formData.append("pdfFile", pdfFile);
+      } else {
+        // The backend already has this PDF, reference it by digest instead of re-uploading
+        formData.append("pdfDigest", pdfDigestRef.current);
+      }
+      formData.append("pageNumber", currentPage.toString()); // Send current page number
+      formData.append("prefetch", "2"); // Convert the next pages in the background for the next page turns
+
+      return fetch(`${process.env.NEXT_PUBLIC_PDF_CONVERSION_API_URL || 'http://localhost:5000'}/convert-pdf-ocr`, {
         method: "POST",
         body: formData,
+        signal: controller.signal,
       });
+    };
+
+    try {
+      let response = await requestOcr(false);
+
+      if (!response.ok) {
+        const errorData = await response.json();
+        if (response.status === 404 && errorData.error === "unknown digest") {
+          // Cached copy was evicted on the backend, upload the file again
+          response = await requestOcr(true);
+        } else {
+          throw new Error(errorData.error || "OCR conversion failed.");
+        }
+      }
 
       if (!response.ok) {
         const errorData = await response.json();
@@ -246,6 +276,9 @@ export default function Labeler() {
       }
 
       const data = await response.json();
+      if (data.digest) {
+        pdfDigestRef.current = data.digest;
+      }
       
       // Store original content without any highlights
       const tempDiv = document.createElement('div');
@@ -268,13 +301,22 @@ export default function Labeler() {
       updateHighlightedTextFromAllPages();
 
     } catch (err: any) {
+      if (err.name === "AbortError") {
+        return; // Superseded by a newer request or the page was left
+      }
       console.error("Error converting to markdown with OCR:", err);
       setError(err.message || "An unexpected error occurred during OCR conversion.");
     } finally {
-      setOcrLoading(false);
+      if (ocrAbortRef.current === controller) {
+        ocrAbortRef.current = null;
+        setOcrLoading(false);
+      }
     }
   };
 
+  // Leaving the labeler cancels any OCR still running for it
+  useEffect(() => () => ocrAbortRef.current?.abort(), []);
+
   const goToPreviousPage = () => {
     if (currentPage > 1) {
       setCurrentPage(currentPage - 1);